@@ -0,0 +1,142 @@
+import logging
+import os
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from . import constants
+from .exceptions import DefinitionError
+from .main import AnsibleBuilder, BuildResult, results_table
+from .shared_galaxy import plan_shared_galaxy_images
+
+
+logger = logging.getLogger(__name__)
+
+
+def definition_name(filename):
+    """Name used for the build context, log file and tags of a definition.
+    This is the name of the folder holding the definition when it has the
+    default file name, and the file name without extension otherwise.
+    """
+    path = os.path.abspath(filename)
+    if os.path.basename(path) == constants.default_file:
+        return os.path.basename(os.path.dirname(path))
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+class BatchBuilder:
+    """
+    Builds images for several execution environment definitions. All build
+    contexts are generated first, then the container builds run with at most
+    ``jobs`` of them at a time. Builds share the layer cache of the container
+    runtime, so layers common to several definitions are only built once.
+    """
+
+    def __init__(self,
+                 filenames,
+                 build_context=constants.default_build_context,
+                 tag=None,
+                 jobs=1,
+                 prune_images=False,
+                 shared_galaxy=False,
+                 cache_from=None,
+                 cache_to=None,
+                 **kwargs):
+        """
+        :param list filenames: Paths of the execution environment definitions.
+        :param str build_context: Directory holding one build context, and one build log, per definition.
+        :param list tag: Image tags, where {name} is replaced by the definition name.
+        :param int jobs: Maximum number of container builds running at once.
+        :param bool shared_galaxy: Install the collections and roles required by several
+            definitions once, in an image their galaxy stages start from.
+        :param list cache_from: Locations to import the layer cache from, where {name} is replaced by the definition name.
+        :param str cache_to: Location to export the layer cache to, where {name} is replaced by the definition name.
+        :param kwargs: Any other AnsibleBuilder option, applied to every definition.
+        """
+        self.build_context = build_context
+        self.jobs = jobs
+        self.prune_images = prune_images
+        self.shared_galaxy = shared_galaxy
+        self.cache_from = cache_from
+        self.cache_to = cache_to
+        self.shared_images = []
+        self.shared_results = {}  # tag of each shared image to the result of its build
+        self.results = []
+
+        self.builders = {}
+        for filename in filenames:
+            name = definition_name(filename)
+            if name in self.builders:
+                raise DefinitionError(
+                    f"Definitions {self.builders[name].definition.filename} and {filename} "
+                    f"would both be built with the name '{name}'."
+                )
+            self.builders[name] = AnsibleBuilder(
+                action='build',
+                filename=filename,
+                build_context=os.path.join(build_context, name),
+                tag=[t.format(name=name) for t in (tag or [constants.default_batch_tag])],
+                log_file=os.path.join(build_context, f'{name}.log'),
+                cache_from=[location.format(name=name) for location in cache_from or []],
+                cache_to=cache_to.format(name=name) if cache_to else None,
+                **kwargs)
+            if shared_galaxy and not self.builders[name].driver.local_base_images:
+                raise ValueError(
+                    f"--shared-galaxy may not be set with the {self.builders[name].driver.name} build driver, "
+                    "which cannot build images starting from the shared galaxy image."
+                )
+
+    def create(self):
+        if self.shared_galaxy:
+            self.shared_images = plan_shared_galaxy_images(self.builders, self.build_context,
+                                                           cache_from=self.cache_from, cache_to=self.cache_to)
+        for name, builder in self.builders.items():
+            logger.debug(f'Generating build context for {name}')
+            builder.prepare_build()
+        for image in self.shared_images:
+            logger.debug(f'Generating build context for {image.name}')
+            image.create()
+        return True
+
+    def _run_build(self, name, driver, command, env, tags, log_file, filename=None):
+        logger.info(f'Building {name}, output in {log_file}')
+        start = time.monotonic()
+        rc, _ = driver.run(
+            command, env=env, allow_error=True,
+            log_file=log_file, show_output=self.jobs <= 1, stream_output=True)
+        result = BuildResult(name, filename, tags, rc, time.monotonic() - start, log_file)
+        logger.info('Build of {0} {1} in {2:.1f}s'.format(name, 'succeeded' if result.succeeded else 'failed', result.duration))
+        return result
+
+    def _build_one(self, name):
+        builder = self.builders[name]
+        base_result = self.shared_results.get(builder.containerfile.galaxy_base_image)
+        if base_result is not None and not base_result.succeeded:
+            logger.info(f'Not building {name}, the build of {base_result.name} failed')
+            return BuildResult(name, builder.definition.filename, builder.tags, base_result.rc, 0, builder.log_file)
+        return self._run_build(name, builder.driver, builder.build_command, builder.build_env, builder.tags, builder.log_file,
+                               filename=builder.definition.filename)
+
+    def build(self):
+        """Build all images, and return True if all of the builds succeeded"""
+        self.create()
+
+        # Shared galaxy images are built first, as the builds of definitions start from them
+        with ThreadPoolExecutor(max_workers=max(self.jobs, 1)) as executor:
+            shared_results = list(executor.map(
+                lambda image: self._run_build(image.name, image.driver, image.build_command, image.build_env,
+                                              [image.tag], image.log_file),
+                self.shared_images))
+            self.shared_results = {result.tags[0]: result for result in shared_results}
+            self.results = shared_results + list(executor.map(self._build_one, self.builders))
+
+        if self.prune_images:
+            logger.debug('Removing all dangling images')
+            builder = next(iter(self.builders.values()))
+            builder.driver.run(builder.prune_image_command)
+
+        return all(result.succeeded for result in self.results)
+
+    def summary(self):
+        """Return the lines of a table of the status and duration of each build"""
+        return results_table(self.results, 'Definition')
@@ -0,0 +1,174 @@
+import re
+import time
+
+
+# podman, like [2/3] STEP 1/8: FROM ... AS builder, without the stage prefix for single stage builds
+PODMAN_STEP = re.compile(r'^(?:\[(\d+)/\d+\] )?STEP (\d+)/(\d+): (.*)$')
+# docker without BuildKit, which numbers the steps of all stages together
+DOCKER_STEP = re.compile(r'^Step (\d+)/(\d+) : (.*)$')
+# podman --> Using cache, docker ---> Using cache
+USING_CACHE = re.compile(r'^\s*-+> Using cache')
+# docker with BuildKit, like #7 [galaxy 2/4] ADD _build /build
+BUILDKIT_STEP = re.compile(r'^#(\d+) \[(\S+) (\d+)/(\d+)\] (.*)$')
+BUILDKIT_CACHED = re.compile(r'^#(\d+) CACHED$')
+BUILDKIT_DONE = re.compile(r'^#(\d+) DONE (\d+(?:\.\d+)?)s$')
+FROM_STAGE_NAME = re.compile(r'^FROM\s+\S+\s+AS\s+(\S+)', re.IGNORECASE)
+
+
+class BuildStep:
+    """A step of a container build, as reported by the container runtime"""
+
+    def __init__(self, stage, number, total, instruction):
+        self.stage = stage
+        self.number = number
+        self.total = total
+        self.instruction = instruction
+        # None for FROM steps, which are not built
+        self.cached = None if self.is_from else False
+        self.start_time = time.time()
+        self.start = time.monotonic()
+        self.end = None
+        self.duration = None
+
+    @property
+    def is_from(self):
+        return self.instruction.upper().startswith('FROM ')
+
+    def finish(self, duration=None):
+        if self.duration is None:
+            self.end = time.monotonic()
+            self.duration = self.end - self.start if duration is None else duration
+
+    def __str__(self):
+        return f'[{self.stage} {self.number}/{self.total}] {self.instruction}'
+
+
+class BuildOutputParser:
+    """Follows the steps of a container build from its output lines, for the
+    output of podman, and of docker with or without BuildKit.
+
+    Use an instance as the on_output callback of run_command(), then call finish().
+    Steps are reported to on_step, if given, once they are complete.
+    """
+
+    def __init__(self, on_step=None):
+        self.on_step = on_step
+        self.steps = []
+        self.current = None  # podman and docker without BuildKit run one step at a time
+        self.vertices = {}  # BuildKit step number to BuildStep
+        self.stage_names = {}  # stage number to the name given by FROM ... AS
+        self.stage_count = 0  # stages seen in docker output without BuildKit
+
+    def __call__(self, line):
+        line = line.rstrip()
+        match = PODMAN_STEP.match(line)
+        if match:
+            stage_number, number, total, instruction = match.groups()
+            if stage_number is None:
+                stage_number = '1'
+            self._start_step(self._stage(stage_number, instruction), number, total, instruction)
+            return
+
+        match = DOCKER_STEP.match(line)
+        if match:
+            number, total, instruction = match.groups()
+            if instruction.upper().startswith('FROM ') or not self.stage_count:
+                self.stage_count += 1
+            self._start_step(self._stage(str(self.stage_count), instruction), number, total, instruction)
+            return
+
+        if USING_CACHE.match(line):
+            if self.current is not None:
+                self.current.cached = True
+            return
+
+        match = BUILDKIT_STEP.match(line)
+        if match:
+            vertex, stage, number, total, instruction = match.groups()
+            if vertex not in self.vertices:
+                step = BuildStep(stage, int(number), int(total), instruction)
+                self.vertices[vertex] = step
+                self.steps.append(step)
+            return
+
+        match = BUILDKIT_CACHED.match(line)
+        if match and match.group(1) in self.vertices:
+            step = self.vertices[match.group(1)]
+            step.cached = True
+            self._finish_step(step)
+            return
+
+        match = BUILDKIT_DONE.match(line)
+        if match and match.group(1) in self.vertices:
+            self._finish_step(self.vertices[match.group(1)], float(match.group(2)))
+
+    def _stage(self, stage_number, instruction):
+        name_match = FROM_STAGE_NAME.match(instruction)
+        if name_match:
+            self.stage_names[stage_number] = name_match.group(1)
+        return self.stage_names.get(stage_number, stage_number)
+
+    def _start_step(self, stage, number, total, instruction):
+        if self.current is not None:
+            self._finish_step(self.current)
+        self.current = BuildStep(stage, int(number), int(total), instruction)
+        self.steps.append(self.current)
+
+    def _finish_step(self, step, duration=None):
+        if step.duration is not None:
+            return
+        step.finish(duration)
+        if self.on_step is not None:
+            self.on_step(step)
+
+    def finish(self):
+        """Complete the steps still running when the output ended"""
+        for step in self.steps:
+            self._finish_step(step)
+        self.current = None
+
+    def stages(self):
+        """Return a dict of stage name to the list of its steps, in the order stages started"""
+        stages = {}
+        for step in self.steps:
+            stages.setdefault(step.stage, []).append(step)
+        return stages
+
+    def cache_misses(self):
+        """Return the steps which were built rather than taken from the layer cache"""
+        return [step for step in self.steps if step.cached is False]
+
+    def summary(self):
+        """Return lines describing which steps of each stage missed the layer cache.
+        The first miss of a stage is the step invalidating the cache for the rest of the stage.
+        """
+        lines = []
+        built = [step for step in self.steps if step.cached is not None]
+        if not built:
+            return lines
+        misses = self.cache_misses()
+        lines.append(f'Layer cache: {len(built) - len(misses)} of {len(built)} steps cached')
+        for stage, steps in self.stages().items():
+            stage_misses = [step for step in steps if step.cached is False]
+            if not stage_misses:
+                continue
+            first = stage_misses[0]
+            lines.append(
+                f'  stage {stage}: {len(stage_misses)} steps built, starting with step {first.number}/{first.total} '
+                f'({first.duration or 0:.1f}s): {first.instruction}'
+            )
+        return lines
+
+    def record(self, timings, parent=None):
+        """Record a span for each stage of the build, and for each of its steps, in timings"""
+        for stage, steps in self.stages().items():
+            ended = [step for step in steps if step.end is not None]
+            if not ended:
+                continue
+            start = min(step.start for step in steps)
+            start_time = min(step.start_time for step in steps)
+            duration = max(step.end for step in ended) - start
+            span = timings.add_span('build.stage', start_time, duration, parent=parent, stage=stage)
+            for step in steps:
+                timings.add_span('build.step', step.start_time, step.duration or 0, parent=span,
+                                 stage=stage, step=step.number, instruction=step.instruction, cached=step.cached)
@@ -1,19 +1,18 @@
 import argparse
 import logging
 import sys
-import yaml
 import os
-import pkg_resources
 
 from . import constants
 
 from .colors import MessageColors
+from .drivers import DRIVERS, RecordingDriver
 from .exceptions import DefinitionError
-from .main import AnsibleBuilder
-from .introspect import process, simple_combine, base_collections_path
-from .requirements import sanitize_requirements
 from .utils import configure_logger, write_file
 
+# Modules needed by a single sub-command are imported where the sub-command
+# runs, so that the other sub-commands, and introspect in particular, start fast.
+
 
 logger = logging.getLogger(__name__)
 
@@ -23,6 +22,8 @@ def run():
     configure_logger(args.verbosity)
 
     if args.action in ['create', 'build']:
+        from .main import AnsibleBuilder
+
         ab = AnsibleBuilder(**vars(args))
         action = getattr(ab, ab.action)
         try:
@@ -35,14 +36,66 @@ def run():
         except DefinitionError as e:
             logger.error(e.args[0])
             sys.exit(1)
+        finally:
+            ab.write_timings()
+
+    elif args.action == 'build-many':
+        from .batch import BatchBuilder
+
+        try:
+            batch = BatchBuilder(**{k: v for k, v in vars(args).items() if k != 'action'})
+            succeeded = batch.build()
+        except DefinitionError as e:
+            logger.error(e.args[0])
+            sys.exit(1)
+        for line in batch.summary():
+            print(line)
+        if succeeded:
+            print(
+                MessageColors.OKGREEN + "Complete! The build contexts can be found at: {0}".format(
+                    os.path.abspath(batch.build_context)
+                ) + MessageColors.ENDC)
+            sys.exit(0)
+        logger.error('One or more builds failed, see the build logs for details.')
+        sys.exit(1)
+
+    elif args.action == 'lock':
+        from .exceptions import LockError
+        from .lock import lock_requirements
+
+        try:
+            lines = lock_requirements(args.requirements_file, find_links=args.find_links or (), index_url=args.index_url,
+                                      python_version=args.python_version, platform=args.platform)
+        except LockError as e:
+            logger.error(e.args[0])
+            sys.exit(1)
+        write_file(args.output, lines + [''])
+        print(MessageColors.OKGREEN + "Complete! The lock file can be found at: {0}".format(
+            os.path.abspath(args.output)) + MessageColors.ENDC)
+        sys.exit(0)
 
     elif args.action == 'introspect':
-        data = process(args.folder, user_pip=args.user_pip, user_bindep=args.user_bindep)
+        import yaml
+        from .introspect import process, simple_combine, default_cache_dir
+        from .requirements import sanitize_requirements
+        from .system_requirements import detect_platform_profiles, sanitize_system_requirements
+        from .timings import Timings
+
+        timings = Timings()
+        cache_dir = (args.cache_dir or default_cache_dir()) if (args.cache or args.cache_dir) else None
+        with timings.span('introspect.collections'):
+            data = process(args.folder, user_pip=args.user_pip, user_bindep=args.user_bindep, jobs=args.jobs, cache_dir=cache_dir)
         if args.sanitize:
             logger.info('# Sanitized dependencies for {0}'.format(args.folder))
             data_for_write = data
-            data['python'] = sanitize_requirements(data['python'])
-            data['system'] = simple_combine(data['system'])
+            with timings.span('introspect.sanitize'):
+                try:
+                    data['python'] = sanitize_requirements(data['python'])
+                except DefinitionError as e:
+                    logger.error(e.args[0])
+                    sys.exit(1)
+                platforms = detect_platform_profiles() if args.detect_platform else None
+                data['system'] = sanitize_system_requirements(data['system'], platforms=platforms)
         else:
             logger.info('# Dependency data for {0}'.format(args.folder))
             data_for_write = data.copy()
@@ -57,6 +110,7 @@ def run():
         if args.write_bindep and data.get('system'):
             write_file(args.write_bindep, data_for_write.get('system') + [''])
 
+        timings.write(args.timings, args.trace_file)
         sys.exit(0)
 
     logger.error("An error has occured.")
@@ -64,7 +118,20 @@ def run():
 
 
 def get_version():
-    return pkg_resources.get_distribution('ansible_builder').version
+    from importlib.metadata import version
+
+    return version('ansible-builder')
+
+
+class VersionAction(argparse.Action):
+    """Like the 'version' action, but only looks up the version when the option is used"""
+
+    def __init__(self, option_strings, dest=argparse.SUPPRESS, default=argparse.SUPPRESS, help=None):
+        super().__init__(option_strings=option_strings, dest=dest, default=default, nargs=0, help=help)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        parser._print_message(get_version() + '\n', sys.stdout)
+        parser.exit()
 
 
 def add_container_options(parser):
@@ -92,6 +159,40 @@ def add_container_options(parser):
         )
     )
 
+    build_many_command_parser = parser.add_parser(
+        'build-many',
+        help='Builds container images for several execution environment definitions.',
+        description=(
+            'Creates a build context for each of the given execution environment definitions, '
+            'then builds their images with the specified container runtime, running up to --jobs '
+            'builds at once. The output of each build is written to a log file next to its build context, '
+            'and the status and duration of every build is reported at the end.'
+        )
+    )
+
+    build_many_command_parser.add_argument(
+        'filenames', nargs='+', metavar='definition',
+        help='Execution environment definition files. Each one is built with a name taken from its '
+             'folder for files named {0}, and from the file name otherwise.'.format(constants.default_file))
+
+    build_many_command_parser.add_argument(
+        '--shared-galaxy',
+        action='store_true',
+        help='Install the collections and roles required by all definitions with the same base image '
+             'and galaxy options once, in an image their galaxy stages start from. Each definition then '
+             'only installs the rest of its galaxy requirements.')
+
+    build_many_command_parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=1,
+        help='Number of container builds to run at once (default: %(default)s)')
+
+    create_command_parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Do not use the introspection cache of --introspect-on-host')
+
     # Because of the way argparse works, if we specify the default here, it would
     # always be included in the value list if a tag value was supplied. We don't want
     # that, so we must, instead, set the default AFTER the argparse.parse_args() call.
@@ -102,33 +203,85 @@ def add_container_options(parser):
         nargs='+',
         help=f'The name(s) for the container image being built (default: {constants.default_tag})')
 
-    build_command_parser.add_argument(
-        '--container-runtime',
-        choices=list(constants.runtime_files.keys()),
-        default=constants.default_container_runtime,
-        help='Specifies which container runtime to use (default: %(default)s)')
-
-    build_command_parser.add_argument(
-        '--build-arg',
-        action=BuildArgAction,
-        default={},
-        dest='build_args',
-        help='Build-time variables to pass to any podman or docker calls. '
-             'Internally ansible-builder makes use of {0}.'.format(
-             ', '.join(constants.build_arg_defaults.keys())))
+    build_many_command_parser.add_argument(
+        '-t', '--tag',
+        action='extend',
+        nargs='+',
+        help='The name(s) for the container images being built, where {name} is replaced by the '
+             f'name of each definition (default: {constants.default_batch_tag})')
 
     build_command_parser.add_argument(
-        '--no-cache',
-        action='store_true',
-        help='Do not use cache when building the image',
+        '--log-file',
+        help='Write the full output of the container build to this file',
     )
 
     build_command_parser.add_argument(
-        '--prune-images',
-        action='store_true',
-        help='Remove all dangling images after building the image',
+        '--platform',
+        action='append',
+        dest='platforms',
+        help='Build the image for this platform, like linux/arm64. May be specified multiple times, '
+             'in which case an image is built for each platform at once, tagged with the platform name '
+             'appended to the tag, and with podman, the tags name a manifest list of these images.',
     )
 
+    for p in [build_command_parser, build_many_command_parser]:
+
+        p.add_argument(
+            '--container-runtime',
+            choices=list(constants.runtime_files.keys()),
+            default=None,
+            help='Specifies which container runtime to use (default: {0} if it is installed, docker otherwise)'.format(
+                constants.default_container_runtime))
+
+        p.add_argument(
+            '--build-driver',
+            choices=[name for name in DRIVERS if name != RecordingDriver.name],
+            default=None,
+            help='Tool building the images: podman, docker, buildah (bud, images are stored for podman) or '
+                 'buildx (docker buildx with BuildKit, images are loaded into docker). '
+                 '(default: the container runtime)')
+
+        p.add_argument(
+            '--squash',
+            action='store_true',
+            help='Squash the layers added by the build into one, with podman and buildah')
+
+        p.add_argument(
+            '--cache-from',
+            action='append',
+            metavar='LOCATION',
+            help='Import the layer cache from this image repository, like quay.io/org/ee-cache, or with the buildx '
+                 'build driver, from this local directory. May be specified multiple times. '
+                 'With build-many, {name} is replaced by the name of each definition.')
+
+        p.add_argument(
+            '--cache-to',
+            metavar='LOCATION',
+            help='Export the layer cache to this image repository, or with the buildx build driver, to this local '
+                 'directory, for later builds to import with --cache-from. '
+                 'With build-many, {name} is replaced by the name of each definition.')
+
+        p.add_argument(
+            '--build-arg',
+            action=BuildArgAction,
+            default={},
+            dest='build_args',
+            help='Build-time variables to pass to any podman or docker calls. '
+                 'Internally ansible-builder makes use of {0}.'.format(
+                 ', '.join(constants.build_arg_defaults.keys())))
+
+        p.add_argument(
+            '--no-cache',
+            action='store_true',
+            help='Do not use cache when building the image, nor the introspection cache of --introspect-on-host',
+        )
+
+        p.add_argument(
+            '--prune-images',
+            action='store_true',
+            help='Remove all dangling images after building the image',
+        )
+
     for p in [create_command_parser, build_command_parser]:
 
         p.add_argument('-f', '--file',
@@ -136,6 +289,18 @@ def add_container_options(parser):
                        dest='filename',
                        help='The definition of the execution environment (default: %(default)s)')
 
+        p.add_argument('--timings',
+                       nargs='?',
+                       const='-',
+                       metavar='FILE',
+                       help='Write a JSON report of the duration of each phase, including the stages of the '
+                            'container build, to FILE, or to stdout if no file is given')
+
+        p.add_argument('--trace-file',
+                       help='Append the timed phases to this file as OpenTelemetry spans in JSON, one per line')
+
+    for p in [create_command_parser, build_command_parser, build_many_command_parser]:
+
         p.add_argument('-c', '--context',
                        default=constants.default_build_context,
                        dest='build_context',
@@ -160,6 +325,64 @@ def add_container_options(parser):
                        help='The number of signatures that must successfully verify collections from '
                        'ansible-galaxy ~if there are any signatures provided~. See ansible-galaxy doc for more info.')
 
+        p.add_argument('--split-context',
+                       action='store_true',
+                       help='Add each dependency file to the image right before the step that uses it, '
+                            'instead of adding the whole build context folder before installing collections. '
+                            'Changes to Python or system requirements then do not invalidate the cached collection install.')
+
+        p.add_argument('--cache-mounts',
+                       action='store_true',
+                       help='Mount the persistent pip cache of downloaded and built packages, and the ansible-galaxy cache '
+                            'of Galaxy API responses, into the RUN steps that use them. '
+                            'Requires docker with BuildKit or podman 4 or later.')
+
+        p.add_argument('--prefetch-collections',
+                       action='store_true',
+                       help='Download the collection tarballs of the galaxy requirements on the host, through a cache, '
+                            'and install collections from copies of them in the build context. Requires ansible-galaxy '
+                            'on the host.')
+
+        p.add_argument('--staging',
+                       choices=constants.staging_strategies,
+                       default=constants.default_staging,
+                       help='How files of the definition are placed in the build context. reflink and hardlink '
+                            'fall back to a copy when the build context is on another filesystem, or the filesystem '
+                            'does not support them. auto tries a reflink, then a hardlink (default: %(default)s)')
+
+        p.add_argument('--prune-context',
+                       action='store_true',
+                       help='Remove the files ansible-builder wrote to the _build folder of the build context in a '
+                            'previous run, and which are no longer used, and write an ignore file leaving the other '
+                            'files it no longer uses out of the build context. Files it did not write are kept.')
+
+        p.add_argument('--introspect-on-host',
+                       action='store_true',
+                       help='Combine the requirements of collections on the host, and add the result to the build context, '
+                            'instead of running ansible-builder introspect in the builder stage. Collections are installed '
+                            'into a temporary directory for this, unless --collections-path is given. '
+                            'Requires ansible-galaxy on the host.')
+
+        p.add_argument('--detect-platform',
+                       action='store_true',
+                       help='Drop the system requirements that cannot apply to the platform of the builder image '
+                            '(EE_BUILDER_IMAGE) when combining requirements in the builder stage. Use it when the '
+                            'builder image and the base image share a platform. Requires an ansible-builder '
+                            'supporting introspect --detect-platform in the builder image.')
+
+        p.add_argument('--cache-dir',
+                       dest='introspect_cache_dir',
+                       help='Directory used to cache requirements of installed collections with --introspect-on-host '
+                            '(default: $XDG_CACHE_HOME/ansible-builder/introspect)')
+
+        p.add_argument('--lock-file',
+                       help='Python requirements pinned by the lock command. They replace the Python requirements '
+                            'of collections and of the definition, and are installed without dependency resolution.')
+
+        p.add_argument('--collections-path',
+                       help='Directory of already installed collections (holding an ansible_collections folder) '
+                            'to introspect on the host. Implies --introspect-on-host.')
+
     introspect_parser = parser.add_parser(
         'introspect',
         help='Introspects collections in folder.',
@@ -173,9 +396,12 @@ def add_container_options(parser):
                                    help=('Sanitize and de-duplicate requirements. '
                                          'This is normally done separately from the introspect script, but this '
                                          'option is given to more accurately test collection content.'))
+    introspect_parser.add_argument('--detect-platform', action='store_true',
+                                   help=('With --sanitize, drop system requirements that cannot apply to the '
+                                         'platform this command runs on.'))
 
     introspect_parser.add_argument(
-        'folder', default=base_collections_path, nargs='?',
+        'folder', default=constants.base_collections_path, nargs='?',
         help=(
             'Ansible collections path(s) to introspect. '
             'This should have a folder named ansible_collections inside of it.'
@@ -200,8 +426,75 @@ def add_container_options(parser):
         '--write-bindep', dest='write_bindep',
         help='Write the combined bindep file to this location.'
     )
+    introspect_parser.add_argument(
+        '-j', '--jobs', dest='jobs',
+        type=int,
+        default=1,
+        help='Number of collections to read concurrently (default: %(default)s)'
+    )
+    introspect_parser.add_argument(
+        '--timings',
+        nargs='?',
+        const='-',
+        metavar='FILE',
+        help='Write a JSON report of the duration of reading the collections and of sanitizing their requirements '
+             'to FILE, or to stdout if no file is given'
+    )
+    introspect_parser.add_argument(
+        '--trace-file',
+        help='Append the timed phases to this file as OpenTelemetry spans in JSON, one per line'
+    )
+    introspect_parser.add_argument(
+        '--cache', dest='cache',
+        action='store_true',
+        help='Cache requirements of installed collections on disk, for repeated introspection of the same collections'
+    )
+    introspect_parser.add_argument(
+        '--cache-dir', dest='cache_dir',
+        help='Directory used to cache requirements of installed collections. Implies --cache '
+             '(default: $XDG_CACHE_HOME/ansible-builder/introspect)'
+    )
+
+    lock_parser = parser.add_parser(
+        'lock',
+        help='Pins Python requirements to exact versions and hashes.',
+        description=(
+            'Resolves the Python requirements written by the introspect command (with --sanitize and --write-pip) '
+            'against a local directory of wheels or a package index, and writes a requirements file pinning '
+            'every package, including dependencies, by version and sha256 hash. '
+            'Give it to the create or build command with --lock-file so pip does not have to resolve them again '
+            'during the image build.'
+        )
+    )
+    lock_parser.add_argument(
+        'requirements_file',
+        help='The Python requirements to lock.'
+    )
+    lock_parser.add_argument(
+        '-o', '--output',
+        default=constants.default_lock_file_name,
+        help='Write the lock file to this location (default: %(default)s)'
+    )
+    lock_parser.add_argument(
+        '--find-links', dest='find_links',
+        action='append',
+        help='A directory of wheels and sdists to resolve against. May be specified multiple times.'
+    )
+    lock_parser.add_argument(
+        '--index-url', dest='index_url',
+        help='A simple repository index to resolve against. Resolution is done offline if unset.'
+    )
+    lock_parser.add_argument(
+        '--python-version', dest='python_version',
+        help='The Python version of the image, if different from the one running ansible-builder (e.g. 3.9).'
+    )
+    lock_parser.add_argument(
+        '--platform',
+        help='The wheel platform tag of the image, if different from the one running ansible-builder '
+             '(e.g. manylinux2014_x86_64).'
+    )
 
-    for n in [create_command_parser, build_command_parser, introspect_parser]:
+    for n in [create_command_parser, build_command_parser, build_many_command_parser, introspect_parser, lock_parser]:
 
         n.add_argument('-v', '--verbosity',
                        dest='verbosity',
@@ -223,7 +516,7 @@ def parse_args(args=sys.argv[1:]):
         )
     )
     parser.add_argument(
-        '--version', action='version', version=get_version(),
+        '--version', action=VersionAction,
         help='Print ansible-builder version and exit.'
     )
 
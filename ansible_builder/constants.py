@@ -1,13 +1,20 @@
-import shutil
-
 default_file = 'execution-environment.yml'
 default_tag = 'ansible-execution-env:latest'
+# {name} is replaced by the name of each definition built with build-many
+default_batch_tag = 'ansible-execution-env-{name}:latest'
+# Image holding the collections shared by several definitions, see build-many --shared-galaxy
+shared_galaxy_tag = 'ansible-builder-galaxy:{digest}'
 default_build_context = 'context'
 default_verbosity = 2
 runtime_files = {
     'podman': 'Containerfile',
     'docker': 'Dockerfile'
 }
+runtime_ignore_files = {
+    'podman': '.containerignore',
+    'docker': '.dockerignore'
+}
+# Used if it is installed, otherwise docker is. See utils.detect_container_runtime().
 default_container_runtime = 'podman'
 base_roles_path = '/usr/share/ansible/roles'
 base_collections_path = '/usr/share/ansible/collections'
@@ -19,13 +26,33 @@ build_arg_defaults = dict(
 )
 
 user_content_subfolder = '_build'
+# Record of the files written to the build context, kept at its top level
+context_manifest_name = 'ansible-builder-manifest.json'
+context_manifest_version = 1
 
-if shutil.which('podman'):
-    default_container_runtime = 'podman'
-else:
-    default_container_runtime = 'docker'
+# How files of the definition are placed in the build context, see utils.stage_file().
+# auto tries a reflink, then a hardlink, before copying.
+staging_strategies = ('copy', 'reflink', 'hardlink', 'auto')
+default_staging = 'copy'
 
 default_keyring_name = 'keyring.gpg'
+default_lock_file_name = 'requirements.lock'
+# Folder of _build holding the collection tarballs of --prefetch-collections
+prefetched_collections_folder = 'collections'
+
+# Caches mounted into RUN steps with --cache-mounts, with their mount target and sharing
+# mode. Tools that cannot share a cache concurrently get 'locked'.
+# pip keeps downloaded and built packages in its cache. ansible-galaxy only keeps the
+# responses of the Galaxy API in its own, collection tarballs are downloaded on every
+# install (see --prefetch-collections). dnf is left out, as it drops the packages it
+# downloads unless keepcache is set in the dnf.conf of the image.
+CACHE_MOUNTS = {
+    'pip': ('/root/.cache/pip', 'shared'),
+    'galaxy': ('/root/.ansible/galaxy_cache', 'locked'),
+}
+# Minimum major version of podman supporting RUN --mount=type=cache
+podman_cache_mount_min_version = 4
+buildah_cache_mount_min_version = (1, 24)
 
 # Files that need to be moved into the build context, and their naming inside the context
 CONTEXT_FILES = {
@@ -33,3 +60,14 @@ CONTEXT_FILES = {
     'python': 'requirements.txt',
     'system': 'bindep.txt',
 }
+
+# Directories that are copied into the build context, and their naming inside the context
+CONTEXT_DIRECTORIES = {
+    'wheels': 'wheels',
+}
+
+# Combined collection and user requirements, when introspection is done on the host
+INTROSPECTED_FILES = {
+    'python': 'requirements-combined.txt',
+    'system': 'bindep-combined.txt',
+}
@@ -0,0 +1,266 @@
+import logging
+import os
+import re
+import sys
+
+from . import constants
+from .utils import detect_container_runtime, run_command
+
+
+logger = logging.getLogger(__name__)
+
+
+def is_local_cache(location):
+    """Return True if a cache location of --cache-from or --cache-to is a local directory rather than an image"""
+    return location.startswith(('/', './', '../', '~')) or location == '.'
+
+
+class BuildDriver:
+    """
+    Builds images with a container tool. Drivers differ in the commands they
+    run and in the features these commands support, which the capability
+    flags describe, so that ansible-builder can leave out what a driver does
+    not support.
+    """
+
+    name = None
+    # Runtime the images are built for, which sets the name of the Containerfile and of the ignore file
+    runtime = None
+    # Supports RUN --mount=type=cache
+    cache_mounts = True
+    # Can import and export the layer cache, with --cache-from and --cache-to
+    cache_export = False
+    # Can squash the layers of the image into one with --squash
+    squash = False
+    # Can create manifest lists from local images, for builds for several platforms
+    manifest_lists = False
+    # Later builds can start from the images it builds without pushing them, see build-many --shared-galaxy
+    local_base_images = True
+    # Minimum version of the tool supporting cache mounts, if it depends on the version
+    cache_mount_min_version = None
+
+    @property
+    def executable(self):
+        return self.runtime
+
+    def build_prefix(self):
+        """The command building an image, without its options"""
+        return [self.executable, 'build']
+
+    def build_command(self, containerfile, context, tags=(), build_args=None, platform=None, no_cache=False,
+                      squash=False, cache_from=(), cache_to=None):
+        command = self.build_prefix() + ['-f', containerfile]
+
+        if platform:
+            command.extend(['--platform', platform])
+
+        for tag in tags:
+            command.extend(['-t', tag])
+
+        for key, value in (build_args or {}).items():
+            if value:
+                build_arg = f"--build-arg={key}={value}"
+            else:
+                build_arg = f"--build-arg={key}"
+
+            command.append(build_arg)
+
+        if squash:
+            command.append('--squash')
+
+        command.extend(self.cache_options(cache_from, cache_to))
+
+        command.append(context)
+
+        if no_cache:
+            command.append('--no-cache')
+
+        return command
+
+    def build_env(self, cache_mounts=False):
+        """Environment of the build command, None to use the current one"""
+        return None
+
+    def cache_options(self, cache_from=(), cache_to=None):
+        """Options importing the layer cache from the cache_from locations, and exporting it to cache_to.
+        Layers can only be imported from, and exported to, image repositories, like quay.io/org/ee-cache.
+        """
+        for location in list(cache_from) + [cache_to]:
+            if location and is_local_cache(location):
+                raise ValueError(f"{self.name} cannot import or export the layer cache from the directory {location}")
+        options = []
+        for location in cache_from:
+            options.extend(['--cache-from', location])
+        if cache_to:
+            options.extend(['--cache-to', cache_to])
+        return options
+
+    def prune_command(self):
+        return [self.executable, 'image', 'prune', '--force']
+
+    def manifest_commands(self, tag, images):
+        """Commands creating a manifest list named tag from local images"""
+        commands = [[self.executable, 'manifest', 'create', tag]]
+        for image in images:
+            commands.append([self.executable, 'manifest', 'add', tag, f'containers-storage:{image}'])
+        return commands
+
+    def manifest_remove_command(self, tag):
+        return [self.executable, 'manifest', 'rm', tag]
+
+    def version(self):
+        """Return the version of the tool as a tuple of integers, or None if it is unknown"""
+        rc, output = self.run([self.executable, '--version'], capture_output=True, allow_error=True)
+        match = re.search(r'version (\d+)\.(\d+)', '\n'.join(output)) if rc == 0 else None
+        return (int(match.group(1)), int(match.group(2))) if match else None
+
+    def supports_cache_mounts(self):
+        if not self.cache_mounts:
+            return False
+        if self.cache_mount_min_version is None:
+            return True
+        version = self.version()
+        return version is not None and version >= self.cache_mount_min_version
+
+    def run(self, command, **kwargs):
+        """Run a command of the tool, with the options of utils.run_command()"""
+        return run_command(command, **kwargs)
+
+
+class PodmanDriver(BuildDriver):
+    name = 'podman'
+    runtime = 'podman'
+    cache_export = True
+    squash = True
+    manifest_lists = True
+    cache_mount_min_version = (constants.podman_cache_mount_min_version, 0)
+
+
+class BuildahDriver(BuildDriver):
+    """Builds with buildah, which does not need a daemon or podman. Images end up in the podman image store."""
+
+    name = 'buildah'
+    runtime = 'podman'
+    cache_export = True
+    squash = True
+    manifest_lists = True
+    cache_mount_min_version = constants.buildah_cache_mount_min_version
+
+    @property
+    def executable(self):
+        return 'buildah'
+
+    def build_prefix(self):
+        return ['buildah', 'bud']
+
+    def prune_command(self):
+        return ['buildah', 'rmi', '--prune']
+
+
+class DockerDriver(BuildDriver):
+    name = 'docker'
+    runtime = 'docker'
+
+    def build_env(self, cache_mounts=False):
+        if cache_mounts:
+            # RUN --mount requires BuildKit, which is not the default on older docker versions
+            return dict(os.environ, DOCKER_BUILDKIT='1')
+        return None
+
+
+class BuildxDriver(BuildDriver):
+    """Builds with docker buildx, and so always with BuildKit"""
+
+    name = 'buildx'
+    runtime = 'docker'
+    cache_export = True
+    # The builder of a buildx instance cannot start from images loaded into docker
+    local_base_images = False
+
+    @property
+    def executable(self):
+        return 'docker'
+
+    def build_prefix(self):
+        # Load the image into docker, rather than only leaving it in the build cache
+        return ['docker', 'buildx', 'build', '--load']
+
+    def cache_options(self, cache_from=(), cache_to=None):
+        """Options importing the layer cache from the cache_from locations, and exporting it to cache_to.
+        Locations are images, like quay.io/org/ee-cache:latest, or local directories, in the OCI layout.
+        Complete BuildKit cache options, like type=gha, are passed as they are.
+        """
+        options = []
+        for location in cache_from:
+            if 'type=' not in location:
+                if is_local_cache(location):
+                    location = f'type=local,src={os.path.expanduser(location)}'
+                else:
+                    location = f'type=registry,ref={location}'
+            options.extend(['--cache-from', location])
+        if cache_to:
+            if 'type=' not in cache_to:
+                # mode=max also exports the layers of the galaxy and builder stages
+                if is_local_cache(cache_to):
+                    cache_to = f'type=local,dest={os.path.expanduser(cache_to)},mode=max'
+                else:
+                    cache_to = f'type=registry,ref={cache_to},mode=max'
+            options.extend(['--cache-to', cache_to])
+        return options
+
+
+class RecordingDriver(BuildDriver):
+    """
+    Records the commands it is given instead of running them, and supports
+    every feature, for tests and to see the commands of a build.
+    """
+
+    name = 'recording'
+    cache_export = True
+    squash = True
+    manifest_lists = True
+
+    def __init__(self, runtime=constants.default_container_runtime, rc=0, output=()):
+        """
+        :param str runtime: Runtime the images are built for.
+        :param int rc: Return code of every command.
+        :param list output: Lines of output of every command.
+        """
+        self.runtime = runtime
+        self.rc = rc
+        self.output = list(output)
+        self.commands = []
+
+    def run(self, command, capture_output=False, allow_error=False, on_output=None, **kwargs):
+        self.commands.append(command)
+        logger.info('Not running command:')
+        logger.info('  {0}'.format(' '.join(command)))
+        if on_output is not None:
+            for line in self.output:
+                on_output(line)
+        if self.rc != 0 and not allow_error:
+            sys.exit(1)
+        return self.rc, list(self.output) if capture_output else []
+
+
+DRIVERS = {driver.name: driver for driver in (PodmanDriver, DockerDriver, BuildahDriver, BuildxDriver, RecordingDriver)}
+
+
+def get_driver(driver=None, container_runtime=None):
+    """Return the BuildDriver to build images with.
+
+    :param driver: A BuildDriver, or the name of one. By default, the driver of the container runtime.
+    :param str container_runtime: Runtime the images are built for. By default, the runtime of the driver,
+        or podman if it is installed and docker otherwise when no driver is given.
+    """
+    if not isinstance(driver, BuildDriver):
+        name = driver or container_runtime or detect_container_runtime()
+        if name not in DRIVERS:
+            raise ValueError(f"Unknown build driver {name}, expected one of: {', '.join(DRIVERS)}")
+        if name == RecordingDriver.name:
+            driver = RecordingDriver(runtime=container_runtime or constants.default_container_runtime)
+        else:
+            driver = DRIVERS[name]()
+    if container_runtime and driver.runtime != container_runtime:
+        raise ValueError(f"The {driver.name} build driver builds images for {driver.runtime}, not {container_runtime}")
+    return driver
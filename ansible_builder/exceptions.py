@@ -8,3 +8,11 @@ class DefinitionError(RuntimeError):
     def __init__(self, msg):
         super(DefinitionError, self).__init__("%s" % msg)
         self.msg = msg
+
+
+class LockError(RuntimeError):
+    """Python requirements could not be locked"""
+
+
+class RequirementConflictError(DefinitionError):
+    """The version specifiers of a Python requirement have no version in common"""
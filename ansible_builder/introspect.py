@@ -1,9 +1,23 @@
+import hashlib
+import json
 import os
 import yaml
 
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from .utils import user_cache_dir
+
 
 base_collections_path = '/usr/share/ansible/collections'
 default_file = 'execution-environment.yml'
+default_cache_max_entries = 2000
+# Bump this when the structure of cached entries changes
+CACHE_VERSION = 3
+
+
+def default_cache_dir():
+    return user_cache_dir('introspect')
 
 
 def line_is_empty(line):
@@ -18,8 +32,14 @@ def read_req_file(path):
         return f.read()
 
 
-def pip_file_data(path):
+def pip_file_data(path, read_files=None):
+    """Return the requirement lines of a pip requirements file, and of the files it includes.
+
+    :param list read_files: If given, the path of every file read is appended to it.
+    """
     pip_content = read_req_file(path)
+    if read_files is not None:
+        read_files.append(path)
 
     pip_lines = []
     for line in pip_content.split('\n'):
@@ -28,7 +48,7 @@ def pip_file_data(path):
         if line.startswith('-r') or line.startswith('--requirement'):
             _, new_filename = line.split(None, 1)
             new_path = os.path.join(os.path.dirname(path or '.'), new_filename)
-            pip_lines.extend(pip_file_data(new_path))
+            pip_lines.extend(pip_file_data(new_path, read_files=read_files))
         else:
             pip_lines.append(line)
 
@@ -47,29 +67,62 @@ def bindep_file_data(path):
     return sys_lines
 
 
-def process_collection(path):
-    """Return a tuple of (python_dependencies, system_dependencies) for the
-    collection install path given.
-    Both items returned are a list of dependencies.
+CollectionRequirements = namedtuple('CollectionRequirements', [
+    'path',         # root directory of the collection
+    'namespace',
+    'name',
+    'python',       # list of python requirement lines
+    'system',       # list of bindep requirement lines
+    'python_file',  # python requirements file, relative to path, or None
+    'system_file',  # bindep requirements file, relative to path, or None
+    'files',        # files the requirements depend on, relative to path, including -r includes
+], defaults=((),))
+
+
+def introspect_collection(path):
+    """Return the CollectionRequirements for the collection install path given.
+    The collection metadata is only read once.
 
     :param str path: root directory of collection (this would contain galaxy.yml file)
     """
     CD = CollectionDefinition(path)
+    namespace, name = CD.namespace_name()
 
+    read_files = []
     py_file = CD.get_dependency('python')
     pip_lines = []
     if py_file:
-        pip_lines = pip_file_data(os.path.join(path, py_file))
+        pip_lines = pip_file_data(os.path.join(path, py_file), read_files=read_files)
 
     sys_file = CD.get_dependency('system')
     bindep_lines = []
     if sys_file:
         bindep_lines = bindep_file_data(os.path.join(path, sys_file))
+        read_files.append(os.path.join(path, sys_file))
 
-    return (pip_lines, bindep_lines)
+    if CD.meta_file is None:
+        # Requirements are inferred from these files, which may appear or become empty
+        read_files.extend(os.path.join(path, filename) for filename, entry in CollectionDefinition.inferred_files)
 
+    files = tuple(sorted(set(os.path.relpath(read_file, path) for read_file in read_files)))
+    return CollectionRequirements(path, namespace, name, pip_lines, bindep_lines, py_file, sys_file, files)
 
-def process(data_dir=base_collections_path, user_pip=None, user_bindep=None):
+
+def process_collection(path):
+    """Return a tuple of (python_dependencies, system_dependencies) for the
+    collection install path given.
+    Both items returned are a list of dependencies.
+
+    :param str path: root directory of collection (this would contain galaxy.yml file)
+    """
+    result = introspect_collection(path)
+    return (result.python, result.system)
+
+
+def collection_paths(data_dir=base_collections_path):
+    """Return a sorted list of the valid collection install paths
+    found under the ansible_collections folder of data_dir.
+    """
     paths = []
     path_root = os.path.join(data_dir, 'ansible_collections')
 
@@ -86,20 +139,66 @@ def process(data_dir=base_collections_path, user_pip=None, user_bindep=None):
                 if 'galaxy.yml' in files_list or 'MANIFEST.json' in files_list:
                     paths.append(collection_dir)
 
+    return paths
+
+
+def _introspect_path(path, cache=None):
+    key = cache.cache_key(path) if cache is not None else None
+    if key is not None:
+        cached = cache.get(path, key=key)
+        if cached is not None:
+            return cached
+
+    result = introspect_collection(path)
+
+    if key is not None:
+        cache.set(result, key=key)
+    return result
+
+
+def introspect_collections(data_dir=base_collections_path, jobs=1, cache_dir=None):
+    """Return a list of CollectionRequirements, one for each collection
+    installed in data_dir, in sorted collection order.
+
+    :param int jobs: Number of worker threads used to read collection metadata.
+    :param str cache_dir: Directory of a persistent cache of collection requirements.
+        Caching is disabled if unset.
+    """
+    paths = collection_paths(data_dir)
+    cache = IntrospectionCache(cache_dir) if cache_dir else None
+
+    if jobs > 1 and len(paths) > 1:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            # map() yields results in the order of the input paths
+            results = list(executor.map(lambda path: _introspect_path(path, cache), paths))
+    else:
+        results = [_introspect_path(path, cache) for path in paths]
+
+    if cache is not None:
+        cache.evict()
+
+    return results
+
+
+def process(data_dir=base_collections_path, user_pip=None, user_bindep=None, jobs=1, cache_dir=None):
+    """Return the python and system requirements of all collections in data_dir,
+    keyed by the fully qualified collection name.
+
+    See introspect_collections() for the jobs and cache_dir parameters.
+    """
+    results = introspect_collections(data_dir, jobs=jobs, cache_dir=cache_dir)
+
     # populate the requirements content
     py_req = {}
     sys_req = {}
-    for path in paths:
-        col_pip_lines, col_sys_lines = process_collection(path)
-        CD = CollectionDefinition(path)
-        namespace, name = CD.namespace_name()
-        key = '{}.{}'.format(namespace, name)
+    for result in results:
+        key = '{}.{}'.format(result.namespace, result.name)
 
-        if col_pip_lines:
-            py_req[key] = col_pip_lines
+        if result.python:
+            py_req[key] = result.python
 
-        if col_sys_lines:
-            sys_req[key] = col_sys_lines
+        if result.system:
+            sys_req[key] = result.system
 
     # add on entries from user files, if they are given
     if user_pip:
@@ -134,16 +233,21 @@ class CollectionDefinition:
     should be replaced by logic to hit the Galaxy API if made available
     """
 
+    # Requirements files used when the collection has no metadata file, and their entry
+    inferred_files = (('requirements.txt', 'python'), ('bindep.txt', 'system'))
+
     def __init__(self, collection_path):
         self.reference_path = collection_path
         meta_file = os.path.join(collection_path, 'meta', default_file)
         if os.path.exists(meta_file):
+            self.meta_file = meta_file
             with open(meta_file, 'r') as f:
                 self.raw = yaml.safe_load(f)
         else:
+            self.meta_file = None
             self.raw = {'version': 1, 'dependencies': {}}
             # Automatically infer requirements for collection
-            for entry, filename in [('python', 'requirements.txt'), ('system', 'bindep.txt')]:
+            for filename, entry in self.inferred_files:
                 candidate_file = os.path.join(collection_path, filename)
                 if has_content(candidate_file):
                     self.raw['dependencies'][entry] = filename
@@ -157,7 +261,11 @@ class CollectionDefinition:
 
     def namespace_name(self):
         "Returns 2-tuple of namespace and name"
-        path_parts = [p for p in self.reference_path.split(os.path.sep) if p]
+        return self.namespace_name_from_path(self.reference_path)
+
+    @staticmethod
+    def namespace_name_from_path(collection_path):
+        path_parts = [p for p in collection_path.split(os.path.sep) if p]
         return tuple(path_parts[-2:])
 
     def get_dependency(self, entry):
@@ -178,13 +286,134 @@ class CollectionDefinition:
         return req_file
 
 
+def _file_stats(path, files):
+    """Return the size and mtime of each of the files, relative to path, or None for the missing ones"""
+    stats = {}
+    for filename in files:
+        try:
+            stat = os.stat(os.path.join(path, filename))
+        except OSError:
+            stats[filename] = None
+        else:
+            stats[filename] = [stat.st_size, stat.st_mtime_ns]
+    return stats
+
+
+class IntrospectionCache:
+    """On-disk cache of collection requirements, keyed by the content of the
+    MANIFEST.json and FILES.json files of installed collections, and by the
+    size and mtime of their metadata file. Looking an entry up does not parse
+    any collection file. Entries also record the size and mtime of the
+    requirements files they were read from, including -r includes, which may
+    be edited without updating FILES.json, and are only used if these match.
+    Collections without a MANIFEST.json (source checkouts) are never cached.
+    """
+
+    def __init__(self, cache_dir, max_entries=default_cache_max_entries):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+
+    def cache_key(self, path):
+        if not os.path.exists(os.path.join(path, 'MANIFEST.json')):
+            return None
+        digest = hashlib.sha256()
+        namespace, name = CollectionDefinition.namespace_name_from_path(path)
+        digest.update('{0}:{1}.{2}'.format(CACHE_VERSION, namespace, name).encode('utf-8'))
+        for filename in ('MANIFEST.json', 'FILES.json'):
+            file_path = os.path.join(path, filename)
+            if os.path.exists(file_path):
+                digest.update(filename.encode('utf-8'))
+                with open(file_path, 'rb') as f:
+                    digest.update(f.read())
+        digest.update(json.dumps(_file_stats(path, [os.path.join('meta', default_file)])).encode('utf-8'))
+        return digest.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key + '.json')
+
+    def get(self, path, key=None):
+        """Return the cached CollectionRequirements for the collection path,
+        or None if there is no usable entry.
+
+        :param str key: The cache_key() of path, if already computed.
+        """
+        key = key or self.cache_key(path)
+        if key is None:
+            return None
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path, 'r') as f:
+                entry = json.load(f)
+            file_stats = entry.pop('file_stats')
+            if _file_stats(path, file_stats) != file_stats:
+                return None
+            # Refresh the mtime, which serves as the last-used time for eviction
+            os.utime(entry_path)
+            entry['files'] = tuple(entry['files'])
+            return CollectionRequirements(path, **entry)
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def set(self, result, key=None):
+        """Store result, with the stats of the files it was read from.
+
+        :param str key: The cache_key() of the path of result, if already computed.
+        """
+        key = key or self.cache_key(result.path)
+        if key is None:
+            return False
+        entry_path = self._entry_path(key)
+        tmp_path = '{0}.{1}.tmp'.format(entry_path, os.getpid())
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmp_path, 'w') as f:
+                entry = result._asdict()
+                # The same collection may be installed in several places
+                del entry['path']
+                entry['file_stats'] = _file_stats(result.path, result.files)
+                json.dump(entry, f)
+            os.replace(tmp_path, entry_path)
+        except OSError:
+            # The cache is an optimization only, an unwritable cache is not an error
+            return False
+        return True
+
+    def evict(self):
+        """Remove the least recently used entries above max_entries"""
+        try:
+            entries = [
+                os.path.join(self.cache_dir, filename)
+                for filename in os.listdir(self.cache_dir) if filename.endswith('.json')
+            ]
+        except OSError:
+            return 0
+        excess = len(entries) - self.max_entries
+        if excess <= 0:
+            return 0
+        mtimes = {}
+        for entry in entries:
+            try:
+                mtimes[entry] = os.stat(entry).st_mtime
+            except OSError:
+                # Removed by another process in the meantime
+                continue
+        excess = len(mtimes) - self.max_entries
+        if excess <= 0:
+            return 0
+        for entry in sorted(mtimes, key=mtimes.get)[:excess]:
+            try:
+                os.remove(entry)
+            except OSError:
+                pass
+        return excess
+
+
 def simple_combine(reqs):
     """Given a dictionary of requirement lines keyed off collections,
     return a list with the most basic of de-duplication logic,
     and comments indicating the sources based off the collection keys
     """
-    consolidated = []
-    fancy_lines = []
+    consolidated = {}  # base line to the list of collections it came from
     for collection, lines in reqs.items():
         for line in lines:
             if line_is_empty(line):
@@ -192,11 +421,12 @@ def simple_combine(reqs):
 
             base_line = line.split('#')[0].strip()
             if base_line in consolidated:
-                i = consolidated.index(base_line)
-                fancy_lines[i] += ', {}'.format(collection)
+                consolidated[base_line].append(collection)
             else:
-                fancy_line = base_line + '  # from collection {}'.format(collection)
-                consolidated.append(base_line)
-                fancy_lines.append(fancy_line)
+                consolidated[base_line] = [collection]
 
-    return fancy_lines
+    # dicts preserve insertion order, so lines keep the order they were first seen in
+    return [
+        base_line + '  # from collection {}'.format(', '.join(collections))
+        for base_line, collections in consolidated.items()
+    ]
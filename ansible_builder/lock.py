@@ -0,0 +1,125 @@
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+from urllib.parse import unquote, urlparse
+
+from .exceptions import LockError
+from .manifest import file_digest
+from .utils import run_command
+
+
+logger = logging.getLogger(__name__)
+
+SDIST_EXTENSIONS = ('.tar.gz', '.tar.bz2', '.zip')
+
+
+def canonical_name(name):
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+def artifact_name_version(filename):
+    """Return the (canonical name, version) of a wheel or sdist file name, or None"""
+    if filename.endswith('.whl'):
+        parts = filename[:-len('.whl')].split('-')
+        if len(parts) >= 5:
+            return canonical_name(parts[0]), parts[1]
+        return None
+    for extension in SDIST_EXTENSIONS:
+        if filename.endswith(extension):
+            name, sep, version = filename[:-len(extension)].rpartition('-')
+            if sep:
+                return canonical_name(name), version
+    return None
+
+
+def local_artifact_hashes(find_links, name, version):
+    """Return the sha256 of every artifact of name==version in the local find-links
+    directories, so the lock file accepts the wheels for other platforms too.
+    """
+    hashes = set()
+    for directory in find_links:
+        if not os.path.isdir(directory):
+            continue
+        for filename in os.listdir(directory):
+            if artifact_name_version(filename) == (canonical_name(name), version):
+                hashes.add(file_digest(os.path.join(directory, filename)))
+    return hashes
+
+
+def resolved_hashes(item, find_links):
+    """Return the set of sha256 hashes allowed for a distribution of the pip installation report"""
+    name = item['metadata']['name']
+    version = item['metadata']['version']
+    download_info = item.get('download_info', {})
+    archive_info = download_info.get('archive_info')
+    if archive_info is None:
+        raise LockError(
+            f"Requirement {name} resolved to {download_info.get('url')}, which is not an archive and cannot be "
+            "pinned by hash. Build a wheel for it and add it to a --find-links directory."
+        )
+
+    hashes = set()
+    if 'sha256' in archive_info.get('hashes', {}):
+        hashes.add(archive_info['hashes']['sha256'])
+    elif archive_info.get('hash', '').startswith('sha256='):
+        hashes.add(archive_info['hash'].split('=', 1)[1])
+    else:
+        url = urlparse(download_info['url'])
+        if url.scheme != 'file':
+            raise LockError(f'No sha256 hash is known for {name}=={version} from {download_info["url"]}.')
+        hashes.add(file_digest(unquote(url.path)))
+
+    hashes.update(local_artifact_hashes(find_links, name, version))
+    return hashes
+
+
+def lock_requirements(requirements_file, find_links=(), index_url=None, python_version=None, platform=None):
+    """
+    Resolve the Python requirements in requirements_file to exact versions, with pip,
+    and return the lines of a requirements file pinning all of them, and their
+    dependencies, by version and sha256 hash.
+
+    :param str requirements_file: Requirements, as written by the introspect command.
+    :param list find_links: Local directories (or URLs) of wheels and sdists to resolve against.
+    :param str index_url: Simple repository index. Resolution is done offline if unset.
+    :param str python_version: Python version of the image, if different from the running one.
+    :param str platform: Platform tag of the wheels of the image, if different from the running one.
+    """
+    if not find_links and not index_url:
+        raise LockError('At least one of --find-links or --index-url is required to lock requirements.')
+
+    with tempfile.TemporaryDirectory(prefix='ansible-builder-lock-') as tmp_dir:
+        report_path = os.path.join(tmp_dir, 'report.json')
+        command = [
+            sys.executable, '-m', 'pip', 'install', '--dry-run', '--ignore-installed', '--quiet',
+            '--report', report_path, '-r', requirements_file,
+        ]
+        for location in find_links:
+            command.extend(['--find-links', location])
+        if index_url:
+            command.extend(['--index-url', index_url])
+        else:
+            command.append('--no-index')
+        if python_version or platform:
+            # pip can only select wheels for another interpreter or platform
+            command.append('--only-binary=:all:')
+        if python_version:
+            command.extend(['--python-version', python_version])
+        if platform:
+            command.extend(['--platform', platform])
+
+        run_command(command, capture_output=True)
+        with open(report_path, 'r') as f:
+            report = json.load(f)
+
+    lines = [f'# Locked by ansible-builder from {os.path.basename(requirements_file)}']
+    for item in sorted(report.get('install', []), key=lambda item: canonical_name(item['metadata']['name'])):
+        hashes = sorted(resolved_hashes(item, find_links))
+        pin = '{0}=={1}'.format(canonical_name(item['metadata']['name']), item['metadata']['version'])
+        lines.append(' \\\n'.join([pin] + ['    --hash=sha256:{0}'.format(digest) for digest in hashes]))
+
+    logger.debug('Locked {0} requirements'.format(len(lines) - 1))
+    return lines
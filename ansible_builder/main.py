@@ -1,12 +1,30 @@
+import fnmatch
 import logging
 import os
+import shlex
+import sys
+import tempfile
+import time
+import yaml
+
+from concurrent.futures import ThreadPoolExecutor
 
 from . import constants
+from .build_output import BuildOutputParser
+from .drivers import get_driver
+from .exceptions import DefinitionError
+from .introspect import process, default_cache_dir
+from .manifest import ContextManifest, file_digest
+from .prefetch import CollectionCache, collection_requirements, default_collection_cache_dir, fetch_collections
 from .steps import (
-    AdditionalBuildSteps, BuildContextSteps, GalaxyInstallSteps, GalaxyCopySteps, AnsibleConfigSteps
+    AdditionalBuildSteps, BuildContextSteps, ContextFileSteps, GalaxyInstallSteps, GalaxyCopySteps, AnsibleConfigSteps,
+    cache_mount_options, context_sources
 )
+from .requirements import sanitize_requirements
+from .system_requirements import sanitize_system_requirements
+from .timings import Timings
 from .user_definition import UserDefinition
-from .utils import run_command, copy_file
+from .utils import run_command, format_size
 
 
 logger = logging.getLogger(__name__)
@@ -19,37 +37,108 @@ class AnsibleBuilder:
                  build_args=None,
                  build_context=constants.default_build_context,
                  tag=None,
-                 container_runtime=constants.default_container_runtime,
+                 container_runtime=None,
                  output_filename=None,
                  no_cache=False,
                  prune_images=False,
                  verbosity=constants.default_verbosity,
                  galaxy_keyring=None,
                  galaxy_required_valid_signature_count=None,
-                 galaxy_ignore_signature_status_codes=()):
+                 galaxy_ignore_signature_status_codes=(),
+                 split_context=False,
+                 cache_mounts=False,
+                 log_file=None,
+                 introspect_on_host=False,
+                 collections_path=None,
+                 lock_file=None,
+                 timings=None,
+                 trace_file=None,
+                 platforms=None,
+                 prefetch_collections=False,
+                 staging=constants.default_staging,
+                 build_driver=None,
+                 squash=False,
+                 cache_from=None,
+                 cache_to=None,
+                 introspect_cache_dir=None,
+                 detect_platform=False,
+                 prune_context=False):
         """
         :param str galaxy_keyring: GPG keyring file used by ansible-galaxy to opportunistically validate collection signatures.
         :param str galaxy_required_valid_signature_count: Number of sigs (prepend + to disallow no sig( required for ansible-galaxy to accept collections.
         :param str galaxy_ignore_signature_status_codes: GPG Status code to ignore when validating galaxy collections.
+        :param bool split_context: Add each dependency file to the image right before the step using it.
+        :param bool cache_mounts: Mount the persistent pip cache, and the ansible-galaxy API response cache, into RUN steps.
+        :param str log_file: File the full output of the container build is written to.
+        :param bool introspect_on_host: Combine collection requirements on the host rather than in the builder stage.
+        :param str collections_path: Collections to introspect on the host. If unset, the galaxy
+            requirements are installed into a temporary directory for introspection.
+        :param str lock_file: Python requirements pinned by the lock command, used instead of the introspected ones.
+        :param str timings: File the JSON report of the duration of each phase is written to, - for stdout.
+        :param str trace_file: File the timed phases are appended to, as OpenTelemetry spans.
+        :param list platforms: Platforms to build the image for, like linux/arm64. With several platforms,
+            an image is built for each of them at once, and the tags name a manifest list of these images.
+        :param bool prefetch_collections: Download the collection tarballs on the host, through a cache, and
+            install collections from the copies of these tarballs in the build context.
+        :param str staging: How files are placed in the build context, one of constants.staging_strategies.
+        :param build_driver: BuildDriver, or name of one, running the builds instead of the container runtime itself.
+        :param bool squash: Squash the layers of the image into one, with build drivers supporting it.
+        :param list cache_from: Images, or directories with the buildx build driver, to import the layer cache from.
+        :param str cache_to: Image, or directory with the buildx build driver, to export the layer cache to.
+        :param str introspect_cache_dir: Directory of the cache of collection requirements used when introspecting
+            on the host, instead of the default one. The cache is not used with no_cache.
+        :param bool detect_platform: Drop the system requirements that cannot apply to the platform of
+            EE_BUILDER_IMAGE when combining requirements in the builder stage.
+        :param bool prune_context: Remove the files ansible-builder wrote to the build context before, and
+            no longer uses, and write an ignore file leaving the others it wrote out of the build context.
         """
+        self.timings = Timings()
+        self.timings_file = timings
+        self.trace_file = trace_file
 
         if not galaxy_keyring and (galaxy_required_valid_signature_count or galaxy_ignore_signature_status_codes):
             raise ValueError("--galaxy-required-valid-signature-count and --galaxy-ignore-signature-status-code may not be set without --galaxy-keyring")
 
+        if prefetch_collections and galaxy_keyring:
+            # Signatures are only available when installing from a galaxy server
+            raise ValueError("--prefetch-collections may not be set with --galaxy-keyring")
+
+        if lock_file and not os.path.exists(lock_file):
+            raise DefinitionError(f"Lock file {lock_file} does not exist.")
+
         self.action = action
 
         # Read and validate the EE file early
-        self.definition = UserDefinition(filename=filename)
-        self.definition.validate()
+        with self.timings.span('definition.load'):
+            self.definition = UserDefinition(filename=filename)
+        with self.timings.span('definition.validate'):
+            self.definition.validate()
 
         self.tags = tag or []
         self.build_context = build_context
         self.build_outputs_dir = os.path.join(
             build_context, constants.user_content_subfolder)
-        self.container_runtime = container_runtime
+        self.driver = get_driver(build_driver, container_runtime)
+        self.container_runtime = self.driver.runtime
+        self.squash = squash
+        self.cache_from = cache_from or []
+        self.cache_to = cache_to
+        if self.driver.cache_export:
+            # Fail before writing the build context if the driver cannot use these locations
+            self.driver.cache_options(self.cache_from, self.cache_to)
         self.build_args = build_args or {}
         self.no_cache = no_cache
+        self.introspect_cache_dir = introspect_cache_dir
         self.prune_images = prune_images
+        self.log_file = log_file
+        self.platforms = platforms or []
+        self.prefetch = prefetch_collections
+        self.prune_context = prune_context
+        self.platform_results = []
+        self.collections_path = collections_path
+        self.galaxy_keyring = galaxy_keyring
+        self.galaxy_required_valid_signature_count = galaxy_required_valid_signature_count
+        self.galaxy_ignore_signature_status_codes = galaxy_ignore_signature_status_codes
         self.containerfile = Containerfile(
             definition=self.definition,
             build_context=self.build_context,
@@ -57,8 +146,15 @@ class AnsibleBuilder:
             output_filename=output_filename,
             galaxy_keyring=galaxy_keyring,
             galaxy_required_valid_signature_count=galaxy_required_valid_signature_count,
-            galaxy_ignore_signature_status_codes=galaxy_ignore_signature_status_codes)
+            galaxy_ignore_signature_status_codes=galaxy_ignore_signature_status_codes,
+            split_context=split_context,
+            cache_mounts=cache_mounts,
+            host_introspect=introspect_on_host or bool(collections_path),
+            lock_file=lock_file,
+            staging=staging,
+            detect_platform=detect_platform)
         self.verbosity = verbosity
+        self.build_output = None
 
     @property
     def version(self):
@@ -70,12 +166,103 @@ class AnsibleBuilder:
 
     def create(self):
         logger.debug('Ansible Builder is generating your execution environment build context.')
-        return self.write_containerfile()
+        with self.timings.span('create'):
+            return self.write_containerfile()
+
+    def write_timings(self):
+        """Write the timings report and spans to the files requested, if any"""
+        self.timings.write(self.timings_file, self.trace_file)
+
+    @property
+    def galaxy_collection_opts(self):
+        return self.build_args.get('ANSIBLE_GALAXY_CLI_COLLECTION_OPTS',
+                                   self.definition.build_arg_defaults['ANSIBLE_GALAXY_CLI_COLLECTION_OPTS'])
+
+    def _galaxy_collection_command(self, action, path_option, path):
+        command = ['ansible-galaxy', 'collection', action]
+        if self.galaxy_collection_opts:
+            command.extend(shlex.split(self.galaxy_collection_opts))
+        command.extend(['-r', self.definition.get_dep_abs_path('galaxy'), path_option, path])
+        return command
+
+    def galaxy_install_command(self, collections_path):
+        """Command installing the galaxy requirements on the host, with the same options as the galaxy stage"""
+        command = self._galaxy_collection_command('install', '--collections-path', collections_path)
+        for code in self.galaxy_ignore_signature_status_codes or ():
+            command.extend(['--ignore-signature-status-code', str(code)])
+        if self.galaxy_required_valid_signature_count:
+            command.extend(['--required-valid-signature-count', str(self.galaxy_required_valid_signature_count)])
+        if self.galaxy_keyring:
+            command.extend(['--keyring', self.galaxy_keyring])
+        return command
+
+    def galaxy_download_command(self, download_path):
+        """Command downloading the tarballs of the galaxy requirements, and of their dependencies, on the host"""
+        return self._galaxy_collection_command('download', '--download-path', download_path)
+
+    def prefetch_collections(self):
+        """Download the collection tarballs of the galaxy requirements through the collection
+        cache, and add them to the build context.
+        """
+        if not self.definition.get_dep_abs_path('galaxy'):
+            return []
+
+        def download(download_path):
+            logger.debug('Downloading collections on the host')
+            run_command(self.galaxy_download_command(download_path), env=self.galaxy_install_env)
+
+        # Anything changing what a download gives is part of the cache key
+        cache_key_extra = self.galaxy_collection_opts or ''
+        if self.definition.ansible_config:
+            cache_key_extra += file_digest(self.definition.ansible_config)
+        tarballs = fetch_collections(self.definition.get_dep_abs_path('galaxy'), CollectionCache(default_collection_cache_dir()),
+                                     download, cache_key_extra=cache_key_extra)
+        return self.containerfile.add_prefetched_collections(tarballs)
+
+    @property
+    def galaxy_install_env(self):
+        env = dict(os.environ)
+        if not self.galaxy_keyring:
+            env['ANSIBLE_GALAXY_DISABLE_GPG_VERIFY'] = '1'
+        if self.definition.ansible_config:
+            env['ANSIBLE_CONFIG'] = os.path.abspath(self.definition.ansible_config)
+        return env
+
+    def introspect_on_host(self):
+        """Write the combined requirements of all collections to the build context,
+        installing the galaxy requirements into a temporary directory unless
+        collections_path is set.
+        """
+        cache_dir = None if self.no_cache else (self.introspect_cache_dir or default_cache_dir())
+        if self.collections_path:
+            return self.containerfile.introspect_on_host(self.collections_path, timings=self.timings, cache_dir=cache_dir)
+
+        with tempfile.TemporaryDirectory(prefix='ansible-builder-collections-') as collections_path:
+            if self.definition.get_dep_abs_path('galaxy'):
+                logger.debug('Installing collections on the host for introspection')
+                with self.timings.span('introspect.galaxy_install'):
+                    run_command(self.galaxy_install_command(collections_path), env=self.galaxy_install_env)
+            return self.containerfile.introspect_on_host(collections_path, timings=self.timings, cache_dir=cache_dir)
 
     def write_containerfile(self):
         # File preparation
-        self.containerfile.create_folder_copy_files()
+        with self.timings.span('context.copy'):
+            self.containerfile.create_folder_copy_files()
+        if self.prefetch:
+            with self.timings.span('context.prefetch'):
+                self.prefetch_collections()
+        if self.containerfile.host_introspect:
+            with self.timings.span('introspect'):
+                self.introspect_on_host()
+
+        with self.timings.span('containerfile.render'):
+            self._render_containerfile()
+        if self.prune_context:
+            with self.timings.span('context.prune'):
+                self.containerfile.prune_context()
+        return True
 
+    def _render_containerfile(self):
         # First stage, galaxy
         self.containerfile.prepare_galaxy_stage_steps()
         self.containerfile.prepare_ansible_config_file()
@@ -84,8 +271,12 @@ class AnsibleBuilder:
 
         # Second stage, builder
         self.containerfile.prepare_build_stage_steps()
-        self.containerfile.prepare_galaxy_copy_steps()
-        self.containerfile.prepare_introspect_assemble_steps()
+        if self.containerfile.host_introspect:
+            # Collections are only needed in the builder stage for introspection
+            self.containerfile.prepare_introspected_assemble_steps()
+        else:
+            self.containerfile.prepare_galaxy_copy_steps()
+            self.containerfile.prepare_introspect_assemble_steps()
 
         # Second stage
         self.containerfile.prepare_final_stage_steps()
@@ -98,47 +289,164 @@ class AnsibleBuilder:
 
     @property
     def prune_image_command(self):
-        command = [
-            self.container_runtime, "image",
-            "prune", "--force"
-        ]
-        return command
+        return self.driver.prune_command()
 
     @property
     def build_command(self):
-        command = [
-            self.container_runtime, "build",
-            "-f", self.containerfile.path
-        ]
+        platform = self.platforms[0] if len(self.platforms) == 1 else None
+        return self.platform_build_command(platform, self.tags)
+
+    def platform_build_command(self, platform, tags):
+        return self.driver.build_command(self.containerfile.path, self.build_context, tags=tags,
+                                         build_args=self.build_args, platform=platform,
+                                         no_cache=self.no_cache, squash=self.squash,
+                                         cache_from=self.cache_from, cache_to=self.cache_to)
+
+    def platform_tags(self, platform):
+        """Tags of the image built for one of several platforms, like ansible-execution-env:latest-linux-arm64"""
+        tags = []
+        for tag in self.tags or [constants.default_tag]:
+            if ':' not in tag.rsplit('/', 1)[-1]:
+                tag += ':latest'
+            tags.append('{0}-{1}'.format(tag, platform.replace('/', '-')))
+        return tags
+
+    def manifest_commands(self, platform_tags):
+        """Commands creating a manifest list for each tag, from the images built for each platform"""
+        commands = []
+        for tag in self.tags or [constants.default_tag]:
+            commands.extend(self.driver.manifest_commands(tag, [tags[0] for tags in platform_tags]))
+        return commands
+
+    def runtime_supports_cache_mounts(self):
+        """Docker supports cache mounts with BuildKit, podman from version 4 on."""
+        return self.driver.supports_cache_mounts()
 
-        for tag in self.tags:
-            command.extend(["-t", tag])
-
-        for key, value in self.build_args.items():
-            if value:
-                build_arg = f"--build-arg={key}={value}"
-            else:
-                build_arg = f"--build-arg={key}"
-
-            command.append(build_arg)
-
-        command.append(self.build_context)
-
-        if self.no_cache:
-            command.append('--no-cache')
+    @property
+    def build_env(self):
+        return self.driver.build_env(cache_mounts=self.containerfile.cache_mounts)
+
+    def prepare_build(self):
+        """Write the build context for a build with the selected build driver"""
+        if self.containerfile.cache_mounts and not self.runtime_supports_cache_mounts():
+            logger.warning(f'{self.driver.name} does not support cache mounts, building without them.')
+            self.containerfile.cache_mounts = False
+        if self.squash and not self.driver.squash:
+            logger.warning(f'{self.driver.name} cannot squash images, building without --squash.')
+            self.squash = False
+        if (self.cache_from or self.cache_to) and not self.driver.cache_export:
+            logger.warning(f'{self.driver.name} cannot import or export the layer cache, building without '
+                           f'--cache-from and --cache-to. Use the buildx build driver instead.')
+            self.cache_from, self.cache_to = [], None
+        return self.write_containerfile()
 
-        return command
+    def build_summary(self, build_output=None):
+        """Return the lines reporting the use of the layer cache by a build"""
+        lines = build_output.summary() if build_output is not None else []
+        if self.cache_from:
+            lines.append('Layer cache imported from: {0}'.format(', '.join(self.cache_from)))
+        if self.cache_to:
+            lines.append(f'Layer cache exported to: {self.cache_to}')
+        return lines
 
     def build(self):
         logger.debug(f'Ansible Builder is building your execution environment image. Tags: {", ".join(self.tags)}')
-        self.write_containerfile()
-        run_command(self.build_command)
+        self.prepare_build()
+        if len(self.platforms) > 1:
+            self.build_platforms()
+        else:
+            self.build_output = BuildOutputParser()
+            with self.timings.span('build', runtime=self.container_runtime, driver=self.driver.name) as span:
+                try:
+                    self.driver.run(self.build_command, env=self.build_env, stream_output=True, log_file=self.log_file,
+                                    on_output=self.build_output)
+                finally:
+                    # Also report the steps of a failed build, which exits from run_command()
+                    self.build_output.finish()
+                    self.build_output.record(self.timings, parent=span)
+                    for line in self.build_summary(self.build_output):
+                        logger.info(line)
         if self.prune_images:
             logger.debug('Removing all dangling images')
-            run_command(self.prune_image_command)
+            with self.timings.span('prune_images'):
+                self.driver.run(self.prune_image_command)
+        return True
+
+    def _build_platform(self, platform, parent_span):
+        tags = self.platform_tags(platform)
+        log_file = '{0}.{1}'.format(self.log_file, platform.replace('/', '-')) if self.log_file else None
+        logger.info(f'Building for {platform}')
+        parser = BuildOutputParser()
+        start_time, start = time.time(), time.monotonic()
+        # The output of simultaneous builds would be interleaved, only the end of failed builds is shown
+        rc, output = self.driver.run(
+            self.platform_build_command(platform, tags), env=self.build_env, allow_error=True, capture_output=True,
+            max_output_lines=20, stream_output=True, show_output=False, log_file=log_file, on_output=parser)
+        parser.finish()
+        result = BuildResult(platform, self.definition.filename, tags, rc, time.monotonic() - start, log_file)
+        result.output = output
+        span = self.timings.add_span('build.platform', start_time, result.duration, parent=parent_span,
+                                     platform=platform, rc=rc)
+        parser.record(self.timings, parent=span)
+        logger.info('Build for {0} {1} in {2:.1f}s'.format(platform, 'succeeded' if result.succeeded else 'failed', result.duration))
+        return result
+
+    def build_platforms(self):
+        """Build an image for each platform at once, then a manifest list of these images for each tag"""
+        with self.timings.span('build', runtime=self.container_runtime, driver=self.driver.name, platforms=','.join(self.platforms)) as span:
+            with ThreadPoolExecutor(max_workers=len(self.platforms)) as executor:
+                self.platform_results = list(executor.map(lambda platform: self._build_platform(platform, span), self.platforms))
+
+        for line in results_table(self.platform_results, 'Platform') + self.build_summary():
+            logger.info(line)
+
+        failed = [result for result in self.platform_results if not result.succeeded]
+        for result in failed:
+            logger.error(f'Build for {result.name} failed (rc={result.rc}), last lines of output:')
+            for line in result.output:
+                logger.error(line)
+        if failed:
+            sys.exit(1)
+
+        if not self.driver.manifest_lists:
+            # docker manifest lists can only reference images pushed to a registry
+            logger.warning('Push the images {0} and create a manifest list of them with docker manifest.'.format(
+                ', '.join(result.tags[0] for result in self.platform_results)))
+            return True
+
+        with self.timings.span('build.manifest'):
+            for tag in self.tags or [constants.default_tag]:
+                # Replace the manifest list left by a previous build
+                self.driver.run(self.driver.manifest_remove_command(tag), allow_error=True, show_output=False)
+            for command in self.manifest_commands([result.tags for result in self.platform_results]):
+                self.driver.run(command)
         return True
 
 
+class BuildResult:
+    def __init__(self, name, filename, tags, rc, duration, log_file):
+        self.name = name
+        self.filename = filename
+        self.tags = tags
+        self.rc = rc
+        self.duration = duration
+        self.log_file = log_file
+
+    @property
+    def succeeded(self):
+        return self.rc == 0
+
+
+def results_table(results, heading):
+    """Return the lines of a table of the status and duration of each BuildResult"""
+    width = max([len(result.name) for result in results] + [len(heading)])
+    lines = ['{0:<{1}}  {2:<7}  {3:>9}  {4}'.format(heading, width, 'Status', 'Duration', 'Tags')]
+    for result in results:
+        lines.append('{0:<{1}}  {2:<7}  {3:>8.1f}s  {4}'.format(
+            result.name, width, 'ok' if result.succeeded else 'FAILED', result.duration, ', '.join(result.tags)))
+    return lines
+
+
 class Containerfile:
     newline_char = '\n'
 
@@ -149,11 +457,36 @@ class Containerfile:
                  keyring=None,
                  galaxy_keyring=None,
                  galaxy_required_valid_signature_count=None,
-                 galaxy_ignore_signature_status_codes=()):
+                 galaxy_ignore_signature_status_codes=(),
+                 split_context=False,
+                 cache_mounts=False,
+                 host_introspect=False,
+                 lock_file=None,
+                 galaxy_base_image=None,
+                 galaxy_requirements=None,
+                 staging=constants.default_staging,
+                 detect_platform=False):
         """
         :param str galaxy_keyring: GPG keyring file used by ansible-galaxy to opportunistically validate collection signatures.
         :param str galaxy_required_valid_signature_count: Number of sigs (prepend + to disallow no sig) required for ansible-galaxy to accept collections.
         :param str galaxy_ignore_signature_status_codes: GPG Status codes to ignore when validating galaxy collections.
+        :param bool cache_mounts: Use RUN --mount=type=cache for the pip cache and the ansible-galaxy API response cache.
+        :param bool host_introspect: Requirements are combined on the host with introspect_on_host(), and
+            the builder stage uses them as they are instead of running the introspect command.
+        :param str lock_file: Python requirements pinned by the lock command. They are installed as they are,
+            without dependency resolution, and replace the collection and user Python requirements.
+        :param bool split_context: Instead of adding the whole build context folder to the galaxy stage,
+            only add the files the galaxy install needs. Python and system requirements are
+            only added to the builder stage, so changing them does not invalidate the galaxy install.
+        :param str galaxy_base_image: Image the galaxy stage starts from instead of EE_BASE_IMAGE, with some
+            of the collections already installed.
+        :param dict galaxy_requirements: Galaxy requirements written to the build context instead of the
+            galaxy requirements file of the definition, like the ones missing from galaxy_base_image.
+        :param str staging: How create_folder_copy_files() places files in the build context: copy, or
+            reflink or hardlink them when the build context is on the same filesystem, or auto to try both.
+        :param bool detect_platform: Run the introspect command of the builder stage with --detect-platform,
+            which needs an ansible-builder supporting it in EE_BUILDER_IMAGE. The platform detected is the
+            one of EE_BUILDER_IMAGE, which may differ from the one of EE_BASE_IMAGE.
         """
 
         self.build_context = build_context
@@ -170,6 +503,16 @@ class Containerfile:
         self.copied_galaxy_keyring = None
         self.galaxy_required_valid_signature_count = galaxy_required_valid_signature_count
         self.galaxy_ignore_signature_status_codes = galaxy_ignore_signature_status_codes
+        self.split_context = split_context
+        self.cache_mounts = cache_mounts
+        self.host_introspect = host_introspect
+        self.original_lock_file = lock_file
+        self.detect_platform = detect_platform
+        self.galaxy_base_image = galaxy_base_image
+        self.galaxy_requirements = galaxy_requirements
+        self.prefetched_collections = None
+        self.wheels = None
+        self.manifest = ContextManifest(self.build_context, staging=staging)
 
         # Build args all need to go at top of file to avoid errors
         self.steps = [
@@ -193,18 +536,139 @@ class Containerfile:
                 continue
             dest = os.path.join(
                 self.build_context, constants.user_content_subfolder, new_name)
-            copy_file(requirement_path, dest)
+            if item == 'galaxy' and self.galaxy_requirements is not None:
+                self.write_to_context(dest, yaml.safe_dump(self.galaxy_requirements, sort_keys=False))
+            else:
+                self.copy_to_context(requirement_path, dest)
 
         if self.original_galaxy_keyring:
             self.copied_galaxy_keyring = constants.default_keyring_name
-            copy_file(self.original_galaxy_keyring, os.path.join(self.build_outputs_dir, self.copied_galaxy_keyring))
+            self.copy_to_context(self.original_galaxy_keyring, os.path.join(self.build_outputs_dir, self.copied_galaxy_keyring))
 
         if self.definition.ansible_config:
-            copy_file(
+            self.copy_to_context(
                 self.definition.ansible_config,
                 os.path.join(self.build_outputs_dir, 'ansible.cfg')
             )
 
+        if self.original_lock_file:
+            self.copy_to_context(self.original_lock_file, os.path.join(self.build_outputs_dir, constants.default_lock_file_name))
+
+        wheels_path = self.definition.get_dep_abs_path('wheels')
+        if wheels_path:
+            self.copy_wheels(wheels_path)
+
+    def copy_to_context(self, source, dest):
+        """Copy source to dest in the build context, unless the manifest shows
+        that neither has changed since the last copy.
+        """
+        return self.manifest.copy(source, dest)
+
+    def write_to_context(self, dest, content):
+        """Write content to dest in the build context, unless the manifest shows
+        that dest already has this content.
+        """
+        return self.manifest.write(dest, content)
+
+    def copy_wheels(self, source_dir):
+        """Copy the files of a directory of prebuilt wheels to the build context, for pip to find them,
+        and remove the files of the build context folder which are no longer in the directory.
+
+        :returns: The names of the files copied.
+        """
+        folder = os.path.join(self.build_outputs_dir, constants.CONTEXT_DIRECTORIES['wheels'])
+        os.makedirs(folder, exist_ok=True)
+        self.wheels = []
+        for filename in sorted(os.listdir(source_dir)):
+            path = os.path.join(source_dir, filename)
+            # pip does not look for packages in subdirectories of --find-links
+            if os.path.isfile(path):
+                self.copy_to_context(path, os.path.join(folder, filename))
+                self.wheels.append(filename)
+        for filename in os.listdir(folder):
+            path = os.path.join(folder, filename)
+            # pip would still find a wheel removed from the directory
+            if filename not in self.wheels and os.path.isfile(path):
+                logger.debug(f'Removing {path}, which is no longer in {source_dir}')
+                os.remove(path)
+                self.manifest.forget(path)
+        return self.wheels
+
+    def add_prefetched_collections(self, tarballs):
+        """Copy collection tarballs to the build context, and install collections from them
+
+        :param list tarballs: (filename, path) of every collection tarball to install.
+        """
+        folder = os.path.join(self.build_outputs_dir, constants.prefetched_collections_folder)
+        os.makedirs(folder, exist_ok=True)
+        for filename, path in tarballs:
+            self.copy_to_context(path, os.path.join(folder, filename))
+        self.write_to_context(
+            os.path.join(folder, constants.CONTEXT_FILES['galaxy']),
+            collection_requirements(f'/build/{constants.prefetched_collections_folder}', [filename for filename, path in tarballs]))
+        self.prefetched_collections = [filename for filename, path in tarballs]
+        return self.prefetched_collections
+
+    def prune_context(self):
+        """Remove the files of the build context folder which the manifest recorded in a
+        previous run and were not written or found current since, and write an ignore file
+        leaving the other files recorded but no longer used out of the build context.
+        Files the manifest never recorded, like the ones added by the user, and the files
+        the additional build steps copy are kept, and never ignored.
+
+        :returns: A tuple of the size of the build context before pruning, and of the part sent to the runtime.
+        """
+        def context_files():
+            for root, dirs, files in os.walk(self.build_context):
+                for filename in files:
+                    yield os.path.relpath(os.path.join(root, filename), self.build_context)
+
+        def referenced(path):
+            return any(fnmatch.fnmatch(path, source) or path.startswith(source + os.path.sep) for source in sources)
+
+        size_before = sum(os.path.getsize(os.path.join(self.build_context, path)) for path in context_files())
+
+        additional_steps = self.definition.get_additional_commands() or {}
+        sources = context_sources(step for stage in ('prepend', 'append') if additional_steps.get(stage)
+                                  for step in AdditionalBuildSteps(additional_steps[stage]))
+        ignore_file = os.path.join(self.build_context, constants.runtime_ignore_files.get(self.container_runtime, '.dockerignore'))
+        ignore_key = os.path.relpath(ignore_file, self.build_context)
+        unused = []
+        for path in self.manifest.unused_files():
+            if not os.path.exists(os.path.join(self.build_context, path)):
+                self.manifest.forget(os.path.join(self.build_context, path))
+            elif path != ignore_key and not referenced(path):
+                unused.append(path)
+
+        pruned = 0
+        ignored = [constants.context_manifest_name]
+        for path in unused:
+            if path.startswith(constants.user_content_subfolder + os.path.sep):
+                logger.debug(f'Removing {path}, which is no longer used, from the build context')
+                os.remove(os.path.join(self.build_context, path))
+                self.manifest.forget(os.path.join(self.build_context, path))
+                pruned += 1
+            else:
+                ignored.append(path)
+        for root, dirs, files in os.walk(self.build_outputs_dir, topdown=False):
+            if root != self.build_outputs_dir and not os.listdir(root):
+                os.rmdir(root)
+
+        if os.path.exists(ignore_file) and not self.manifest.get(ignore_file):
+            logger.debug(f'Not writing {ignore_key}, which was not written by ansible-builder')
+            ignored = []
+        else:
+            lines = ['# Generated by ansible-builder: files it wrote to the build context before, and no longer uses']
+            self.write_to_context(ignore_file, '\n'.join(lines + ignored + ['']))
+        self.manifest.save()
+
+        sent = [path for path in context_files() if path not in ignored]
+        size_sent = sum(os.path.getsize(os.path.join(self.build_context, path)) for path in sent)
+        logger.info('Build context: {0} sent to {1} in {2} files, out of {3}{4}'.format(
+            format_size(size_sent), self.container_runtime, len(sent), format_size(size_before),
+            f', {pruned} unused files removed' if pruned else ''))
+        return size_before, size_sent
+
     def prepare_ansible_config_file(self):
         ansible_config_file_path = self.definition.ansible_config
         if ansible_config_file_path:
@@ -231,7 +695,15 @@ class Containerfile:
         return False
 
     def prepare_build_context(self):
-        if any(self.definition.get_dep_abs_path(thing) for thing in ('galaxy', 'system', 'python')):
+        if self.split_context:
+            if self.definition.get_dep_abs_path('galaxy'):
+                context_files = [constants.CONTEXT_FILES['galaxy']]
+                if self.prefetched_collections is not None:
+                    context_files.append(constants.prefetched_collections_folder)
+                if self.copied_galaxy_keyring:
+                    context_files.append(self.copied_galaxy_keyring)
+                self.steps.extend(ContextFileSteps(context_files))
+        elif any(self.definition.get_dep_abs_path(thing) for thing in ('galaxy', 'system', 'python')):
             self.steps.extend(BuildContextSteps())
         return self.steps
 
@@ -240,16 +712,85 @@ class Containerfile:
             self.steps.extend(GalaxyInstallSteps(constants.CONTEXT_FILES['galaxy'],
                                                  self.copied_galaxy_keyring,
                                                  self.galaxy_ignore_signature_status_codes,
-                                                 self.galaxy_required_valid_signature_count))
+                                                 self.galaxy_required_valid_signature_count,
+                                                 cache_mounts=self.cache_mounts,
+                                                 collection_requirements=self.prefetched_requirements))
+        return self.steps
+
+    @property
+    def prefetched_requirements(self):
+        """Requirements file of the prefetched collection tarballs, relative to /build"""
+        if self.prefetched_collections is None:
+            return None
+        return os.path.join(constants.prefetched_collections_folder, constants.CONTEXT_FILES['galaxy'])
+
+    def introspect_on_host(self, collections_path, timings=None, cache_dir=None):
+        """Combine the requirements of the collections installed in collections_path with
+        the user requirements, like the introspect command does in the builder stage,
+        and write the result to the build context.
+
+        :param str collections_path: Directory holding an ansible_collections folder.
+        :param Timings timings: Records the duration of the introspection phases.
+        :param str cache_dir: Directory of the cache of collection requirements, not used if unset.
+        """
+        timings = timings or Timings()
+        user_files = {}
+        for entry in ('python', 'system'):
+            path = os.path.join(self.build_outputs_dir, constants.CONTEXT_FILES[entry])
+            user_files[entry] = path if os.path.exists(path) else None
+
+        with timings.span('introspect.collections'):
+            data = process(collections_path, user_pip=user_files['python'], user_bindep=user_files['system'],
+                           cache_dir=cache_dir)
+        with timings.span('introspect.sanitize'):
+            combined = {
+                'python': sanitize_requirements(data['python']),
+                # The platform of the host may not be the one of the image, so nothing is filtered out
+                'system': sanitize_system_requirements(data['system']),
+            }
+
+        for entry, lines in combined.items():
+            path = os.path.join(self.build_outputs_dir, constants.INTROSPECTED_FILES[entry])
+            if lines:
+                self.write_to_context(path, '\n'.join(lines + ['']))
+            elif os.path.exists(path):
+                # Remove it now, the Containerfile only adds the files which exist
+                os.remove(path)
+
+        return combined
+
+    def prepare_introspected_assemble_steps(self):
+        """Assemble from the requirements written by introspect_on_host()"""
+        if any(self.definition.get_dep_abs_path(thing) for thing in ('galaxy', 'system', 'python')) or self.original_lock_file:
+            entries = ('system',) if self.original_lock_file else ('python', 'system')
+            for entry in entries:
+                if os.path.exists(os.path.join(self.build_outputs_dir, constants.INTROSPECTED_FILES[entry])):
+                    relative_path = os.path.join(constants.user_content_subfolder, constants.INTROSPECTED_FILES[entry])
+                    # Where the introspect command would have written them for assemble
+                    self.steps.append(f"ADD {relative_path} /tmp/src/{constants.CONTEXT_FILES[entry]}")
+            self.prepare_lock_file_steps()
+            self.prepare_wheels_steps()
+            self.steps.append(self._assemble_step())
+
+        return self.steps
+
+    def prepare_lock_file_steps(self):
+        if self.original_lock_file:
+            relative_lock_path = os.path.join(constants.user_content_subfolder, constants.default_lock_file_name)
+            # Where assemble reads the python requirements from
+            self.steps.append(f"ADD {relative_lock_path} /tmp/src/{constants.CONTEXT_FILES['python']}")
         return self.steps
 
     def prepare_introspect_assemble_steps(self):
         # The introspect/assemble block is valid if there are any form of requirements
-        if any(self.definition.get_dep_abs_path(thing) for thing in ('galaxy', 'system', 'python')):
+        if any(self.definition.get_dep_abs_path(thing) for thing in ('galaxy', 'system', 'python')) or self.original_lock_file:
 
             introspect_cmd = "RUN ansible-builder introspect --sanitize"
+            if self.detect_platform:
+                introspect_cmd += " --detect-platform"
 
-            requirements_file_exists = os.path.exists(os.path.join(
+            # Python requirements of collections and the user are already in the lock file
+            requirements_file_exists = not self.original_lock_file and os.path.exists(os.path.join(
                 self.build_outputs_dir, constants.CONTEXT_FILES['python']
             ))
             if requirements_file_exists:
@@ -263,13 +804,37 @@ class Containerfile:
                 self.steps.append(f"ADD {relative_bindep_path} {constants.CONTEXT_FILES['system']}")
                 introspect_cmd += " --user-bindep={0}".format(constants.CONTEXT_FILES['system'])
 
-            introspect_cmd += " --write-bindep=/tmp/src/bindep.txt --write-pip=/tmp/src/requirements.txt"
+            introspect_cmd += " --write-bindep=/tmp/src/bindep.txt"
+            if not self.original_lock_file:
+                introspect_cmd += " --write-pip=/tmp/src/requirements.txt"
 
             self.steps.append(introspect_cmd)
-            self.steps.append("RUN assemble")
+            self.prepare_lock_file_steps()
+            self.prepare_wheels_steps()
+            self.steps.append(self._assemble_step())
 
         return self.steps
 
+    def prepare_wheels_steps(self):
+        if self.wheels:
+            folder = constants.CONTEXT_DIRECTORIES['wheels']
+            self.steps.append(f"ADD {constants.user_content_subfolder}/{folder} /build/{folder}")
+        return self.steps
+
+    def _assemble_step(self):
+        run = "RUN "
+        if self.cache_mounts:
+            run += cache_mount_options('pip') + " "
+        if self.wheels:
+            # The pip commands of assemble take the prebuilt wheels rather than building them
+            run += f"PIP_FIND_LINKS=/build/{constants.CONTEXT_DIRECTORIES['wheels']} "
+            if self.definition.wheels_no_index:
+                run += "PIP_NO_INDEX=1 "
+        if self.original_lock_file:
+            # Every dependency is pinned in the lock file, so pip can skip resolving them
+            run += "PIP_NO_DEPS=1 "
+        return run + "assemble"
+
     def prepare_system_runtime_deps_steps(self):
         self.steps.extend([
             "COPY --from=builder /output/ /output/",
@@ -281,7 +846,7 @@ class Containerfile:
     def prepare_galaxy_stage_steps(self):
         self.steps.extend([
             "",
-            "FROM $EE_BASE_IMAGE as galaxy",
+            "FROM {0} as galaxy".format(self.galaxy_base_image or '$EE_BASE_IMAGE'),
             "ARG ANSIBLE_GALAXY_CLI_COLLECTION_OPTS={}".format(
                 self.definition.build_arg_defaults['ANSIBLE_GALAXY_CLI_COLLECTION_OPTS']
             ),
@@ -315,8 +880,7 @@ class Containerfile:
         return self.steps
 
     def write(self):
-        with open(self.path, 'w') as f:
-            for step in self.steps:
-                f.write(step + self.newline_char)
-
+        content = ''.join(step + self.newline_char for step in self.steps)
+        self.write_to_context(self.path, content)
+        self.manifest.save()
         return True
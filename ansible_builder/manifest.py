@@ -0,0 +1,166 @@
+import hashlib
+import json
+import logging
+import os
+
+from . import constants
+from .utils import copy_file
+
+
+logger = logging.getLogger(__name__)
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def text_digest(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _stat_record(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+class ContextManifest:
+    """
+    Record of the content hashes of every file ansible-builder placed in a
+    build context, along with the size and mtime of those files and of their
+    sources at the time they were written.
+
+    If nothing was touched since the last run, a single stat of each file is
+    enough to tell that the context is up-to-date, and files are not
+    rewritten, which keeps their mtimes (and the container layer cache) stable.
+    """
+
+    def __init__(self, build_context, staging='copy'):
+        """
+        :param str build_context: The build context directory the manifest describes.
+        :param str staging: How files are copied to the build context, one of constants.staging_strategies.
+        """
+        self.build_context = build_context
+        self.staging = staging
+        self.path = os.path.join(build_context, constants.context_manifest_name)
+        self.entries = {}
+        self._saved_entries = {}
+        # Files found current or written since the manifest was loaded
+        self.used = set()
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    data = json.load(f)
+                if data.get('version') == constants.context_manifest_version:
+                    self.entries = data.get('files', {})
+            except (OSError, ValueError):
+                logger.debug('Ignoring unreadable build context manifest {0}'.format(self.path))
+        self._saved_entries = json.loads(json.dumps(self.entries))
+
+    def _key(self, dest):
+        return os.path.relpath(dest, self.build_context)
+
+    def get(self, dest):
+        return self.entries.get(self._key(dest))
+
+    def is_current(self, dest, source=None, digest=None):
+        """
+        Return True if dest is unchanged since it was recorded and, when
+        given, the source it was copied from is unchanged as well, or the
+        expected content digest matches the recorded one.
+        """
+        entry = self.get(dest)
+        if not entry or not os.path.exists(dest):
+            return False
+        if _stat_record(dest) != entry['dest_stat']:
+            return False
+        if digest is not None and digest != entry['sha256']:
+            return False
+        if source is not None:
+            if entry.get('source') != os.path.abspath(source) or not os.path.exists(source):
+                return False
+            if _stat_record(source) != entry['source_stat']:
+                return False
+        self.used.add(self._key(dest))
+        return True
+
+    def record(self, dest, source=None, digest=None):
+        """Record the current state of dest, and of the source it came from"""
+        entry = {
+            'sha256': digest or file_digest(dest),
+            'dest_stat': _stat_record(dest),
+        }
+        if source is not None:
+            entry['source'] = os.path.abspath(source)
+            entry['source_stat'] = _stat_record(source)
+        self.entries[self._key(dest)] = entry
+        self.used.add(self._key(dest))
+
+    def copy(self, source, dest):
+        """Copy source to dest, unless neither has changed since the last copy"""
+        if self.is_current(dest, source=source):
+            logger.debug("File {0} is already up-to-date.".format(dest))
+            return False
+        digest = None
+        if self._dest_unchanged(dest, source):
+            # Only the stat of source changed, like after a touch or a checkout:
+            # compare digests rather than copying, to keep dest and the layer cache
+            digest = file_digest(source)
+            if digest == self.get(dest)['sha256']:
+                logger.debug("File {0} is already up-to-date.".format(dest))
+                self.record(dest, source=source, digest=digest)
+                return False
+        changed = copy_file(source, dest, self.staging)
+        self.record(dest, source=source, digest=digest)
+        return changed
+
+    def _dest_unchanged(self, dest, source):
+        """Return True if dest is as recorded, or is a hardlink of source"""
+        entry = self.get(dest)
+        if not entry or entry.get('source') != os.path.abspath(source):
+            return False
+        if not os.path.exists(dest) or not os.path.exists(source):
+            return False
+        return _stat_record(dest) == entry['dest_stat'] or os.path.samefile(source, dest)
+
+    def write(self, dest, content):
+        """Write content to dest, unless dest already has this content"""
+        digest = text_digest(content)
+        if self.is_current(dest, digest=digest):
+            logger.debug("File {0} is already up-to-date.".format(dest))
+            return False
+        if os.path.exists(dest) and os.stat(dest).st_nlink > 1:
+            # Never write through a hardlink to a file outside of the build context
+            os.remove(dest)
+        with open(dest, 'w') as f:
+            f.write(content)
+        self.record(dest, digest=digest)
+        return True
+
+    def used_files(self):
+        """Return the paths, relative to the build context, of the files used since the manifest was loaded"""
+        return sorted(self.used)
+
+    def unused_files(self):
+        """Return the paths, relative to the build context, of the files recorded when
+        the manifest was loaded, and not used since. Files the manifest never recorded,
+        like ones the user added to the build context, are not part of them.
+        """
+        return sorted(key for key in self._saved_entries if key not in self.used)
+
+    def forget(self, dest):
+        """Remove the entry of dest, like after removing it"""
+        self.entries.pop(self._key(dest), None)
+
+    def save(self):
+        """Write the manifest, unless nothing changed since it was loaded"""
+        if self.entries == self._saved_entries and os.path.exists(self.path):
+            return False
+        os.makedirs(self.build_context, exist_ok=True)
+        with open(self.path, 'w') as f:
+            json.dump({'version': constants.context_manifest_version, 'files': self.entries}, f, indent=2, sort_keys=True)
+        self._saved_entries = json.loads(json.dumps(self.entries))
+        return True
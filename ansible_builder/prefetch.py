@@ -0,0 +1,156 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import yaml
+
+from .manifest import file_digest
+from .shared_galaxy import load_galaxy_requirements
+from .utils import user_cache_dir
+
+
+logger = logging.getLogger(__name__)
+
+# An exact version, as opposed to a range like >=1.0.0 or no version at all
+EXACT_VERSION = re.compile(r'^(==)?\s*\d[\w.+-]*$')
+# A full commit hash, as opposed to a branch or tag that can move
+GIT_COMMIT = re.compile(r'^[0-9a-f]{40}([0-9a-f]{24})?$')
+
+
+def default_collection_cache_dir():
+    return user_cache_dir('collections')
+
+
+def _source_type(name, source_type=None):
+    """Type of the source of a collection requirement, inferred from its name like ansible-galaxy does if not given"""
+    if source_type:
+        return source_type
+    if name.startswith('git+'):
+        return 'git'
+    if '://' in name:
+        return 'url'
+    if name.endswith(('.tar.gz', '.tgz')) or os.path.sep in name:
+        return 'file'
+    return 'galaxy'
+
+
+def requirements_are_pinned(requirements):
+    """Return True if every collection of the galaxy requirements would give the same
+    artifacts when downloaded again: collections from a galaxy server with an exact
+    version, and collections from git at a commit. The content of url and file
+    sources can change without their requirement changing, so they are never pinned.
+    """
+    for entry in requirements['collections']:
+        if isinstance(entry, str):
+            if entry.startswith('git+'):
+                name, _, version = entry.rpartition(',')
+                if not name:
+                    return False
+            else:
+                name, _, version = entry.partition(':')
+            source_type = _source_type(name)
+        else:
+            source_type = _source_type(entry.get('name', ''), entry.get('type'))
+            version = entry.get('version')
+        if not version:
+            return False
+        if source_type == 'galaxy':
+            if not EXACT_VERSION.match(str(version)):
+                return False
+        elif source_type == 'git':
+            if not GIT_COMMIT.match(str(version)):
+                return False
+        else:
+            return False
+    return True
+
+
+class CollectionCache:
+    """
+    Content-addressed store of collection tarballs, with an index of the
+    tarballs downloaded for a set of galaxy requirements.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.blobs_dir = os.path.join(cache_dir, 'blobs')
+        self.index_dir = os.path.join(cache_dir, 'index')
+
+    def blob_path(self, digest):
+        return os.path.join(self.blobs_dir, digest + '.tar.gz')
+
+    def store(self, path):
+        """Add the tarball at path to the cache, and return its digest"""
+        digest = file_digest(path)
+        blob = self.blob_path(digest)
+        if not os.path.exists(blob):
+            os.makedirs(self.blobs_dir, exist_ok=True)
+            tmp_path = '{0}.{1}.tmp'.format(blob, os.getpid())
+            shutil.copyfile(path, tmp_path)
+            os.replace(tmp_path, blob)
+        return digest
+
+    def _index_path(self, key):
+        return os.path.join(self.index_dir, key + '.json')
+
+    def get_index(self, key):
+        """Return the list of (filename, digest) recorded for key, if all of these tarballs are cached"""
+        try:
+            with open(self._index_path(key), 'r') as f:
+                entries = [tuple(entry) for entry in json.load(f)]
+        except (OSError, ValueError):
+            return None
+        if all(os.path.exists(self.blob_path(digest)) for filename, digest in entries):
+            return entries
+        return None
+
+    def set_index(self, key, entries):
+        try:
+            os.makedirs(self.index_dir, exist_ok=True)
+            tmp_path = '{0}.{1}.tmp'.format(self._index_path(key), os.getpid())
+            with open(tmp_path, 'w') as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, self._index_path(key))
+        except OSError:
+            # The index is an optimization only
+            pass
+
+
+def fetch_collections(requirements_file, cache, download, cache_key_extra=''):
+    """
+    Return the list of (filename, blob path) of the collection tarballs, dependencies
+    included, needed to install the collections of a galaxy requirements file.
+
+    :param str requirements_file: Galaxy requirements file.
+    :param CollectionCache cache: Cache the tarballs are stored in.
+    :param download: Called with a directory to download all of the tarballs into.
+    :param str cache_key_extra: Anything else affecting the downloaded tarballs, like galaxy options.
+    """
+    with open(requirements_file, 'rb') as f:
+        key = hashlib.sha256(f.read() + cache_key_extra.encode('utf-8')).hexdigest()
+    pinned = requirements_are_pinned(load_galaxy_requirements(requirements_file))
+
+    entries = cache.get_index(key) if pinned else None
+    if entries is not None:
+        logger.debug('Using the cached collection tarballs for {0}'.format(requirements_file))
+    else:
+        with tempfile.TemporaryDirectory(prefix='ansible-builder-download-') as download_dir:
+            download(download_dir)
+            entries = [
+                (filename, cache.store(os.path.join(download_dir, filename)))
+                for filename in sorted(os.listdir(download_dir)) if filename.endswith('.tar.gz')
+            ]
+        if pinned:
+            cache.set_index(key, entries)
+
+    return [(filename, cache.blob_path(digest)) for filename, digest in entries]
+
+
+def collection_requirements(folder, filenames):
+    """Return the content of a galaxy requirements file installing the tarballs in folder"""
+    return yaml.safe_dump({
+        'collections': [{'name': os.path.join(folder, filename), 'type': 'file'} for filename in filenames],
+    }, sort_keys=False)
@@ -1,6 +1,12 @@
 import logging
+import re
+
 import requirements
-from pkg_resources import safe_name
+
+from packaging.version import InvalidVersion
+
+from .exceptions import RequirementConflictError
+from .specifiers import Spec, SpecifierConflict, UnverifiableSpecifiers, merge_specs
 
 
 logger = logging.getLogger(__name__)
@@ -18,6 +24,14 @@ EXCLUDE_REQUIREMENTS = frozenset((
 ))
 
 
+def safe_name(name):
+    """Convert an arbitrary string to a standard distribution name.
+    Any runs of non-alphanumeric/. characters are replaced with a single '-'.
+    This is the same normalization pkg_resources.safe_name() does.
+    """
+    return re.sub('[^A-Za-z0-9.]+', '-', name)
+
+
 def sanitize_requirements(collection_py_reqs):
     """
     Cleanup Python requirements by removing duplicates and excluded packages.
@@ -30,10 +44,12 @@ def sanitize_requirements(collection_py_reqs):
         from the user specified requirements file from the ``--user-pip`` CLI option.
 
     :returns: A finalized list of sanitized Python requirements.
+    :raises RequirementConflictError: If the version specifiers of a requirement,
+        combined over all collections, cannot be satisfied by any version.
     """
     # de-duplication
     consolidated = []
-    seen_pkgs = set()
+    seen_pkgs = {}  # package name to its entry in consolidated
 
     for collection, lines in collection_py_reqs.items():
         try:
@@ -41,18 +57,18 @@ def sanitize_requirements(collection_py_reqs):
                 if req.specifier:
                     req.name = safe_name(req.name)
                 req.collections = [collection]  # add backref for later
+                req.spec_sources = [(cmp, ver, collection) for cmp, ver in req.specs]
                 if req.name is None:
                     consolidated.append(req)
                     continue
-                if req.name in seen_pkgs:
-                    for prior_req in consolidated:
-                        if req.name == prior_req.name:
-                            prior_req.specs.extend(req.specs)
-                            prior_req.collections.append(collection)
-                            break
+                prior_req = seen_pkgs.get(req.name)
+                if prior_req is not None:
+                    prior_req.specs.extend(req.specs)
+                    prior_req.spec_sources.extend(req.spec_sources)
+                    prior_req.collections.append(collection)
                     continue
                 consolidated.append(req)
-                seen_pkgs.add(req.name)
+                seen_pkgs[req.name] = req
         except Exception as e:
             logger.warning('Warning: failed to parse requirements from {}, error: {}'.format(collection, e))
 
@@ -67,11 +83,48 @@ def sanitize_requirements(collection_py_reqs):
             # A source control requirement like git+, return as-is
             new_line = req.line
         elif req.name:
-            specs = ['{0}{1}'.format(cmp, ver) for cmp, ver in req.specs]
-            new_line = req.name + ','.join(specs)
+            new_line = req.name + ','.join(simplify_specs(req))
         else:
             raise RuntimeError('Could not process {0}'.format(req.line))
 
         sanitized.append(new_line + '  # from collection {}'.format(','.join(req.collections)))
 
     return sanitized
+
+
+def _describe(name, spec):
+    """Describe a specifier of the requirement name, and the collections it comes from"""
+    sources = spec.source if isinstance(spec.source, tuple) else (spec.source,)
+    return "'{0}{1}' from collection{2} {3}".format(name, spec, 's' if len(sources) > 1 else '', ', '.join(sources))
+
+
+def simplify_specs(req):
+    """
+    Return the minimal list of version specifiers equivalent to all the
+    specifiers collected for the requirement, like ``['>=2.0', '<3']`` for
+    ``foo>=1.0,<3`` and ``foo>=2.0``.
+
+    Requirements using versions which are not PEP 440 compliant keep all
+    of their specifiers, as they cannot be compared reliably.
+
+    :raises RequirementConflictError: If no version satisfies all of the specifiers,
+        or an ``===`` specifier cannot be compared to the others.
+    """
+    try:
+        specs = [Spec(cmp, ver, collection) for cmp, ver, collection in req.spec_sources]
+        merged = merge_specs(specs)
+    except InvalidVersion:
+        logger.debug(f'Not simplifying version specifiers of {req.name}, which are not PEP 440 compliant')
+        return ['{0}{1}'.format(cmp, ver) for cmp, ver in req.specs]
+    except UnverifiableSpecifiers as e:
+        raise RequirementConflictError(
+            f"Cannot verify the requirements for Python package '{req.name}': "
+            f"{_describe(req.name, e.first)} is not a PEP 440 version, so it "
+            f"cannot be compared to {_describe(req.name, e.second)}."
+        )
+    except SpecifierConflict as e:
+        raise RequirementConflictError(
+            f"Conflicting requirements for Python package '{req.name}': "
+            f"{_describe(req.name, e.first)} and {_describe(req.name, e.second)} cannot both be satisfied."
+        )
+    return [str(spec) for spec in merged]
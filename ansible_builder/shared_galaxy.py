@@ -0,0 +1,187 @@
+import hashlib
+import json
+import logging
+import os
+import yaml
+
+from . import constants
+from .manifest import ContextManifest, file_digest
+from .steps import AnsibleConfigSteps, BuildContextSteps, GalaxyInstallSteps
+
+
+logger = logging.getLogger(__name__)
+
+GALAXY_REQUIREMENT_TYPES = ('collections', 'roles')
+
+
+def load_galaxy_requirements(path):
+    """Return the collections and roles of a galaxy requirements file, as a dict of lists"""
+    with open(path, 'r') as f:
+        data = yaml.safe_load(f) or {}
+    if isinstance(data, list):
+        # The old format, a list of roles
+        data = {'roles': data}
+    return {kind: list(data.get(kind) or []) for kind in GALAXY_REQUIREMENT_TYPES}
+
+
+def requirement_key(entry):
+    """Key comparing galaxy requirements, so that 'ns.name' and {'name': 'ns.name'} are the same"""
+    if isinstance(entry, str):
+        entry = {'name': entry}
+    return json.dumps(entry, sort_keys=True)
+
+
+def common_requirements(all_requirements):
+    """Return the requirements found in every one of the requirements given,
+    in the order of the first one.
+    """
+    common = {}
+    for kind in GALAXY_REQUIREMENT_TYPES:
+        keys = [set(requirement_key(entry) for entry in requirements[kind]) for requirements in all_requirements]
+        shared = set.intersection(*keys) if keys else set()
+        common[kind] = [entry for entry in all_requirements[0][kind] if requirement_key(entry) in shared]
+    return common
+
+
+def subtract_requirements(requirements, common):
+    """Return the requirements which are not in common"""
+    delta = {}
+    for kind in GALAXY_REQUIREMENT_TYPES:
+        common_keys = set(requirement_key(entry) for entry in common[kind])
+        delta[kind] = [entry for entry in requirements[kind] if requirement_key(entry) not in common_keys]
+    return delta
+
+
+def _optional_digest(path):
+    return file_digest(path) if path else None
+
+
+def galaxy_stage_key(builder):
+    """Definitions can only share a galaxy image if their galaxy stages would be
+    the same, apart from the collections they install.
+    """
+    definition = builder.definition
+    return (
+        builder.build_args.get('EE_BASE_IMAGE') or definition.build_arg_defaults['EE_BASE_IMAGE'],
+        builder.build_args.get('ANSIBLE_GALAXY_CLI_COLLECTION_OPTS',
+                               definition.build_arg_defaults['ANSIBLE_GALAXY_CLI_COLLECTION_OPTS']),
+        _optional_digest(definition.ansible_config),
+        _optional_digest(builder.galaxy_keyring),
+        builder.galaxy_required_valid_signature_count,
+        tuple(builder.galaxy_ignore_signature_status_codes or ()),
+        builder.containerfile.cache_mounts,
+        builder.driver.name,
+    )
+
+
+class SharedGalaxyImage:
+    """
+    An image holding the collections and roles that several execution
+    environments all install. The galaxy stage of each of these execution
+    environments starts from this image, and only installs the rest of its
+    requirements.
+    """
+
+    def __init__(self, builders, requirements, build_context, cache_from=None, cache_to=None):
+        """
+        :param list builders: AnsibleBuilder instances with the same galaxy_stage_key().
+        :param dict requirements: Galaxy requirements common to all of the builders.
+        :param str build_context: Directory the build context of the image is created in.
+        :param list cache_from: Locations to import the layer cache from, where {name} is replaced by the image name.
+        :param str cache_to: Location to export the layer cache to, where {name} is replaced by the image name.
+        """
+        self.builders = builders
+        self.requirements = requirements
+        first = builders[0]
+        self.key = galaxy_stage_key(first)
+        self.base_image, self.galaxy_opts = self.key[:2]
+        digest = hashlib.sha256(json.dumps([self.key, requirements], sort_keys=True).encode('utf-8')).hexdigest()[:12]
+        self.name = f'_galaxy-{digest}'
+        self.tag = constants.shared_galaxy_tag.format(digest=digest)
+        self.build_context = os.path.join(build_context, self.name)
+        self.build_outputs_dir = os.path.join(self.build_context, constants.user_content_subfolder)
+        self.containerfile_path = os.path.join(self.build_context, constants.runtime_files[first.container_runtime])
+        self.log_file = os.path.join(build_context, f'{self.name}.log')
+        self.cache_from = [location.format(name=self.name) for location in cache_from or []]
+        self.cache_to = cache_to.format(name=self.name) if cache_to else None
+
+    def create(self):
+        """Write the build context of the image"""
+        first = self.builders[0]
+        manifest = ContextManifest(self.build_context, staging=first.containerfile.manifest.staging)
+        os.makedirs(self.build_outputs_dir, exist_ok=True)
+
+        manifest.write(os.path.join(self.build_outputs_dir, constants.CONTEXT_FILES['galaxy']),
+                       yaml.safe_dump(self.requirements, sort_keys=False))
+        steps = [
+            f"ARG EE_BASE_IMAGE={self.base_image}",
+            "FROM $EE_BASE_IMAGE",
+            f"ARG ANSIBLE_GALAXY_CLI_COLLECTION_OPTS={self.galaxy_opts}",
+            "USER root",
+            "",
+        ]
+        if first.definition.ansible_config:
+            manifest.copy(first.definition.ansible_config, os.path.join(self.build_outputs_dir, 'ansible.cfg'))
+            steps.extend(AnsibleConfigSteps(os.path.join(constants.user_content_subfolder, 'ansible.cfg')))
+        keyring = None
+        if first.galaxy_keyring:
+            keyring = constants.default_keyring_name
+            manifest.copy(first.galaxy_keyring, os.path.join(self.build_outputs_dir, keyring))
+        steps.extend(BuildContextSteps())
+        steps.extend(GalaxyInstallSteps(constants.CONTEXT_FILES['galaxy'], keyring,
+                                        first.galaxy_ignore_signature_status_codes,
+                                        first.galaxy_required_valid_signature_count,
+                                        cache_mounts=first.containerfile.cache_mounts))
+        manifest.write(self.containerfile_path, ''.join(step + '\n' for step in steps))
+        manifest.save()
+        return True
+
+    @property
+    def driver(self):
+        return self.builders[0].driver
+
+    @property
+    def build_command(self):
+        # The builders share EE_BASE_IMAGE and ANSIBLE_GALAXY_CLI_COLLECTION_OPTS, see galaxy_stage_key()
+        first = self.builders[0]
+        return self.driver.build_command(self.containerfile_path, self.build_context, tags=[self.tag],
+                                         build_args=first.build_args, no_cache=first.no_cache,
+                                         cache_from=self.cache_from, cache_to=self.cache_to)
+
+    @property
+    def build_env(self):
+        return self.driver.build_env(cache_mounts=self.builders[0].containerfile.cache_mounts)
+
+
+def plan_shared_galaxy_images(builders, build_context, cache_from=None, cache_to=None):
+    """Group builders whose galaxy stages can share an image, and make each of them
+    install only the requirements missing from the image of its group.
+
+    :param dict builders: AnsibleBuilder instances keyed by definition name.
+    :param list cache_from: Locations to import the layer cache of the images from, see SharedGalaxyImage.
+    :param str cache_to: Location to export the layer cache of the images to, see SharedGalaxyImage.
+    :returns: The list of SharedGalaxyImage to build before the builders.
+    """
+    groups = {}
+    for builder in builders.values():
+        galaxy_file = builder.definition.get_dep_abs_path('galaxy')
+        if galaxy_file:
+            groups.setdefault(galaxy_stage_key(builder), []).append((builder, load_galaxy_requirements(galaxy_file)))
+
+    images = []
+    for members in groups.values():
+        if len(members) < 2:
+            continue
+        common = common_requirements([requirements for builder, requirements in members])
+        if not any(common.values()):
+            continue
+        image = SharedGalaxyImage([builder for builder, requirements in members], common, build_context,
+                                  cache_from=cache_from, cache_to=cache_to)
+        for builder, requirements in members:
+            builder.containerfile.galaxy_base_image = image.tag
+            builder.containerfile.galaxy_requirements = subtract_requirements(requirements, common)
+        images.append(image)
+        logger.debug('Collections and roles shared by {0}: {1}'.format(
+            ', '.join(os.path.basename(builder.build_context) for builder in image.builders),
+            ', '.join(str(entry) for kind in GALAXY_REQUIREMENT_TYPES for entry in common[kind])))
+    return images
@@ -0,0 +1,188 @@
+from packaging.specifiers import Specifier
+from packaging.version import InvalidVersion, Version
+
+
+class SpecifierConflict(Exception):
+    """Two specifiers of the same requirement cannot both be satisfied"""
+
+    def __init__(self, first, second):
+        super().__init__(first, second)
+        self.first = first
+        self.second = second
+
+
+class UnverifiableSpecifiers(SpecifierConflict):
+    """An arbitrary equality (``===``) specifier is combined with specifiers it cannot be compared to"""
+
+
+class Spec:
+    """A single version specifier, like ``>=1.0``, and the collection requiring it,
+    or a tuple of the collections when it was derived from the specifiers of several.
+    """
+
+    def __init__(self, operator, version, source=None):
+        self.operator = operator
+        self.version = version
+        self.source = source
+        self.wildcard = version.endswith('.*')
+        # === compares strings, and wildcards match a whole series, so neither has a single version
+        self.parsed = None if (self.wildcard or operator == '===') else Version(version)
+        # ~= or wildcard spec a bound was derived from, see _compatible_release_bounds() and _wildcard_bounds()
+        self.origin = None
+
+    def __str__(self):
+        return self.operator + self.version
+
+    def contains(self, version):
+        return Specifier(str(self)).contains(version, prereleases=True)
+
+
+def _compatible_release_bounds(spec):
+    """Return the >= and < specs equivalent to a ~= spec"""
+    release = spec.parsed.release
+    prefix = list(release[:-1]) if len(release) > 1 else list(release)
+    prefix[-1] += 1
+    bounds = [
+        Spec('>=', spec.version, spec.source),
+        Spec('<', '.'.join(str(part) for part in prefix), spec.source),
+    ]
+    for bound in bounds:
+        bound.origin = spec
+    return bounds
+
+
+def _wildcard_bounds(spec):
+    """Return the >= and < specs equivalent to a ==X.* spec, like >=1.2 and <1.3 for ==1.2.*"""
+    release = list(Version(spec.version[:-2]).release)
+    upper = release[:-1] + [release[-1] + 1]
+    bounds = [
+        Spec('>=', '.'.join(str(part) for part in release), spec.source),
+        Spec('<', '.'.join(str(part) for part in upper), spec.source),
+    ]
+    for bound in bounds:
+        bound.parsed = Version(bound.version)
+        bound.origin = spec
+    return bounds
+
+
+def _reported(spec):
+    """The spec a collection actually gave, rather than a bound derived from it"""
+    return spec.origin or spec
+
+
+def _sources(spec):
+    """The collections which gave spec, as a tuple"""
+    return spec.source if isinstance(spec.source, tuple) else (spec.source,)
+
+
+def _conflict(first, second):
+    return SpecifierConflict(_reported(first), _reported(second))
+
+
+def _stricter_lower(first, second):
+    if first is None:
+        return second
+    if second.parsed != first.parsed:
+        return second if second.parsed > first.parsed else first
+    return second if second.operator == '>' else first
+
+
+def _stricter_upper(first, second):
+    if first is None:
+        return second
+    if second.parsed != first.parsed:
+        return second if second.parsed < first.parsed else first
+    return second if second.operator == '<' else first
+
+
+def merge_specs(specs):
+    """
+    Intersect the version specifiers of a requirement, and return the equivalent
+    minimal list of Spec: at most one lower and one upper bound (or a single
+    ``==`` pin), followed by the exclusions that fall within those bounds.
+
+    :param list specs: List of Spec, possibly coming from several collections.
+    ``==X.*`` wildcards are intersected as the equivalent ``>=X,<X+1`` range.
+
+    :raises SpecifierConflict: With the two specs that cannot both be satisfied.
+    :raises UnverifiableSpecifiers: If an ``===`` spec which is not a PEP 440 version
+        is combined with other specs.
+    :raises InvalidVersion: If a version is not a PEP 440 version.
+    """
+    lower = upper = None
+    pins = []
+    exclusions = []
+    opaque = []  # !=X.* exclusions, which are kept as they are
+    for spec in specs:
+        if spec.operator == '===':
+            pins.append(spec)
+        elif spec.wildcard and spec.operator == '==':
+            ge, lt = _wildcard_bounds(spec)
+            lower = _stricter_lower(lower, ge)
+            upper = _stricter_upper(upper, lt)
+        elif spec.wildcard:
+            if not any(str(spec) == str(other) for other in opaque):
+                opaque.append(spec)
+        elif spec.operator == '~=':
+            ge, lt = _compatible_release_bounds(spec)
+            lower = _stricter_lower(lower, ge)
+            upper = _stricter_upper(upper, lt)
+        elif spec.operator in ('>=', '>'):
+            lower = _stricter_lower(lower, spec)
+        elif spec.operator in ('<=', '<'):
+            upper = _stricter_upper(upper, spec)
+        elif spec.operator == '==':
+            pins.append(spec)
+        elif spec.operator == '!=':
+            exclusions.append(spec)
+
+    if pins:
+        # An === pin is only comparable to the other specifiers if it is a PEP 440 version
+        pins.sort(key=lambda spec: spec.operator == '===')
+        pin = pins[0]
+        for spec in specs:
+            if spec is pin or str(spec) == str(pin):
+                continue
+            if pin.operator == '===' or spec.operator == '===':
+                try:
+                    version = Version(pin.version)
+                except InvalidVersion:
+                    raise UnverifiableSpecifiers(pin, spec)
+            else:
+                version = pin.parsed
+            if not spec.contains(version):
+                raise _conflict(pin, spec)
+        return [pin]
+
+    if lower is not None and upper is not None:
+        if lower.parsed > upper.parsed:
+            raise _conflict(lower, upper)
+        if lower.parsed == upper.parsed:
+            if lower.operator == '>' or upper.operator == '<':
+                raise _conflict(lower, upper)
+            # The pin comes from both bounds, so a conflict with it names the collections of both
+            sources = tuple(dict.fromkeys(_sources(lower) + _sources(upper)))
+            pin = Spec('==', lower.version, sources if len(sources) > 1 else sources[0])
+            for spec in exclusions + opaque:
+                if not spec.contains(pin.parsed):
+                    raise _conflict(pin, spec)
+            return [pin]
+
+    for spec in opaque:
+        # A !=X.* exclusion of the whole range left by the bounds cannot be satisfied
+        excluded = _wildcard_bounds(spec)
+        if lower is not None and upper is not None and \
+                lower.parsed >= excluded[0].parsed and upper.parsed <= excluded[1].parsed:
+            raise _conflict(lower, spec)
+
+    merged = [bound for bound in (lower, upper) if bound is not None]
+    seen = set()
+    for spec in sorted(exclusions, key=lambda spec: spec.parsed):
+        if spec.parsed in seen or not all(bound.contains(spec.parsed) for bound in merged):
+            continue  # already excluded by a bound
+        seen.add(spec.parsed)
+        merged.append(spec)
+    if lower is not None and lower.origin is not None and upper is not None and \
+            str(upper.origin) == str(lower.origin):
+        merged[:2] = [lower.origin]  # both bounds come from the same wildcard, which is shorter
+    return merged + opaque
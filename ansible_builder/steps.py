@@ -1,10 +1,48 @@
+import json
 import sys
 import os
+import shlex
 
 from . import constants
 from .exceptions import DefinitionError
 
 
+def cache_mount_options(*caches):
+    """Return the RUN options mounting the named download caches from constants.CACHE_MOUNTS.
+    The cache ids are shared by all stages and images, so each cache is only filled once.
+    """
+    options = []
+    for cache in caches:
+        target, sharing = constants.CACHE_MOUNTS[cache]
+        options.append(f"--mount=type=cache,id=ansible-builder-{cache},target={target},sharing={sharing}")
+    return ' '.join(options)
+
+
+def context_sources(steps):
+    """Return the sources, relative to the build context, which the COPY and ADD
+    instructions of steps take from the build context. Sources may be patterns.
+    """
+    sources = []
+    for step in steps:
+        instruction, _, arguments = step.strip().partition(' ')
+        if instruction.upper() not in ('COPY', 'ADD'):
+            continue
+        arguments = arguments.strip()
+        options = []
+        while arguments.startswith('--'):
+            option, _, arguments = arguments.partition(' ')
+            options.append(option)
+            arguments = arguments.strip()
+        if any(option.startswith('--from') for option in options):
+            continue  # copied from another stage or image
+        try:
+            paths = json.loads(arguments) if arguments.startswith('[') else shlex.split(arguments)
+        except ValueError:
+            continue
+        sources.extend(os.path.normpath(path).lstrip('/') for path in paths[:-1] if '://' not in path)
+    return sources
+
+
 class Steps:
     def __iter__(self):
         return iter(self.steps)
@@ -42,17 +80,38 @@ class BuildContextSteps(Steps):
         ]
 
 
+class ContextFileSteps(Steps):
+    def __init__(self, context_files):
+        """Adds individual files from the build context folder to /build, one step
+        per file, so a change to one file only invalidates the layers from its step on.
+
+        :param list context_files: Names of the files inside the build context folder.
+        """
+        self.steps = ["WORKDIR /build"]
+        for context_file in context_files:
+            self.steps.append("ADD {0}/{1} {1}".format(constants.user_content_subfolder, context_file))
+        self.steps.append("")
+
+
 class GalaxyInstallSteps(Steps):
-    def __init__(self, requirements_naming, galaxy_keyring, galaxy_ignore_signature_status_codes, galaxy_required_valid_signature_count):
+    def __init__(self, requirements_naming, galaxy_keyring, galaxy_ignore_signature_status_codes, galaxy_required_valid_signature_count,
+                 cache_mounts=False, collection_requirements=None):
         """Assumes given requirements file name and keyring has been placed in the build context.
 
         :param str galaxy_keyring: GPG keyring file used by ansible-galaxy to opportunistically validate collection signatures.
         :param str galaxy_required_valid_signature_count: Number of sigs (prepend + to disallow no sig) required for ansible-galaxy to accept collections.
         :param str galaxy_ignore_signature_status_codes: GPG Status codes to ignore when validating galaxy collections.
+        :param bool cache_mounts: Mount a persistent ansible-galaxy download cache into the collection install step.
+        :param str collection_requirements: Requirements file listing collection tarballs in the build context,
+            dependencies included, to install collections from instead of requirements_naming.
         """
 
         env = ""
-        install_opts = f"-r {requirements_naming} --collections-path \"{constants.base_collections_path}\""
+        if collection_requirements:
+            # All dependencies were downloaded with the collections, nothing needs to be resolved
+            install_opts = f"-r {collection_requirements} --no-deps --collections-path \"{constants.base_collections_path}\""
+        else:
+            install_opts = f"-r {requirements_naming} --collections-path \"{constants.base_collections_path}\""
 
         if galaxy_ignore_signature_status_codes:
             for code in galaxy_ignore_signature_status_codes:
@@ -71,9 +130,13 @@ class GalaxyInstallSteps(Steps):
             # in the final image.
             env = "ANSIBLE_GALAXY_DISABLE_GPG_VERIFY=1 "
 
+        run = "RUN "
+        if cache_mounts and not collection_requirements:
+            run += cache_mount_options('galaxy') + " "
+
         self.steps = [
             f"RUN ansible-galaxy role install -r {requirements_naming} --roles-path \"{constants.base_roles_path}\"",
-            f"RUN {env}ansible-galaxy collection install $ANSIBLE_GALAXY_CLI_COLLECTION_OPTS {install_opts}",
+            f"{run}{env}ansible-galaxy collection install $ANSIBLE_GALAXY_CLI_COLLECTION_OPTS {install_opts}",
         ]
 
 
@@ -0,0 +1,229 @@
+import logging
+import re
+
+from .introspect import line_is_empty
+
+
+logger = logging.getLogger(__name__)
+
+# name [selectors] version, as in the bindep grammar
+BINDEP_LINE = re.compile(
+    r'^(?P<name>[A-Za-z0-9/][A-Za-z0-9.+\-_/]+)'
+    r'(?:\s+\[(?P<selectors>[^\]]*)\])?'
+    r'(?:\s+(?P<version>(?:<=|<|!=|==|>=|>)\S+))?$'
+)
+SELECTOR_TOKEN = re.compile(r'\([^)]*\)|[^\s()]+')
+
+
+class SelectorSet:
+    """The selectors of one bindep partition (platform or user profiles).
+
+    Like bindep, the set matches if none of the negative selectors is active and,
+    when there are positive selectors, at least one of them is active.
+    Groups like ``(platform:rpm compile)`` are kept, but are never merged.
+    """
+
+    def __init__(self, positive=(), negative=(), groups=()):
+        self.positive = list(positive)
+        self.negative = list(negative)
+        self.groups = list(groups)
+
+    def __eq__(self, other):
+        return (set(self.positive), set(self.negative), set(self.groups)) == \
+            (set(other.positive), set(other.negative), set(other.groups))
+
+    def is_empty(self):
+        return not (self.positive or self.negative or self.groups)
+
+    def covers(self, other):
+        """Return True if this set matches whenever the other set matches"""
+        if self.is_empty():
+            return True
+        if self.groups or other.groups:
+            return self == other
+        if not set(self.negative) <= set(other.negative):
+            return False
+        if not self.positive:
+            return True
+        return bool(other.positive) and set(other.positive) <= set(self.positive)
+
+    def can_union(self, other):
+        """Return True if the union of the positive selectors matches exactly
+        when either set matches.
+        """
+        return (
+            not self.groups and not other.groups and self.positive and other.positive
+            and set(self.negative) == set(other.negative)
+        )
+
+    def union(self, other):
+        return SelectorSet(
+            self.positive + [label for label in other.positive if label not in self.positive],
+            self.negative,
+        )
+
+    def evaluate(self, profiles):
+        """Return whether the selectors match the active profiles, or None if
+        that depends on labels missing from profiles.
+        """
+        if self.groups:
+            return None
+        if any(label in profiles for label in self.negative):
+            return False
+        if not self.positive:
+            return True
+        return any(label in profiles for label in self.positive)
+
+    def tokens(self):
+        return self.positive + ['!' + label for label in self.negative] + self.groups
+
+
+class BindepRule:
+    """A single package entry of a bindep file, and the collections listing it"""
+
+    def __init__(self, name, platform, user, version, collections):
+        self.name = name
+        self.platform = platform
+        self.user = user
+        self.version = version
+        self.collections = collections
+
+    @classmethod
+    def parse(cls, line, collection):
+        """Return the BindepRule for a bindep line, or None if it cannot be parsed"""
+        match = BINDEP_LINE.match(line)
+        if match is None:
+            return None
+        partitions = {'platform': SelectorSet(), 'user': SelectorSet()}
+        for token in SELECTOR_TOKEN.findall(match.group('selectors') or ''):
+            if token.startswith('('):
+                # bindep evaluates groups with the user profiles
+                partitions['user'].groups.append(token)
+                continue
+            label = token.lstrip('!')
+            partition = partitions['platform' if label.startswith('platform:') else 'user']
+            if token.startswith('!'):
+                partition.negative.append(label)
+            else:
+                partition.positive.append(label)
+        return cls(match.group('name'), partitions['platform'], partitions['user'],
+                   match.group('version') or '', [collection])
+
+    def covers(self, other):
+        return (
+            self.name == other.name and self.version == other.version
+            and self.platform.covers(other.platform) and self.user.covers(other.user)
+        )
+
+    def merge(self, other):
+        """Return a rule matching exactly when this rule or the other does, or None"""
+        if self.name != other.name or self.version != other.version:
+            return None
+        collections = self.collections + [c for c in other.collections if c not in self.collections]
+        if self.covers(other):
+            return BindepRule(self.name, self.platform, self.user, self.version, collections)
+        if other.covers(self):
+            return BindepRule(self.name, other.platform, other.user, self.version, collections)
+        if self.user == other.user and self.platform.can_union(other.platform):
+            return BindepRule(self.name, self.platform.union(other.platform), self.user, self.version, collections)
+        if self.platform == other.platform and self.user.can_union(other.user):
+            return BindepRule(self.name, self.platform, self.user.union(other.user), self.version, collections)
+        return None
+
+    def line(self):
+        parts = [self.name]
+        tokens = self.platform.tokens() + self.user.tokens()
+        if tokens:
+            parts.append('[{0}]'.format(' '.join(tokens)))
+        if self.version:
+            parts.append(self.version)
+        return ' '.join(parts)
+
+
+def detect_platform_profiles():
+    """Return the bindep platform profiles, like ``platform:rpm``, of the running system,
+    or None if they cannot be determined.
+    """
+    from bindep.depends import Depends
+
+    try:
+        return Depends('').platform_profiles()
+    except Exception as e:
+        logger.warning(f'Warning: failed to detect the platform, system requirements will not be filtered: {e}')
+        return None
+
+
+def sanitize_system_requirements(collection_sys_reqs, platforms=None):
+    """
+    Combine bindep requirements, merging the entries for the same package.
+
+    Entries are merged when the result applies in exactly the same cases as the
+    original entries: entries covered by a less restrictive entry are dropped, and
+    entries that only differ by their positive profiles or platforms are combined
+    into one entry listing all of them. Lines which cannot be parsed are kept as-is.
+
+    :param dict collection_sys_reqs: A dict of lists of bindep requirements, keyed
+        by fully qualified collection name, like for ``simple_combine()``.
+    :param list platforms: The bindep platform profiles of the system the requirements
+        will be installed on. If given, entries that cannot apply to that platform
+        are dropped, and the platform selectors of the others are removed.
+
+    :returns: A list of bindep lines with comments naming the source collections.
+    """
+    rules = []  # BindepRule, (line, collections) for lines kept as-is, or None once merged
+    unrecognized = {}  # lines kept as-is to their entry in rules
+    by_name = {}  # package name to its rules, in the order they were first seen
+    for collection, lines in collection_sys_reqs.items():
+        for line in lines:
+            if line_is_empty(line):
+                continue
+            base_line = line.split('#')[0].strip()
+            rule = BindepRule.parse(base_line, collection)
+            if rule is None:
+                logger.debug(f'Keeping unrecognized bindep line from {collection} as-is: {base_line}')
+                if base_line in unrecognized:
+                    unrecognized[base_line][1].append(collection)
+                else:
+                    unrecognized[base_line] = (base_line, [collection])
+                    rules.append(unrecognized[base_line])
+                continue
+
+            if platforms is not None:
+                applies = rule.platform.evaluate(platforms)
+                if applies is False:
+                    logger.debug(f'# Excluding {base_line} from {collection}, which does not apply to {platforms}')
+                    continue
+                if applies:
+                    rule.platform = SelectorSet()
+
+            candidates = by_name.setdefault(rule.name, [])
+            index = None  # position of the rule in rules, once merged into an earlier one
+            while True:
+                # A merged rule may in turn cover, or combine with, another earlier rule
+                merges = ((existing, existing.merge(rule)) for existing in candidates)
+                existing, combined = next(((e, c) for e, c in merges if c is not None), (None, None))
+                if combined is None:
+                    break
+                candidates.remove(existing)
+                existing_index = rules.index(existing)
+                if index is not None and index < existing_index:
+                    rules[existing_index] = None
+                else:
+                    if index is not None:
+                        rules[index] = None
+                    index = existing_index
+                rules[index] = rule = combined
+            if index is None:
+                rules.append(rule)
+            candidates.append(rule)
+
+    sanitized = []
+    for rule in rules:
+        if rule is None:
+            continue  # merged into another rule
+        if isinstance(rule, BindepRule):
+            line, collections = rule.line(), rule.collections
+        else:
+            line, collections = rule
+        sanitized.append(line + '  # from collection {}'.format(', '.join(collections)))
+    return sanitized
@@ -0,0 +1,119 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Span:
+    """A timed phase of the build, in the shape of an OpenTelemetry span"""
+
+    def __init__(self, name, span_id, parent_id=None, start=None, attributes=None):
+        self.name = name
+        self.span_id = span_id
+        self.parent_id = parent_id
+        # Wall clock for reporting, monotonic clock for durations
+        self.start_time = time.time() if start is None else start
+        self.start = time.monotonic()
+        self.duration = None
+        self.attributes = attributes or {}
+
+    def end(self, duration=None):
+        self.duration = time.monotonic() - self.start if duration is None else duration
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'start': self.start_time,
+            'duration': round(self.duration, 6) if self.duration is not None else None,
+            'attributes': self.attributes,
+        }
+
+    def as_otel(self, trace_id):
+        end_time = self.start_time + (self.duration or 0)
+        return {
+            'traceId': trace_id,
+            'spanId': self.span_id,
+            'parentSpanId': self.parent_id or '',
+            'name': self.name,
+            'startTimeUnixNano': int(self.start_time * 1e9),
+            'endTimeUnixNano': int(end_time * 1e9),
+            'attributes': [
+                {'key': key, 'value': {'stringValue': str(value)}} for key, value in self.attributes.items()
+            ],
+        }
+
+
+class Timings:
+    """Records the duration of the phases of a command, as nested spans.
+
+    Spans are recorded with the span() context manager, and can be written as a
+    JSON report of durations with report(), or exported in the OpenTelemetry JSON
+    format, one span per line, with export_spans().
+    """
+
+    def __init__(self):
+        self.trace_id = os.urandom(16).hex()
+        self.spans = []
+        self._local = threading.local()
+
+    def _current(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def start_span(self, name, **attributes):
+        """Start a span, child of the innermost span of the current thread. End it with end_span()."""
+        stack = self._current()
+        parent_id = stack[-1].span_id if stack else None
+        span = Span(name, os.urandom(8).hex(), parent_id, attributes=attributes)
+        self.spans.append(span)
+        stack.append(span)
+        return span
+
+    def end_span(self, span):
+        span.end()
+        stack = self._current()
+        if span in stack:
+            stack.remove(span)
+        return span
+
+    @contextmanager
+    def span(self, name, **attributes):
+        span = self.start_span(name, **attributes)
+        try:
+            yield span
+        finally:
+            self.end_span(span)
+
+    def add_span(self, name, start_time, duration, parent=None, **attributes):
+        """Record a span which was timed elsewhere, like a stage of the container build"""
+        span = Span(name, os.urandom(8).hex(), parent.span_id if parent else None, start=start_time, attributes=attributes)
+        span.end(duration)
+        self.spans.append(span)
+        return span
+
+    def report(self):
+        return {'spans': [span.as_dict() for span in self.spans if span.duration is not None]}
+
+    def write_report(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+            f.write('\n')
+
+    def write(self, timings_file=None, trace_file=None):
+        """Write the report to timings_file, - for stdout, and append the spans to trace_file, if given"""
+        if timings_file == '-':
+            print(json.dumps(self.report(), indent=2))
+        elif timings_file:
+            self.write_report(timings_file)
+        if trace_file:
+            self.export_spans(trace_file)
+
+    def export_spans(self, filename):
+        """Append the spans to filename in the OpenTelemetry JSON format, one per line"""
+        with open(filename, 'a') as f:
+            for span in self.spans:
+                if span.duration is not None:
+                    f.write(json.dumps(span.as_otel(self.trace_id)) + '\n')
@@ -14,6 +14,8 @@ ALLOWED_KEYS = [
     'additional_build_steps',
 ]
 
+DEPENDENCY_KEYS = list(constants.CONTEXT_FILES) + list(constants.CONTEXT_DIRECTORIES)
+
 
 class UserDefinition:
     """
@@ -54,7 +56,7 @@ class UserDefinition:
                     f"""
                     Error: Unknown type {type(self.raw.get('dependencies'))} found for dependencies, must be a dict.\n
                     Allowed options are:
-                    {list(constants.CONTEXT_FILES.keys())}
+                    {DEPENDENCY_KEYS}
                     """)
                 )
 
@@ -88,12 +90,21 @@ class UserDefinition:
         commands = self.raw.get('additional_build_steps')
         return commands
 
+    @property
+    def wheels_no_index(self):
+        """ Whether pip installs only from the wheels directory, rather than from it and the package index """
+        wheels = self.raw.get('dependencies', {}).get('wheels')
+        return isinstance(wheels, dict) and bool(wheels.get('no_index'))
+
     def get_dep_abs_path(self, entry):
         """Unique to the user EE definition, files can be referenced by either
         an absolute path or a path relative to the EE definition folder
         This method will return the absolute path.
         """
         req_file = self.raw.get('dependencies', {}).get(entry)
+        if isinstance(req_file, dict):
+            # Like wheels: {path: wheels, no_index: true}
+            req_file = req_file.get('path')
 
         if not req_file:
             return None
@@ -122,22 +133,41 @@ class UserDefinition:
 
         if self.raw.get('dependencies') is not None:
             dependencies_keys = set(self.raw.get('dependencies'))
-            invalid_dependencies_keys = dependencies_keys - set(constants.CONTEXT_FILES.keys())
+            invalid_dependencies_keys = dependencies_keys - set(DEPENDENCY_KEYS)
             if invalid_dependencies_keys:
                 raise DefinitionError(textwrap.dedent(
                     f"""
                     Error: Unknown yaml key(s), {invalid_dependencies_keys}, found in dependencies.\n
                     Allowed options are:
-                    {list(constants.CONTEXT_FILES.keys())}
+                    {DEPENDENCY_KEYS}
                     """)
                 )
 
+            wheels = self.raw['dependencies'].get('wheels')
+            if isinstance(wheels, dict):
+                unexpected_keys = set(wheels) - {'path', 'no_index'}
+                if unexpected_keys:
+                    raise DefinitionError(f"Keys {unexpected_keys} are not allowed in 'dependencies.wheels'.")
+                if 'path' not in wheels:
+                    raise DefinitionError("Expected a 'path' key in 'dependencies.wheels'.")
+                wheels = wheels['path']
+            if wheels is not None and not isinstance(wheels, str):
+                raise DefinitionError(
+                    f"Expected 'dependencies.wheels' to be a directory, or a dictionary with keys 'path' "
+                    f"and 'no_index'; found a {type(wheels).__name__} instead."
+                )
+
         for item in constants.CONTEXT_FILES:
             requirement_path = self.get_dep_abs_path(item)
             if requirement_path:
                 if not os.path.exists(requirement_path):
                     raise DefinitionError(f"Dependency file {requirement_path} does not exist.")
 
+        for item in constants.CONTEXT_DIRECTORIES:
+            directory = self.get_dep_abs_path(item)
+            if directory and not os.path.isdir(directory):
+                raise DefinitionError(f"Dependency directory {directory} does not exist.")
+
         build_arg_defaults = self.raw.get('build_arg_defaults')
         if build_arg_defaults:
             if not isinstance(build_arg_defaults, dict):
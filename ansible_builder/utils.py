@@ -1,4 +1,5 @@
-import filecmp
+import codecs
+import errno
 import logging
 import logging.config
 import os
@@ -20,6 +21,12 @@ logging_levels = {
 }
 
 
+def user_cache_dir(name):
+    """Return the directory of the named ansible-builder cache, in $XDG_CACHE_HOME or ~/.cache"""
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'ansible-builder', name)
+
+
 class ColorFilter(logging.Filter):
     color_map = {
         'ERROR': MessageColors.FAIL,
@@ -28,8 +35,13 @@ class ColorFilter(logging.Filter):
         'DEBUG': MessageColors.OK
     }
 
+    def __init__(self, name=''):
+        super().__init__(name)
+        # Checked once, rather than for every record
+        self.isatty = sys.stdout.isatty()
+
     def filter(self, record):
-        if sys.stdout.isatty():
+        if self.isatty:
             record.msg = self.color_map[record.levelname] + record.msg + MessageColors.ENDC
         return record
 
@@ -56,18 +68,76 @@ LOGGING = {
 }
 
 
+def detect_container_runtime():
+    """Return the container runtime to use when none was selected: podman if
+    it is installed, docker otherwise. This looks through PATH, so it is only
+    done when a runtime is actually needed.
+    """
+    if shutil.which(constants.default_container_runtime):
+        return constants.default_container_runtime
+    return 'docker'
+
+
 def configure_logger(verbosity):
     LOGGING['loggers']['ansible_builder']['level'] = logging_levels[str(verbosity)]
     logging.config.dictConfig(LOGGING)
 
 
-def run_command(command, capture_output=False, allow_error=False):
+# Size of the reads of command output
+OUTPUT_CHUNK_SIZE = 64 * 1024
+
+
+def _read_output_lines(stream, log_file=None, echo=False):
+    """Yield the lines of output read from stream, without line ends.
+    Output is read in large chunks and decoded incrementally.
+
+    :param log_file: Open file object the decoded output is also written to.
+    :param bool echo: Write the decoded output straight to stdout.
+    """
+    decoder = codecs.getincrementaldecoder(sys.stdout.encoding or 'utf-8')(errors='replace')
+    pending = ''
+    while True:
+        chunk = stream.read1(OUTPUT_CHUNK_SIZE)
+        text = decoder.decode(chunk, final=not chunk)
+        if text:
+            if log_file is not None:
+                log_file.write(text)
+            if echo:
+                sys.stdout.write(text)
+                sys.stdout.flush()
+            lines = (pending + text).split('\n')
+            pending = lines.pop()
+            yield from lines
+        if not chunk:
+            break
+    if pending:
+        yield pending
+
+
+def run_command(command, capture_output=False, allow_error=False, env=None,
+                stream_output=False, log_file=None, max_output_lines=None, show_output=True, on_output=None):
+    """Run command, logging its output, and exit if it fails.
+
+    :param bool capture_output: Return the lines of output, and show all of them on error.
+    :param bool allow_error: Do not exit when the command fails.
+    :param dict env: Environment for the command, instead of the current one.
+    :param bool stream_output: At debug verbosity, write output straight to stdout
+        instead of logging every line. Used for commands with very long output.
+    :param str log_file: Also write all of the output to this file.
+    :param int max_output_lines: Only keep the last lines of captured output, up to this number.
+    :param bool show_output: Set to False to not log the output at all, for instance when
+        several commands run at once and their output would be interleaved.
+    :param on_output: Called with each line of output as soon as it is read.
+
+    :returns: A tuple of the return code and the list of captured output lines.
+    """
     logger.info('Running command:')
     logger.info('  {0}'.format(' '.join(command)))
     try:
         process = subprocess.Popen(command,
                                    stdout=subprocess.PIPE,
-                                   stderr=subprocess.STDOUT)
+                                   stderr=subprocess.STDOUT,
+                                   env=env)
     except FileNotFoundError:
         msg = f"You do not have {command[0]} installed."
         if command[0] in constants.runtime_files:
@@ -87,14 +157,22 @@ def run_command(command, capture_output=False, allow_error=False):
         logger.error(msg)
         sys.exit(1)
 
-    output = []
+    output = deque(maxlen=max_output_lines)
     trailing_output = deque(maxlen=20)
-    for line in iter(process.stdout.readline, b''):
-        line = line.decode(sys.stdout.encoding)
-        if capture_output:
-            output.append(line.rstrip())
-        trailing_output.append(line.rstrip())
-        logger.debug(line.rstrip('\n'))  # line ends added by logger itself
+    echo = show_output and stream_output and logger.isEnabledFor(logging.DEBUG)
+    log_fd = open(log_file, 'w') if log_file else None
+    try:
+        for line in _read_output_lines(process.stdout, log_file=log_fd, echo=echo):
+            if capture_output:
+                output.append(line.rstrip())
+            trailing_output.append(line.rstrip())
+            if on_output is not None:
+                on_output(line)
+            if show_output and not echo:
+                logger.debug(line)
+    finally:
+        if log_fd is not None:
+            log_fd.close()
     logger.debug('')
 
     rc = process.wait()
@@ -117,7 +195,15 @@ def run_command(command, capture_output=False, allow_error=False):
         logger.error(f"An error occured (rc={rc}), see output line(s) above for details.")
         sys.exit(1)
 
-    return (rc, output)
+    return (rc, list(output))
+
+
+def format_size(size):
+    """Return a size in bytes in a human readable form, like 1.5 MiB"""
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if size < 1024 or unit == 'GiB':
+            return f'{size} {unit}' if unit == 'B' else f'{size:.1f} {unit}'
+        size /= 1024
 
 
 def write_file(filename: str, lines: list) -> bool:
@@ -138,7 +224,68 @@ def write_file(filename: str, lines: list) -> bool:
     return True
 
 
-def copy_file(source: str, dest: str) -> bool:
+# ioctl request cloning a whole file on Linux, from linux/fs.h
+FICLONE = 0x40049409
+
+
+def _reflink(source, dest):
+    """Make dest a copy-on-write clone of source, on filesystems supporting it (btrfs, XFS)"""
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError(errno.EOPNOTSUPP, 'Reflinks are not supported on this platform')
+    with open(source, 'rb') as src, open(dest, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    shutil.copystat(source, dest)
+
+
+def _same_filesystem(source, dest):
+    return os.stat(source).st_dev == os.stat(os.path.dirname(os.path.abspath(dest))).st_dev
+
+
+def stage_file(source: str, dest: str, strategy: str = 'copy') -> str:
+    """Place the content of source at dest, replacing dest if it exists, and
+    return how it was placed.
+
+    :param str strategy: One of constants.staging_strategies. With reflink or
+        hardlink, and with auto which tries a reflink then a hardlink, files
+        are only copied when source and dest are on different filesystems,
+        or the filesystem does not support it.
+    """
+    if strategy == 'auto':
+        methods = ['reflink', 'hardlink']
+    elif strategy in ('reflink', 'hardlink'):
+        methods = [strategy]
+    else:
+        methods = []
+    if methods and not _same_filesystem(source, dest):
+        methods = []
+
+    # Placed under another name first, so that dest is never written in place:
+    # it may be a hardlink to a file of the user.
+    tmp_dest = '{0}.{1}.tmp'.format(dest, os.getpid())
+    for method in methods:
+        try:
+            if method == 'reflink':
+                _reflink(source, tmp_dest)
+            else:
+                os.link(source, tmp_dest)
+        except OSError as e:
+            logger.debug('Could not {0} {1} to {2}: {3}'.format(method, source, dest, e))
+            if os.path.lexists(tmp_dest):
+                os.remove(tmp_dest)
+            continue
+        os.replace(tmp_dest, dest)
+        return method
+    shutil.copy2(source, tmp_dest)
+    os.replace(tmp_dest, dest)
+    return 'copy'
+
+
+def copy_file(source: str, dest: str, strategy: str = 'copy') -> bool:
+    """Copy source to dest with stage_file(), unless dest already has the same
+    size and modification time, which copies keep, or is the same file.
+    """
     should_copy = False
 
     if os.path.abspath(source) == os.path.abspath(dest):
@@ -147,15 +294,23 @@ def copy_file(source: str, dest: str) -> bool:
     elif not os.path.exists(dest):
         logger.debug("File {0} will be created.".format(dest))
         should_copy = True
-    elif not filecmp.cmp(source, dest, shallow=False):
-        logger.warning('File {0} had modifications and will be rewritten'.format(dest))
-        should_copy = True
-    elif os.path.getmtime(source) > os.path.getmtime(dest):
-        logger.warning('File {0} updated time increased and will be rewritten'.format(dest))
-        should_copy = True
+    elif os.path.samefile(source, dest):
+        # Hardlinked by a previous run
+        pass
+    else:
+        source_stat = os.stat(source)
+        dest_stat = os.stat(dest)
+        if source_stat.st_size != dest_stat.st_size:
+            logger.warning('File {0} had modifications and will be rewritten'.format(dest))
+            should_copy = True
+        elif source_stat.st_mtime_ns != dest_stat.st_mtime_ns:
+            logger.warning('File {0} updated time changed and will be rewritten'.format(dest))
+            should_copy = True
 
     if should_copy:
-        shutil.copy2(source, dest)
+        method = stage_file(source, dest, strategy)
+        if method != 'copy':
+            logger.debug("File {0} was placed with a {1}.".format(dest, method))
     else:
         logger.debug("File {0} is already up-to-date.".format(dest))
 
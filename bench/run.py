@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+"""Benchmark introspection, requirement consolidation and build context creation.
+
+Run from the repository root and write the results as JSON:
+
+    python -m bench.run --sizes 10 100 1000 --output bench-results.json
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+from ansible_builder.cli import get_version
+from ansible_builder.introspect import process, simple_combine
+from ansible_builder.main import AnsibleBuilder
+from ansible_builder.requirements import sanitize_requirements
+from ansible_builder.user_definition import UserDefinition
+
+from .synthetic import synthetic_requirements, write_collections_tree, write_definition
+
+
+def time_call(func, *args, repeat=3, **kwargs):
+    """Return the best and mean wall clock time of repeat calls to func"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        timings.append(time.perf_counter() - start)
+    return {'best': min(timings), 'mean': sum(timings) / len(timings), 'repeat': repeat}
+
+
+def load_definition(path):
+    definition = UserDefinition(filename=path)
+    definition.validate()
+    return definition
+
+
+def create_context(path, build_context):
+    return AnsibleBuilder(action='create', filename=path, build_context=build_context).create()
+
+
+def bench_size(work_dir, size, args):
+    """Run every benchmark against a tree of size collections"""
+    data_dir = os.path.join(work_dir, 'collections-{0}'.format(size))
+    write_collections_tree(data_dir, size, python_lines=args.python_lines, nesting=args.nesting)
+    definition = write_definition(os.path.join(work_dir, 'definition-{0}'.format(size)), size)
+    cache_dir = os.path.join(work_dir, 'cache-{0}'.format(size))
+    data = process(data_dir)
+    # Fill the cache once, so the cached benchmark measures warm lookups
+    process(data_dir, cache_dir=cache_dir)
+
+    cases = {
+        'introspect.process': lambda: process(data_dir),
+        'introspect.process[jobs={0}]'.format(args.jobs): lambda: process(data_dir, jobs=args.jobs),
+        'introspect.process[cached]': lambda: process(data_dir, cache_dir=cache_dir),
+        'sanitize_requirements': lambda: sanitize_requirements(data['python']),
+        'simple_combine': lambda: simple_combine(data['system']),
+        'UserDefinition': lambda: load_definition(definition),
+        'AnsibleBuilder.create': lambda: create_context(definition, os.path.join(work_dir, 'context-{0}'.format(size))),
+    }
+
+    results = []
+    for name, func in cases.items():
+        if args.only and not any(only in name for only in args.only):
+            continue
+        result = {'name': name, 'collections': size}
+        result.update(time_call(func, repeat=args.repeat))
+        results.append(result)
+    return results
+
+
+def bench_requirement_lines(line_counts, args):
+    """Run the consolidation benchmarks against growing numbers of requirement lines"""
+    results = []
+    for line_count in line_counts:
+        reqs = synthetic_requirements(line_count)
+        for name, func in (('sanitize_requirements', sanitize_requirements), ('simple_combine', simple_combine)):
+            if args.only and not any(only in name for only in args.only):
+                continue
+            result = {'name': name, 'lines': line_count}
+            result.update(time_call(func, reqs, repeat=args.repeat))
+            results.append(result)
+    return results
+
+
+def parse_args(args=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000],
+                        help='Numbers of collections in the synthetic trees (default: %(default)s)')
+    parser.add_argument('--lines', type=int, nargs='*', default=[1000, 10000],
+                        help='Numbers of requirement lines for the consolidation benchmarks (default: %(default)s)')
+    parser.add_argument('--python-lines', type=int, default=10,
+                        help='Python requirement lines per collection (default: %(default)s)')
+    parser.add_argument('--nesting', type=int, default=2,
+                        help='Depth of -r includes in collection requirement files (default: %(default)s)')
+    parser.add_argument('--jobs', type=int, default=8,
+                        help='Jobs for the concurrent introspection benchmark (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of timed runs of each benchmark (default: %(default)s)')
+    parser.add_argument('--only', action='append',
+                        help='Only run benchmarks whose name contains this string. May be given multiple times.')
+    parser.add_argument('--output',
+                        help='Write the JSON results to this file instead of stdout')
+    return parser.parse_args(args)
+
+
+def main():
+    args = parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='ansible-builder-bench-') as work_dir:
+        for size in args.sizes:
+            results.extend(bench_size(work_dir, size, args))
+    results.extend(bench_requirement_lines(args.lines, args))
+
+    report = {
+        'ansible_builder_version': get_version(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.time(),
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
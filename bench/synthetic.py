@@ -0,0 +1,89 @@
+"""Generators for synthetic benchmark inputs."""
+import json
+import os
+
+import yaml
+
+
+def synthetic_requirements(line_count, collection_count=100):
+    """Return a dict of requirement lines keyed by collection name, with
+    line_count lines in total spread over collection_count collections.
+    Every package is required by several collections.
+    """
+    package_count = max(line_count // 4, 1)
+    lines_per_collection = max(line_count // collection_count, 1)
+    reqs = {}
+    line_number = 0
+    for collection_index in range(collection_count):
+        lines = []
+        for _ in range(lines_per_collection):
+            lines.append('package{0}>={1}.0'.format(line_number % package_count, collection_index % 10))
+            line_number += 1
+        reqs['bench.collection{0}'.format(collection_index)] = lines
+    return reqs
+
+
+def write_collections_tree(data_dir, collection_count, python_lines=10, system_lines=3, nesting=1):
+    """Create an ansible_collections tree of installed collections in data_dir.
+
+    :param int collection_count: Number of collections, spread over namespaces of 10 collections each.
+    :param int python_lines: Number of python requirement lines per collection.
+    :param int system_lines: Number of bindep lines per collection.
+    :param int nesting: Depth of ``-r`` includes the python requirements are split over.
+    :returns: The number of collections written.
+    """
+    for index in range(collection_count):
+        namespace = 'ns{0}'.format(index // 10)
+        name = 'col{0}'.format(index)
+        path = os.path.join(data_dir, 'ansible_collections', namespace, name)
+        os.makedirs(os.path.join(path, 'meta'), exist_ok=True)
+
+        # Overlapping package names, so consolidation has duplicates to merge
+        lines = ['package{0}>={1}'.format((index + line) % (python_lines * 5), line % 3) for line in range(python_lines)]
+        chunk = max(len(lines) // max(nesting, 1), 1)
+        for depth in range(nesting):
+            filename = 'requirements-{0}.txt'.format(depth) if depth else 'requirements.txt'
+            content = lines[depth * chunk:(depth + 1) * chunk if depth < nesting - 1 else None]
+            if depth < nesting - 1:
+                content = content + ['-r requirements-{0}.txt'.format(depth + 1)]
+            with open(os.path.join(path, filename), 'w') as f:
+                f.write('\n'.join(content) + '\n')
+
+        with open(os.path.join(path, 'bindep.txt'), 'w') as f:
+            f.write('\n'.join(
+                'syspkg{0} [platform:rpm]'.format((index + line) % (system_lines * 5)) for line in range(system_lines)
+            ) + '\n')
+
+        with open(os.path.join(path, 'meta', 'execution-environment.yml'), 'w') as f:
+            yaml.safe_dump({'version': 1, 'dependencies': {'python': 'requirements.txt', 'system': 'bindep.txt'}}, f)
+
+        manifest = {'collection_info': {'namespace': namespace, 'name': name, 'version': '1.0.0'}}
+        with open(os.path.join(path, 'MANIFEST.json'), 'w') as f:
+            json.dump(manifest, f)
+        with open(os.path.join(path, 'FILES.json'), 'w') as f:
+            json.dump({'files': [{'name': 'requirements.txt', 'chksum_sha256': str(index)}]}, f)
+
+    return collection_count
+
+
+def write_definition(definition_dir, collection_count, python_lines=10, system_lines=3):
+    """Write an execution environment definition and its dependency files
+    to definition_dir, and return the path of the definition.
+    """
+    os.makedirs(definition_dir, exist_ok=True)
+    galaxy = {'collections': [{'name': 'ns{0}.col{1}'.format(i // 10, i), 'version': '1.0.0'} for i in range(collection_count)]}
+    with open(os.path.join(definition_dir, 'requirements.yml'), 'w') as f:
+        yaml.safe_dump(galaxy, f)
+    with open(os.path.join(definition_dir, 'requirements.txt'), 'w') as f:
+        f.write('\n'.join('userpackage{0}'.format(i) for i in range(python_lines)) + '\n')
+    with open(os.path.join(definition_dir, 'bindep.txt'), 'w') as f:
+        f.write('\n'.join('usersyspkg{0} [platform:rpm]'.format(i) for i in range(system_lines)) + '\n')
+
+    path = os.path.join(definition_dir, 'execution-environment.yml')
+    with open(path, 'w') as f:
+        yaml.safe_dump({
+            'version': 1,
+            'dependencies': {'galaxy': 'requirements.yml', 'python': 'requirements.txt', 'system': 'bindep.txt'},
+            'additional_build_steps': {'append': ['RUN echo done']},
+        }, f)
+    return path
@@ -20,6 +20,7 @@ def do_not_run_commands(request, mocker):
         'python:', '  foo: []', 'system: {}',
     ]])
     mocker.patch('ansible_builder.main.run_command', new=cmd_mock)
+    mocker.patch('ansible_builder.drivers.run_command', new=cmd_mock)
     yield cmd_mock
 
 
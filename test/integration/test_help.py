@@ -4,13 +4,13 @@ import re
 def test_help(cli):
     result = cli('ansible-builder --help', check=False)
     help_text = result.stdout
-    assert 'usage: ansible-builder [-h] [--version] {create,build,introspect} ...' in help_text
+    assert 'usage: ansible-builder [-h] [--version] {create,build,build-many,introspect,lock} ...' in help_text
 
 
 def test_no_args(cli):
     result = cli('ansible-builder', check=False)
     stderr = result.stderr
-    assert 'usage: ansible-builder [-h] [--version] {create,build,introspect} ...' in stderr
+    assert 'usage: ansible-builder [-h] [--version] {create,build,build-many,introspect,lock} ...' in stderr
     assert 'ansible-builder: error: the following arguments are required: action' in stderr
 
 
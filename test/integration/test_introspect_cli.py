@@ -47,7 +47,7 @@ def test_introspect_write_python_and_sanitize(cli, data_dir, tmp_path):
     cli(f'ansible-builder introspect {data_dir} --write-pip={dest_file} --sanitize')
 
     assert dest_file.read_text() == '\n'.join([
-        'pyvcloud>=14,>=18.0.10  # from collection test.metadata,test.reqfile',
+        'pyvcloud>=18.0.10  # from collection test.metadata,test.reqfile',
         'pytz  # from collection test.reqfile',
         'python-dateutil>=2.8.2  # from collection test.reqfile',
         'tacacs-plus  # from collection test.reqfile',
@@ -0,0 +1,61 @@
+import pytest
+
+from ansible_builder.batch import BatchBuilder, definition_name
+from ansible_builder.cli import parse_args
+from ansible_builder.exceptions import DefinitionError
+
+
+@pytest.fixture
+def definitions(tmp_path):
+    paths = []
+    for name in ('first', 'second'):
+        path = tmp_path / name
+        path.mkdir()
+        path = path / 'execution-environment.yml'
+        path.write_text('version: 1\n')
+        paths.append(str(path))
+    return paths
+
+
+def test_definition_name():
+    assert definition_name('/foo/bar/execution-environment.yml') == 'bar'
+    assert definition_name('/foo/bar/my-ee.yml') == 'my-ee'
+
+
+def test_batch_build(definitions, tmp_path, mocker):
+    # With two jobs the builds run in either order, so the return code follows from the command
+    run_command = mocker.patch('ansible_builder.drivers.run_command',
+                               side_effect=lambda command, **kwargs: (1 if 'registry/second:1.0' in command else 0, []))
+    args = parse_args(['build-many'] + definitions + ['--jobs', '2', '-c', str(tmp_path / 'bc'), '-t', 'registry/{name}:1.0'])
+    batch = BatchBuilder(**{k: v for k, v in vars(args).items() if k != 'action'})
+
+    assert not batch.build()
+    assert run_command.call_count == 2
+    assert (tmp_path / 'bc' / 'first' / 'ansible-builder-manifest.json').exists()
+    assert (tmp_path / 'bc' / 'second' / 'ansible-builder-manifest.json').exists()
+
+    results = {result.name: result for result in batch.results}
+    assert results['first'].succeeded
+    assert not results['second'].succeeded
+    assert results['first'].tags == ['registry/first:1.0']
+
+    summary = batch.summary()
+    assert len(summary) == 3
+    assert 'FAILED' in summary[2]
+
+
+def test_batch_default_tag(definitions, tmp_path):
+    batch = BatchBuilder(definitions, build_context=str(tmp_path))
+    assert batch.builders['first'].tags == ['ansible-execution-env-first:latest']
+
+
+def test_batch_cache_locations(definitions, tmp_path):
+    batch = BatchBuilder(definitions, build_context=str(tmp_path), container_runtime='podman',
+                         cache_from=['quay.io/org/{name}-cache'], cache_to='quay.io/org/{name}-cache')
+    assert batch.builders['first'].cache_from == ['quay.io/org/first-cache']
+    assert batch.builders['second'].cache_to == 'quay.io/org/second-cache'
+
+
+def test_batch_duplicate_names(definitions, tmp_path):
+    with pytest.raises(DefinitionError):
+        BatchBuilder([definitions[0], definitions[0]], build_context=str(tmp_path))
@@ -0,0 +1,121 @@
+from ansible_builder.build_output import BuildOutputParser
+from ansible_builder.timings import Timings
+
+
+PODMAN_OUTPUT = """\
+[1/3] STEP 1/3: FROM quay.io/ansible/ansible-runner:latest AS galaxy
+[1/3] STEP 2/3: ADD _build /build
+--> Using cache 5e4b0a2f1c
+--> 5e4b0a2f1c
+[1/3] STEP 3/3: RUN ansible-galaxy collection install -r requirements.yml
+--> Using cache 8d2c1e9f0b
+--> 8d2c1e9f0b
+[2/3] STEP 1/3: FROM quay.io/ansible/ansible-builder:latest AS builder
+[2/3] STEP 2/3: ADD _build/requirements.txt requirements.txt
+--> Using cache 0c9f6e1d2a
+[2/3] STEP 3/3: RUN ansible-builder introspect --sanitize
+Collecting foo
+--> 3f2e1d0c9b
+[3/3] STEP 1/2: FROM quay.io/ansible/ansible-runner:latest
+[3/3] STEP 2/2: RUN /output/install-from-bindep
+--> 7a6b5c4d3e
+"""
+
+BUILDKIT_OUTPUT = """\
+#1 [internal] load build definition from Dockerfile
+#1 DONE 0.0s
+#5 [galaxy 1/3] FROM quay.io/ansible/ansible-runner:latest
+#6 [builder 1/2] FROM quay.io/ansible/ansible-builder:latest
+#7 [galaxy 2/3] ADD _build /build
+#7 CACHED
+#8 [galaxy 3/3] RUN ansible-galaxy collection install -r requirements.yml
+#8 0.512 Starting galaxy collection install process
+#8 DONE 12.5s
+#9 [builder 2/2] RUN ansible-builder introspect --sanitize
+#9 CACHED
+"""
+
+DOCKER_OUTPUT = """\
+Step 1/4 : FROM quay.io/ansible/ansible-runner:latest as galaxy
+ ---> 2b3c4d5e6f
+Step 2/4 : ADD _build /build
+ ---> Using cache
+ ---> 3c4d5e6f7a
+Step 3/4 : FROM quay.io/ansible/ansible-runner:latest
+ ---> 2b3c4d5e6f
+Step 4/4 : COPY --from=galaxy /usr/share/ansible /usr/share/ansible
+ ---> 4d5e6f7a8b
+"""
+
+
+def parse(output):
+    completed = []
+    parser = BuildOutputParser(on_step=completed.append)
+    for line in output.splitlines():
+        parser(line)
+    parser.finish()
+    assert sorted(completed, key=parser.steps.index) == parser.steps
+    return parser
+
+
+def test_podman_output():
+    parser = parse(PODMAN_OUTPUT)
+
+    assert [(step.stage, step.number, step.cached) for step in parser.steps] == [
+        ('galaxy', 1, None), ('galaxy', 2, True), ('galaxy', 3, True),
+        ('builder', 1, None), ('builder', 2, True), ('builder', 3, False),
+        ('3', 1, None), ('3', 2, False),
+    ]
+    assert all(step.duration >= 0 for step in parser.steps)
+    assert [str(step) for step in parser.cache_misses()] == [
+        '[builder 3/3] RUN ansible-builder introspect --sanitize',
+        '[3 2/2] RUN /output/install-from-bindep',
+    ]
+
+    summary = parser.summary()
+    assert summary[0] == 'Layer cache: 3 of 5 steps cached'
+    assert summary[1].startswith('  stage builder: 1 steps built, starting with step 3/3 (')
+    assert summary[1].endswith('RUN ansible-builder introspect --sanitize')
+    assert len(summary) == 3
+
+
+def test_buildkit_output():
+    parser = parse(BUILDKIT_OUTPUT)
+
+    assert [(step.stage, step.number, step.cached) for step in parser.steps] == [
+        ('galaxy', 1, None), ('builder', 1, None), ('galaxy', 2, True), ('galaxy', 3, False), ('builder', 2, True),
+    ]
+    assert parser.steps[3].duration == 12.5
+    assert parser.summary() == [
+        'Layer cache: 2 of 3 steps cached',
+        '  stage galaxy: 1 steps built, starting with step 3/3 (12.5s): RUN ansible-galaxy collection install -r requirements.yml',
+    ]
+
+
+def test_docker_output():
+    parser = parse(DOCKER_OUTPUT)
+
+    assert [(step.stage, step.number, step.cached) for step in parser.steps] == [
+        ('galaxy', 1, None), ('galaxy', 2, True), ('2', 3, None), ('2', 4, False),
+    ]
+
+
+def test_no_steps():
+    parser = parse('Error: no such file\n')
+    assert parser.steps == []
+    assert parser.summary() == []
+
+
+def test_record_timings():
+    parser = parse(PODMAN_OUTPUT)
+    timings = Timings()
+    with timings.span('build') as build:
+        parser.record(timings, parent=build)
+
+    stages = [span for span in timings.spans if span.name == 'build.stage']
+    assert [span.attributes['stage'] for span in stages] == ['galaxy', 'builder', '3']
+    assert all(span.parent_id == build.span_id for span in stages)
+    steps = [span for span in timings.spans if span.name == 'build.step']
+    assert len(steps) == 8
+    assert steps[0].parent_id == stages[0].span_id
+    assert steps[5].attributes['cached'] is False
@@ -1,3 +1,6 @@
+import subprocess
+import sys
+
 from ansible_builder.main import AnsibleBuilder
 from ansible_builder.cli import parse_args
 
@@ -61,3 +64,13 @@ def test_build_prune_images(good_exec_env_definition_path, tmp_path):
     assert aee_prune_images.prune_images
     assert 'prune' in aee_prune_images.prune_image_command
     assert not aee_no_prune_images.prune_images
+
+
+def test_cli_import_is_lazy():
+    """Importing the CLI must not pull in modules only some sub-commands need"""
+    heavy_modules = ('pkg_resources', 'yaml', 'requirements', 'ansible_builder.main', 'ansible_builder.introspect')
+    result = subprocess.run(
+        [sys.executable, '-c', f'import sys, ansible_builder.cli; print([m for m in {heavy_modules!r} if m in sys.modules])'],
+        check=True, stdout=subprocess.PIPE, encoding='utf-8'
+    )
+    assert result.stdout.strip() == '[]'
@@ -0,0 +1,105 @@
+import pytest
+
+from ansible_builder.drivers import BuildahDriver, BuildxDriver, DockerDriver, PodmanDriver, RecordingDriver, get_driver
+from ansible_builder.main import AnsibleBuilder
+
+
+@pytest.mark.parametrize('driver,prefix', [
+    (PodmanDriver(), ['podman', 'build']),
+    (DockerDriver(), ['docker', 'build']),
+    (BuildahDriver(), ['buildah', 'bud']),
+    (BuildxDriver(), ['docker', 'buildx', 'build', '--load']),
+])
+def test_build_command(driver, prefix):
+    command = driver.build_command('bc/Containerfile', 'bc', tags=['my-ee'], build_args={'FOO': 'bar'}, no_cache=True)
+    assert command == prefix + ['-f', 'bc/Containerfile', '-t', 'my-ee', '--build-arg=FOO=bar', 'bc', '--no-cache']
+
+
+def test_get_driver():
+    assert isinstance(get_driver('buildah'), BuildahDriver)
+    assert get_driver('buildah').runtime == 'podman'
+    assert isinstance(get_driver(container_runtime='docker'), DockerDriver)
+    assert get_driver('recording', 'docker').runtime == 'docker'
+
+    with pytest.raises(ValueError, match='builds images for docker, not podman'):
+        get_driver('buildx', 'podman')
+    with pytest.raises(ValueError, match='Unknown build driver'):
+        get_driver('kaniko')
+
+
+@pytest.mark.parametrize('driver,version,supported', [
+    (PodmanDriver(), 'podman version 4.2.0', True),
+    (PodmanDriver(), 'podman version 3.4.4', False),
+    (BuildahDriver(), 'buildah version 1.23.1 (image-spec 1.0.1-dev, runtime-spec 1.0.2-dev)', False),
+    (BuildahDriver(), 'buildah version 1.28.0 (image-spec 1.0.2-dev, runtime-spec 1.0.2-dev)', True),
+    (DockerDriver(), None, True),
+])
+def test_supports_cache_mounts(do_not_run_commands, driver, version, supported):
+    do_not_run_commands.return_value = (0, [version])
+    assert driver.supports_cache_mounts() == supported
+
+
+def test_recording_driver(exec_env_definition_file, tmp_path):
+    path = exec_env_definition_file(content={'version': 1})
+    driver = RecordingDriver(runtime='podman')
+    aee = AnsibleBuilder(filename=path, build_context=str(tmp_path / 'bc'), tag=['my-ee'], build_driver=driver,
+                         squash=True, prune_images=True)
+
+    assert aee.build()
+    assert aee.containerfile.path.endswith('Containerfile')
+    assert driver.commands == [
+        ['podman', 'build', '-f', aee.containerfile.path, '-t', 'my-ee', '--squash', str(tmp_path / 'bc')],
+        ['podman', 'image', 'prune', '--force'],
+    ]
+
+
+def test_squash_unsupported(exec_env_definition_file, tmp_path):
+    path = exec_env_definition_file(content={'version': 1})
+    aee = AnsibleBuilder(filename=path, build_context=str(tmp_path / 'bc'), build_driver='buildx', squash=True)
+
+    aee.build()
+    assert '--squash' not in aee.build_command
+
+
+def test_buildx_cache_options():
+    options = BuildxDriver().cache_options(['quay.io/org/ee-cache:main', './cache', 'type=gha'], './cache')
+    assert options == [
+        '--cache-from', 'type=registry,ref=quay.io/org/ee-cache:main',
+        '--cache-from', 'type=local,src=./cache',
+        '--cache-from', 'type=gha',
+        '--cache-to', 'type=local,dest=./cache,mode=max',
+    ]
+
+
+def test_podman_cache_options():
+    assert PodmanDriver().cache_options(['quay.io/org/ee-cache'], 'quay.io/org/ee-cache') == [
+        '--cache-from', 'quay.io/org/ee-cache', '--cache-to', 'quay.io/org/ee-cache',
+    ]
+    with pytest.raises(ValueError, match='from the directory /tmp/cache'):
+        PodmanDriver().cache_options(['/tmp/cache'])
+
+
+def test_cache_from_and_to(exec_env_definition_file, tmp_path):
+    path = exec_env_definition_file(content={'version': 1})
+    driver = RecordingDriver(runtime='docker')
+    aee = AnsibleBuilder(filename=path, build_context=str(tmp_path / 'bc'), build_driver=driver,
+                         cache_from=['registry:5000/ee-cache'], cache_to='registry:5000/ee-cache')
+
+    aee.build()
+    command = driver.commands[0]
+    assert command[command.index('--cache-from') + 1] == 'registry:5000/ee-cache'
+    assert command[command.index('--cache-to') + 1] == 'registry:5000/ee-cache'
+    assert aee.build_summary() == [
+        'Layer cache imported from: registry:5000/ee-cache',
+        'Layer cache exported to: registry:5000/ee-cache',
+    ]
+
+
+def test_cache_export_unsupported(exec_env_definition_file, tmp_path):
+    path = exec_env_definition_file(content={'version': 1})
+    aee = AnsibleBuilder(filename=path, build_context=str(tmp_path / 'bc'), build_driver='docker',
+                         cache_from=['registry:5000/ee-cache'])
+
+    aee.build()
+    assert '--cache-from' not in aee.build_command
+    assert aee.build_summary() == []
@@ -1,6 +1,10 @@
 import os
+import shutil
+import yaml
 
-from ansible_builder.introspect import process, process_collection, simple_combine
+from ansible_builder.introspect import (
+    CollectionDefinition, CollectionRequirements, IntrospectionCache, introspect_collection, process, process_collection, simple_combine
+)
 from ansible_builder.requirements import sanitize_requirements
 
 
@@ -11,7 +15,7 @@ def test_multiple_collection_metadata(data_dir):
     files['system'] = simple_combine(files['system'])
 
     assert files == {'python': [
-        'pyvcloud>=14,>=18.0.10  # from collection test.metadata,test.reqfile',
+        'pyvcloud>=18.0.10  # from collection test.metadata,test.reqfile',
         'pytz  # from collection test.reqfile',
         # python-dateutil should appear only once even though referenced in
         # multiple places, once with a dash and another with an underscore in the name.
@@ -30,3 +34,104 @@ def test_single_collection_metadata(data_dir):
 
     assert py_reqs == ['pyvcloud>=14']
     assert sys_reqs == []
+
+
+def test_introspect_collection(data_dir):
+    col_path = os.path.join(data_dir, 'ansible_collections', 'test', 'metadata')
+    result = introspect_collection(col_path)
+
+    assert result.namespace == 'test'
+    assert result.name == 'metadata'
+    assert result.python == ['pyvcloud>=14']
+    assert result.system == []
+    assert result.python_file == 'my-requirements.txt'
+    assert result.system_file is None
+
+
+def test_parallel_process_matches_serial(data_dir):
+    serial = process(data_dir)
+    parallel = process(data_dir, jobs=4)
+
+    assert parallel == serial
+    assert list(parallel['python'].keys()) == list(serial['python'].keys())
+
+
+def test_cached_process(data_dir, tmp_path):
+    collections_dir = tmp_path / 'collections'
+    shutil.copytree(data_dir / 'ansible_collections', collections_dir / 'ansible_collections')
+    cache_dir = tmp_path / 'cache'
+
+    uncached = process(str(collections_dir))
+    assert process(str(collections_dir), cache_dir=str(cache_dir)) == uncached
+    assert len(os.listdir(cache_dir)) == 3  # one entry per collection with a MANIFEST.json
+
+    assert process(str(collections_dir), cache_dir=str(cache_dir)) == uncached
+    assert len(os.listdir(cache_dir)) == 3
+
+    # A requirements file edited without updating FILES.json invalidates the entry, as does
+    # a file it includes with -r
+    req_file = collections_dir / 'ansible_collections' / 'test' / 'reqfile' / 'requirements.txt'
+    (req_file.parent / 'extra_req.txt').write_text('included\n')
+    assert process(str(collections_dir), cache_dir=str(cache_dir))['python']['test.reqfile'][-1] == 'included'
+    req_file.write_text('changed\n')
+    assert process(str(collections_dir), cache_dir=str(cache_dir))['python']['test.reqfile'] == ['changed']
+    assert len(os.listdir(cache_dir)) == 3
+
+    # So does a changed FILES.json
+    (req_file.parent / 'FILES.json').write_text('{"files": []}')
+    assert process(str(collections_dir), cache_dir=str(cache_dir))['python']['test.reqfile'] == ['changed']
+    assert len(os.listdir(cache_dir)) == 4
+
+
+def test_cache_hit_does_not_parse_metadata(data_dir, tmp_path, mocker):
+    cache_dir = str(tmp_path / 'cache')
+    uncached = process(data_dir)
+    load = mocker.spy(yaml, 'safe_load')
+
+    assert process(data_dir, cache_dir=cache_dir) == uncached
+    assert load.call_count == 1  # test.metadata, read once on the cold run
+    assert process(data_dir, cache_dir=cache_dir) == uncached
+    assert load.call_count == 1
+
+
+def test_cache_eviction(data_dir, tmp_path):
+    cache = IntrospectionCache(str(tmp_path), max_entries=2)
+    for name in ('bindep', 'metadata', 'reqfile'):
+        path = os.path.join(data_dir, 'ansible_collections', 'test', name)
+        assert cache.set(CollectionRequirements(path, 'test', name, [], [], None, None))
+        os.utime(os.path.join(tmp_path, cache.cache_key(path) + '.json'), (0, len(os.listdir(tmp_path))))
+
+    assert cache.evict() == 1
+    assert cache.get(os.path.join(data_dir, 'ansible_collections', 'test', 'bindep')) is None
+    path = os.path.join(data_dir, 'ansible_collections', 'test', 'reqfile')
+    assert cache.get(path) == CollectionRequirements(path, 'test', 'reqfile', [], [], None, None)
+
+
+def test_cache_eviction_removed_entry(tmp_path, monkeypatch):
+    cache = IntrospectionCache(str(tmp_path), max_entries=1)
+    for name in ('first', 'second'):
+        (tmp_path / f'{name}.json').write_text('{}')
+    # An entry removed by another process while evicting
+    listdir = os.listdir
+    monkeypatch.setattr(os, 'listdir', lambda path: listdir(path) + ['removed.json'])
+
+    assert cache.evict() == 1
+    assert len(listdir(tmp_path)) == 1
+
+
+def test_simple_combine():
+    assert simple_combine({
+        'foo.bar': ['gcc', 'make  # build tool', '# comment'],
+        'bar.foo': ['git', 'make', 'gcc'],
+    }) == [
+        'gcc  # from collection foo.bar, bar.foo',
+        'make  # from collection foo.bar, bar.foo',
+        'git  # from collection bar.foo',
+    ]
+
+
+def test_metadata_read_once_with_cache(data_dir, tmp_path, mocker):
+    definition = mocker.spy(CollectionDefinition, '__init__')
+    process(data_dir, cache_dir=str(tmp_path / 'cache'))
+    # One definition per collection, the cache never builds its own
+    assert definition.call_count == 3
@@ -0,0 +1,54 @@
+import zipfile
+
+import pytest
+
+from ansible_builder.exceptions import LockError
+from ansible_builder.lock import artifact_name_version, lock_requirements
+from ansible_builder.manifest import file_digest
+
+
+def make_wheel(directory, name, version, requires=(), tag='py3-none-any'):
+    path = directory / f'{name}-{version}-{tag}.whl'
+    dist_info = f'{name}-{version}.dist-info'
+    with zipfile.ZipFile(path, 'w') as wheel:
+        wheel.writestr(f'{dist_info}/METADATA', ''.join(
+            [f'Metadata-Version: 2.1\nName: {name}\nVersion: {version}\n'] + [f'Requires-Dist: {r}\n' for r in requires]
+        ))
+        wheel.writestr(f'{dist_info}/WHEEL', f'Wheel-Version: 1.0\nGenerator: test\nRoot-Is-Purelib: true\nTag: {tag}\n')
+        wheel.writestr(f'{dist_info}/RECORD', '')
+    return path
+
+
+@pytest.fixture
+def wheelhouse(tmp_path):
+    directory = tmp_path / 'wheels'
+    directory.mkdir()
+    make_wheel(directory, 'foo', '1.0', requires=['bar_baz>=1'])
+    make_wheel(directory, 'bar_baz', '1.0')
+    make_wheel(directory, 'bar_baz', '2.0')
+    return directory
+
+
+def test_artifact_name_version():
+    assert artifact_name_version('bar_baz-2.0-py3-none-any.whl') == ('bar-baz', '2.0')
+    assert artifact_name_version('bar.baz-2.0.tar.gz') == ('bar-baz', '2.0')
+    assert artifact_name_version('README.md') is None
+
+
+def test_lock_requirements(wheelhouse, tmp_path):
+    requirements = tmp_path / 'requirements.txt'
+    requirements.write_text('foo  # from collection test.foo\n')
+    # wheel of the same release for another platform, which must be accepted as well
+    other_platform = make_wheel(wheelhouse, 'bar_baz', '2.0', tag='cp39-cp39-manylinux2014_aarch64')
+
+    lines = lock_requirements(str(requirements), find_links=[str(wheelhouse)])
+
+    assert lines[0] == '# Locked by ansible-builder from requirements.txt'
+    assert lines[1].startswith('bar-baz==2.0 \\\n    --hash=sha256:')
+    assert f'--hash=sha256:{file_digest(other_platform)}' in lines[1]
+    assert lines[2] == 'foo==1.0 \\\n    --hash=sha256:{0}'.format(file_digest(wheelhouse / 'foo-1.0-py3-none-any.whl'))
+
+
+def test_lock_requires_a_source(tmp_path):
+    with pytest.raises(LockError):
+        lock_requirements(str(tmp_path / 'requirements.txt'))
@@ -2,8 +2,10 @@ import os
 import pathlib
 
 import pytest
+import yaml
 
 from ansible_builder import constants
+from ansible_builder.exceptions import DefinitionError
 from ansible_builder.main import AnsibleBuilder
 
 
@@ -47,6 +49,20 @@ def test_galaxy_requirements(exec_env_definition_file, galaxy_requirements_file,
         content = f.read()
 
     assert f'ADD {constants.user_content_subfolder} /build' in content
+    assert 'RUN ansible-builder introspect --sanitize --write-bindep=/tmp/src/bindep.txt' in content
+    assert '--detect-platform' not in content
+
+
+def test_detect_platform(exec_env_definition_file, tmp_path):
+    path = exec_env_definition_file(content={'version': 1, 'dependencies': {'system': 'bindep.txt'}})
+    path.parent.joinpath('bindep.txt').write_text('gcc [platform:rpm]\n')
+
+    aee = AnsibleBuilder(filename=path, build_context=str(tmp_path / 'bc'), detect_platform=True)
+    aee.build()
+
+    with open(aee.containerfile.path) as f:
+        content = f.read()
+    assert 'RUN ansible-builder introspect --sanitize --detect-platform --user-bindep=bindep.txt' in content
 
 
 def test_base_image_via_build_args(exec_env_definition_file, tmp_path):
@@ -152,3 +168,355 @@ def test_use_dockerfile(exec_env_definition_file, tmp_path, runtime):
         content = f.read()
 
     assert 'FROM' in content
+
+
+def test_unchanged_context_not_rewritten(exec_env_definition_file, tmp_path):
+    python_requirements = tmp_path / 'requirements.txt'
+    python_requirements.write_text('foo\n')
+    path = exec_env_definition_file(content={'version': 1, 'dependencies': {'python': str(python_requirements)}})
+    build_context = tmp_path / 'bc'
+
+    aee = AnsibleBuilder(filename=path, build_context=build_context)
+    aee.create()
+    assert (build_context / constants.context_manifest_name).exists()
+
+    containerfile = pathlib.Path(aee.containerfile.path)
+    copied_requirements = build_context / constants.user_content_subfolder / 'requirements.txt'
+    mtimes = [containerfile.stat().st_mtime_ns, copied_requirements.stat().st_mtime_ns]
+
+    AnsibleBuilder(filename=path, build_context=build_context).create()
+    assert [containerfile.stat().st_mtime_ns, copied_requirements.stat().st_mtime_ns] == mtimes
+
+    python_requirements.write_text('foo\nbar\n')
+    AnsibleBuilder(filename=path, build_context=build_context).create()
+    assert copied_requirements.read_text() == 'foo\nbar\n'
+
+
+def test_split_context(exec_env_definition_file, galaxy_requirements_file, tmp_path):
+    galaxy_requirements_path = galaxy_requirements_file({'collections': ['ansible.posix']})
+    python_requirements = tmp_path / 'requirements.txt'
+    python_requirements.write_text('foo\n')
+    path = exec_env_definition_file(content={
+        'version': 1,
+        'dependencies': {'galaxy': str(galaxy_requirements_path), 'python': str(python_requirements)}
+    })
+
+    aee = AnsibleBuilder(filename=path, build_context=tmp_path / 'bc', split_context=True)
+    aee.create()
+
+    with open(aee.containerfile.path) as f:
+        lines = f.read().splitlines()
+
+    assert f'ADD {constants.user_content_subfolder} /build' not in lines
+    galaxy_add = lines.index(f'ADD {constants.user_content_subfolder}/requirements.yml requirements.yml')
+    galaxy_install = next(i for i, line in enumerate(lines) if 'ansible-galaxy collection install' in line)
+    builder_stage = lines.index('FROM $EE_BUILDER_IMAGE as builder')
+    python_add = lines.index(f'ADD {constants.user_content_subfolder}/requirements.txt requirements.txt')
+    assert galaxy_add < galaxy_install < builder_stage < python_add
+
+
+@pytest.mark.parametrize('runtime_version,supported', [
+    ('podman version 4.2.0', True),
+    ('podman version 3.4.4', False),
+])
+def test_cache_mounts(exec_env_definition_file, tmp_path, do_not_run_commands, runtime_version, supported):
+    python_requirements = tmp_path / 'requirements.txt'
+    python_requirements.write_text('foo\n')
+    path = exec_env_definition_file(content={'version': 1, 'dependencies': {'python': str(python_requirements)}})
+    do_not_run_commands.return_value = (0, [runtime_version])
+
+    aee = AnsibleBuilder(filename=path, build_context=tmp_path / 'bc', container_runtime='podman', cache_mounts=True)
+    aee.build()
+
+    with open(aee.containerfile.path) as f:
+        content = f.read()
+
+    assert ('RUN --mount=type=cache,id=ansible-builder-pip' in content) == supported
+    assert 'ansible-builder-dnf' not in content
+
+
+def test_cache_mounts_docker_buildkit(exec_env_definition_file, tmp_path):
+    path = exec_env_definition_file(content={'version': 1})
+
+    aee = AnsibleBuilder(filename=path, build_context=tmp_path / 'bc', container_runtime='docker', cache_mounts=True)
+    assert aee.build_env['DOCKER_BUILDKIT'] == '1'
+
+    aee = AnsibleBuilder(filename=path, build_context=tmp_path / 'bc', container_runtime='docker')
+    assert aee.build_env is None
+
+
+def test_introspect_on_host(exec_env_definition_file, data_dir, tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    user_requirements = tmp_path / 'requirements.txt'
+    user_requirements.write_text('ansible\n')
+    path = exec_env_definition_file(content={'version': 1, 'dependencies': {'python': str(user_requirements)}})
+
+    aee = AnsibleBuilder(filename=path, build_context=tmp_path / 'bc', collections_path=str(data_dir))
+    aee.create()
+
+    outputs_dir = tmp_path / 'bc' / constants.user_content_subfolder
+    python_lines = (outputs_dir / constants.INTROSPECTED_FILES['python']).read_text().splitlines()
+    assert 'pytz  # from collection test.reqfile' in python_lines
+    assert 'ansible  # from collection user' in python_lines
+    assert (outputs_dir / constants.INTROSPECTED_FILES['system']).exists()
+
+    with open(aee.containerfile.path) as f:
+        content = f.read()
+
+    assert 'ansible-builder introspect' not in content
+    assert f"ADD {constants.user_content_subfolder}/{constants.INTROSPECTED_FILES['python']} /tmp/src/requirements.txt" in content
+    assert f"ADD {constants.user_content_subfolder}/{constants.INTROSPECTED_FILES['system']} /tmp/src/bindep.txt" in content
+    # The builder stage does not need the collections anymore
+    builder_stage = content.split('as builder')[1].split('FROM $EE_BASE_IMAGE')[0]
+    assert 'COPY --from=galaxy' not in builder_stage
+
+
+@pytest.mark.parametrize('no_cache', [False, True])
+def test_introspect_on_host_cache(exec_env_definition_file, data_dir, tmp_path, no_cache):
+    path = exec_env_definition_file(content={'version': 1})
+    cache_dir = tmp_path / 'introspect-cache'
+
+    aee = AnsibleBuilder(filename=path, build_context=tmp_path / 'bc', collections_path=str(data_dir),
+                         introspect_cache_dir=str(cache_dir), no_cache=no_cache)
+    aee.create()
+
+    assert cache_dir.exists() != no_cache
+
+
+def test_galaxy_install_command(exec_env_definition_file, galaxy_requirements_file, tmp_path, do_not_run_commands, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    galaxy_requirements_path = galaxy_requirements_file({'collections': ['ansible.posix']})
+    path = exec_env_definition_file(content={'version': 1, 'dependencies': {'galaxy': str(galaxy_requirements_path)}})
+
+    aee = AnsibleBuilder(filename=path, build_context=tmp_path / 'bc', introspect_on_host=True,
+                         build_args={'ANSIBLE_GALAXY_CLI_COLLECTION_OPTS': '--pre'})
+
+    assert aee.galaxy_install_command('/tmp/collections') == [
+        'ansible-galaxy', 'collection', 'install', '--pre', '-r', str(galaxy_requirements_path),
+        '--collections-path', '/tmp/collections',
+    ]
+    assert aee.galaxy_install_env['ANSIBLE_GALAXY_DISABLE_GPG_VERIFY'] == '1'
+
+    aee.create()
+    command = do_not_run_commands.call_args[0][0]
+    assert command[:3] == ['ansible-galaxy', 'collection', 'install']
+
+
+def test_lock_file(exec_env_definition_file, tmp_path):
+    python_requirements = tmp_path / 'requirements.txt'
+    python_requirements.write_text('foo\n')
+    lock_file = tmp_path / 'requirements.lock'
+    lock_file.write_text('foo==1.0 --hash=sha256:abc\n')
+    path = exec_env_definition_file(content={'version': 1, 'dependencies': {'python': str(python_requirements)}})
+
+    aee = AnsibleBuilder(filename=path, build_context=tmp_path / 'bc', lock_file=str(lock_file))
+    aee.create()
+
+    with open(aee.containerfile.path) as f:
+        content = f.read()
+
+    assert '--write-pip' not in content
+    assert '--user-pip' not in content
+    assert f'ADD {constants.user_content_subfolder}/{constants.default_lock_file_name} /tmp/src/requirements.txt' in content
+    assert 'RUN PIP_NO_DEPS=1 assemble' in content
+
+
+@pytest.mark.parametrize('no_index', [False, True])
+def test_wheels(exec_env_definition_file, tmp_path, no_index):
+    python_requirements = tmp_path / 'requirements.txt'
+    python_requirements.write_text('lxml\n')
+    wheels = tmp_path / 'wheels'
+    wheels.mkdir()
+    (wheels / 'lxml-4.9.2-cp39-cp39-manylinux_2_17_x86_64.whl').write_text('wheel')
+    (wheels / 'subfolder').mkdir()
+    path = exec_env_definition_file(content={'version': 1, 'dependencies': {
+        'python': str(python_requirements),
+        'wheels': {'path': str(wheels), 'no_index': no_index},
+    }})
+
+    aee = AnsibleBuilder(filename=path, build_context=tmp_path / 'bc')
+    aee.create()
+
+    with open(aee.containerfile.path) as f:
+        content = f.read()
+
+    assert aee.containerfile.wheels == ['lxml-4.9.2-cp39-cp39-manylinux_2_17_x86_64.whl']
+    assert (tmp_path / 'bc' / constants.user_content_subfolder / 'wheels' / aee.containerfile.wheels[0]).exists()
+    assert f'ADD {constants.user_content_subfolder}/wheels /build/wheels' in content
+    if no_index:
+        assert 'RUN PIP_FIND_LINKS=/build/wheels PIP_NO_INDEX=1 assemble' in content
+    else:
+        assert 'RUN PIP_FIND_LINKS=/build/wheels assemble' in content
+
+
+def test_wheels_removed(exec_env_definition_file, tmp_path):
+    wheels = tmp_path / 'wheels'
+    wheels.mkdir()
+    for filename in ('a-1.0-py3-none-any.whl', 'b-1.0-py3-none-any.whl'):
+        (wheels / filename).write_text('wheel')
+    path = exec_env_definition_file(content={'version': 1, 'dependencies': {'wheels': str(wheels)}})
+    AnsibleBuilder(filename=path, build_context=tmp_path / 'bc').create()
+
+    (wheels / 'b-1.0-py3-none-any.whl').unlink()
+    aee = AnsibleBuilder(filename=path, build_context=tmp_path / 'bc')
+    aee.create()
+
+    staged = tmp_path / 'bc' / constants.user_content_subfolder / 'wheels'
+    assert os.listdir(staged) == ['a-1.0-py3-none-any.whl']
+    assert aee.containerfile.manifest.get(str(staged / 'b-1.0-py3-none-any.whl')) is None
+
+
+def test_missing_lock_file(exec_env_definition_file, tmp_path):
+    path = exec_env_definition_file(content={'version': 1})
+    with pytest.raises(DefinitionError):
+        AnsibleBuilder(filename=path, lock_file=str(tmp_path / 'missing.lock'))
+
+
+def test_platform_build_command(exec_env_definition_file, tmp_path):
+    path = exec_env_definition_file(content={'version': 1})
+    aee = AnsibleBuilder(filename=path, build_context=str(tmp_path / 'bc'), tag=['my-ee:1.0'], platforms=['linux/arm64'])
+
+    command = aee.build_command
+    assert command[command.index('--platform') + 1] == 'linux/arm64'
+    assert command[command.index('-t') + 1] == 'my-ee:1.0'
+
+
+def test_multiple_platforms(exec_env_definition_file, tmp_path, do_not_run_commands):
+    do_not_run_commands.return_value = (0, [])
+    path = exec_env_definition_file(content={'version': 1})
+    aee = AnsibleBuilder(filename=path, build_context=str(tmp_path / 'bc'), tag=['quay.io/org/my-ee'],
+                         container_runtime='podman', platforms=['linux/amd64', 'linux/arm64'])
+
+    assert aee.build()
+
+    commands = [call.args[0] for call in do_not_run_commands.call_args_list]
+    builds = [command for command in commands if command[1] == 'build']
+    # Builds run at once, in any order
+    assert sorted(command[command.index('--platform') + 1] for command in builds) == ['linux/amd64', 'linux/arm64']
+    assert sorted(command[command.index('-t') + 1] for command in builds) == [
+        'quay.io/org/my-ee:latest-linux-amd64', 'quay.io/org/my-ee:latest-linux-arm64'
+    ]
+    assert commands[-3:] == [
+        ['podman', 'manifest', 'create', 'quay.io/org/my-ee'],
+        ['podman', 'manifest', 'add', 'quay.io/org/my-ee', 'containers-storage:quay.io/org/my-ee:latest-linux-amd64'],
+        ['podman', 'manifest', 'add', 'quay.io/org/my-ee', 'containers-storage:quay.io/org/my-ee:latest-linux-arm64'],
+    ]
+    assert [result.name for result in aee.platform_results] == ['linux/amd64', 'linux/arm64']
+    assert sorted(span.attributes['platform'] for span in aee.timings.spans if span.name == 'build.platform') == [
+        'linux/amd64', 'linux/arm64'
+    ]
+
+
+def test_multiple_platforms_failure(exec_env_definition_file, tmp_path, do_not_run_commands):
+    do_not_run_commands.side_effect = lambda command, **kwargs: (1 if 'linux/arm64' in command else 0, ['exec format error'])
+    path = exec_env_definition_file(content={'version': 1})
+    aee = AnsibleBuilder(filename=path, build_context=str(tmp_path / 'bc'), tag=['my-ee'],
+                         container_runtime='podman', platforms=['linux/amd64', 'linux/arm64'])
+
+    with pytest.raises(SystemExit):
+        aee.build()
+    assert not any('manifest' in call.args[0] for call in do_not_run_commands.call_args_list)
+    assert [result.succeeded for result in aee.platform_results] == [True, False]
+
+
+def test_prefetch_collections(exec_env_definition_file, galaxy_requirements_file, tmp_path, do_not_run_commands, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+
+    def download(command, **kwargs):
+        path = command[command.index('--download-path') + 1]
+        (pathlib.Path(path) / 'community-general-5.0.0.tar.gz').write_text('tarball')
+        return (0, [])
+
+    do_not_run_commands.side_effect = download
+    galaxy_path = galaxy_requirements_file({'collections': ['community.general']})
+    path = exec_env_definition_file(content={'version': 1, 'dependencies': {'galaxy': str(galaxy_path)}})
+    aee = AnsibleBuilder(filename=path, build_context=str(tmp_path / 'bc'), prefetch_collections=True, split_context=True)
+    aee.create()
+
+    command = do_not_run_commands.call_args.args[0]
+    assert command[:3] == ['ansible-galaxy', 'collection', 'download']
+
+    collections_dir = tmp_path / 'bc' / constants.user_content_subfolder / 'collections'
+    assert (collections_dir / 'community-general-5.0.0.tar.gz').read_text() == 'tarball'
+    assert yaml.safe_load((collections_dir / 'requirements.yml').read_text()) == {
+        'collections': [{'name': '/build/collections/community-general-5.0.0.tar.gz', 'type': 'file'}]
+    }
+    with open(aee.containerfile.path) as f:
+        content = f.read()
+    assert f'ADD {constants.user_content_subfolder}/collections collections' in content
+    assert '-r collections/requirements.yml --no-deps' in content
+
+
+def test_prefetch_collections_with_keyring(exec_env_definition_file, tmp_path):
+    path = exec_env_definition_file(content={'version': 1})
+    with pytest.raises(ValueError):
+        AnsibleBuilder(filename=path, prefetch_collections=True, galaxy_keyring='keyring.gpg')
+
+
+def test_prune_context(exec_env_definition_file, tmp_path):
+    requirements = tmp_path / 'requirements.txt'
+    requirements.write_text('foo\n')
+    path = exec_env_definition_file(content={'version': 1, 'dependencies': {'python': str(requirements)}})
+    build_context = tmp_path / 'bc'
+    aee = AnsibleBuilder(filename=path, build_context=str(build_context), container_runtime='podman', prune_context=True)
+    aee.create()
+
+    build_dir = build_context / constants.user_content_subfolder
+    assert (build_dir / 'requirements.txt').exists()
+    assert (build_context / '.containerignore').read_text().splitlines()[1:] == [constants.context_manifest_name]
+
+    # Files the user added, and the ones the additional build steps copy, are kept
+    (build_dir / 'extra.sh').write_text('echo')
+    (build_context / 'notes.txt').write_text('notes')
+    path.write_text(yaml.safe_dump({'version': 1, 'additional_build_steps': {'append': ['COPY _build/extra.sh /tmp/']}}))
+    aee = AnsibleBuilder(filename=path, build_context=str(build_context), container_runtime='docker', prune_context=True)
+    aee.create()
+
+    assert not (build_dir / 'requirements.txt').exists()
+    assert (build_dir / 'extra.sh').exists()
+    assert (build_context / 'notes.txt').exists()
+    # Files written for podman are left out of the build context
+    assert (build_context / '.dockerignore').read_text().splitlines()[1:] == [
+        constants.context_manifest_name, '.containerignore', 'Containerfile'
+    ]
+
+
+def test_no_prune_context(exec_env_definition_file, tmp_path):
+    requirements = tmp_path / 'requirements.txt'
+    requirements.write_text('foo\n')
+    path = exec_env_definition_file(content={'version': 1, 'dependencies': {'python': str(requirements)}})
+    build_context = tmp_path / 'bc'
+    AnsibleBuilder(filename=path, build_context=str(build_context), container_runtime='podman').create()
+
+    path.write_text(yaml.safe_dump({'version': 1}))
+    AnsibleBuilder(filename=path, build_context=str(build_context), container_runtime='podman').create()
+
+    assert (build_context / constants.user_content_subfolder / 'requirements.txt').exists()
+    assert not (build_context / '.containerignore').exists()
+
+
+def test_prune_context_user_ignore_file(exec_env_definition_file, tmp_path):
+    path = exec_env_definition_file(content={'version': 1})
+    build_context = tmp_path / 'bc'
+    build_context.mkdir()
+    (build_context / '.containerignore').write_text('secrets\n')
+    aee = AnsibleBuilder(filename=path, build_context=str(build_context), container_runtime='podman', prune_context=True)
+    aee.create()
+
+    assert (build_context / '.containerignore').read_text() == 'secrets\n'
+
+
+def test_prune_context_sizes(exec_env_definition_file, tmp_path):
+    path = exec_env_definition_file(content={'version': 1})
+    aee = AnsibleBuilder(filename=path, build_context=str(tmp_path / 'bc'), container_runtime='docker')
+    aee.create()
+    (tmp_path / 'bc' / 'Containerfile').write_bytes(b'x' * 4096)
+    aee.containerfile.manifest.record(str(tmp_path / 'bc' / 'Containerfile'))
+    aee.containerfile.manifest.save()
+
+    aee = AnsibleBuilder(filename=path, build_context=str(tmp_path / 'bc'), container_runtime='docker')
+    aee.containerfile.create_folder_copy_files()
+    aee._render_containerfile()
+    size_before, size_sent = aee.containerfile.prune_context()
+    assert size_before > size_sent + 4096
+    assert 'Containerfile' in (tmp_path / 'bc' / '.dockerignore').read_text().splitlines()
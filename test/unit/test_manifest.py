@@ -0,0 +1,76 @@
+import os
+
+from ansible_builder.manifest import ContextManifest, text_digest
+
+
+def test_record_and_save(tmp_path):
+    source = tmp_path / 'source.txt'
+    source.write_text('foo\n')
+    context = tmp_path / 'context'
+    context.mkdir()
+    dest = context / 'dest.txt'
+    dest.write_text('foo\n')
+
+    manifest = ContextManifest(str(context))
+    assert not manifest.is_current(str(dest), source=str(source))
+    manifest.record(str(dest), source=str(source))
+    assert manifest.save()
+
+    manifest = ContextManifest(str(context))
+    assert manifest.is_current(str(dest), source=str(source))
+    assert not manifest.save()  # nothing changed, do not rewrite
+
+    source.write_text('bar\n')
+    assert not manifest.is_current(str(dest), source=str(source))
+
+
+def test_digest_mismatch(tmp_path):
+    dest = tmp_path / 'Containerfile'
+    dest.write_text('FROM foo\n')
+
+    manifest = ContextManifest(str(tmp_path))
+    manifest.record(str(dest), digest=text_digest('FROM foo\n'))
+
+    assert manifest.is_current(str(dest), digest=text_digest('FROM foo\n'))
+    assert not manifest.is_current(str(dest), digest=text_digest('FROM bar\n'))
+
+    os.utime(dest, ns=(0, 0))
+    assert not manifest.is_current(str(dest), digest=text_digest('FROM foo\n'))
+
+
+def test_copy_touched_source(tmp_path):
+    source = tmp_path / 'source.txt'
+    source.write_text('foo\n')
+    context = tmp_path / 'context'
+    context.mkdir()
+    dest = context / 'dest.txt'
+
+    manifest = ContextManifest(str(context))
+    assert manifest.copy(str(source), str(dest))
+    dest_mtime = os.stat(dest).st_mtime_ns
+
+    # Same content, the digest shows there is no need to copy again
+    os.utime(source, ns=(0, 0))
+    assert not manifest.copy(str(source), str(dest))
+    assert os.stat(dest).st_mtime_ns == dest_mtime
+    assert manifest.is_current(str(dest), source=str(source))
+
+    source.write_text('bar\n')
+    assert manifest.copy(str(source), str(dest))
+    assert dest.read_text() == 'bar\n'
+
+
+def test_write_over_hardlink(tmp_path):
+    source = tmp_path / 'requirements.yml'
+    source.write_text('collections: []\n')
+    context = tmp_path / 'context'
+    context.mkdir()
+    dest = context / 'requirements.yml'
+
+    manifest = ContextManifest(str(context), staging='hardlink')
+    manifest.copy(str(source), str(dest))
+    assert os.path.samefile(source, dest)
+
+    manifest.write(str(dest), 'roles: []\n')
+    assert dest.read_text() == 'roles: []\n'
+    assert source.read_text() == 'collections: []\n'
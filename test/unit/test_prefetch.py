@@ -0,0 +1,72 @@
+import os
+
+import pytest
+import yaml
+
+from ansible_builder.prefetch import CollectionCache, fetch_collections, requirements_are_pinned
+
+
+@pytest.mark.parametrize('collections, pinned', [
+    ([{'name': 'community.general', 'version': '5.0.0'}, 'ansible.utils:2.1.0'], True),
+    ([{'name': 'community.general', 'version': '==5.0.0'}], True),
+    ([{'name': 'community.general', 'version': '>=5.0.0'}], False),
+    (['community.general'], False),
+    ([{'name': 'https://github.com/org/repo.git', 'type': 'git', 'version': '1.0.0'}], False),
+    ([{'name': 'https://github.com/org/repo.git', 'type': 'git', 'version': 'a' * 40}], True),
+    (['git+https://github.com/org/repo.git,' + 'a' * 40], True),
+    (['git+https://github.com/org/repo.git,main'], False),
+    ([{'name': 'https://example.com/ns-name-1.0.0.tar.gz', 'type': 'url', 'version': '1.0.0'}], False),
+    ([{'name': 'https://example.com/ns-name-1.0.0.tar.gz', 'version': '1.0.0'}], False),
+    ([{'name': './ns-name-1.0.0.tar.gz', 'type': 'file', 'version': '1.0.0'}], False),
+    (['./ns-name-1.0.0.tar.gz'], False),
+])
+def test_requirements_are_pinned(collections, pinned):
+    assert requirements_are_pinned({'collections': collections, 'roles': []}) is pinned
+
+
+@pytest.fixture
+def downloads():
+    calls = []
+
+    def download(path):
+        calls.append(path)
+        for filename in ('community-general-5.0.0.tar.gz', 'ansible-utils-2.1.0.tar.gz'):
+            with open(os.path.join(path, filename), 'w') as f:
+                f.write(filename)
+        with open(os.path.join(path, 'requirements.yml'), 'w') as f:
+            f.write('collections: []\n')
+
+    download.calls = calls
+    return download
+
+
+def test_fetch_pinned_collections(tmp_path, downloads):
+    requirements = tmp_path / 'requirements.yml'
+    requirements.write_text(yaml.safe_dump({'collections': [{'name': 'community.general', 'version': '5.0.0'}]}))
+    cache = CollectionCache(str(tmp_path / 'cache'))
+
+    tarballs = fetch_collections(str(requirements), cache, downloads)
+    assert [filename for filename, path in tarballs] == ['ansible-utils-2.1.0.tar.gz', 'community-general-5.0.0.tar.gz']
+    for filename, path in tarballs:
+        assert path.startswith(cache.blobs_dir)
+        with open(path) as f:
+            assert f.read() == filename
+
+    # The same requirements are taken from the cache
+    assert fetch_collections(str(requirements), cache, downloads) == tarballs
+    assert len(downloads.calls) == 1
+
+    # Other galaxy options may give other tarballs
+    fetch_collections(str(requirements), cache, downloads, cache_key_extra='--pre')
+    assert len(downloads.calls) == 2
+
+
+def test_fetch_unpinned_collections(tmp_path, downloads):
+    requirements = tmp_path / 'requirements.yml'
+    requirements.write_text(yaml.safe_dump({'collections': ['community.general']}))
+    cache = CollectionCache(str(tmp_path / 'cache'))
+
+    first = fetch_collections(str(requirements), cache, downloads)
+    assert fetch_collections(str(requirements), cache, downloads) == first
+    assert len(downloads.calls) == 2
+    assert len(os.listdir(cache.blobs_dir)) == 2
@@ -1,11 +1,14 @@
-from ansible_builder.requirements import sanitize_requirements
+import pytest
+
+from ansible_builder.exceptions import RequirementConflictError
+from ansible_builder.requirements import safe_name, sanitize_requirements
 
 
 def test_combine_entries():
     assert sanitize_requirements({
         'foo.bar': ['foo>1.0'],
         'bar.foo': ['foo>=2.0']
-    }) == ['foo>1.0,>=2.0  # from collection foo.bar,bar.foo']
+    }) == ['foo>=2.0  # from collection foo.bar,bar.foo']
 
 
 def test_remove_unwanted_requirements():
@@ -56,3 +59,88 @@ def test_sanitize_requirements_do_not_exclude():
         'pytest  # from collection user',
         'zoo  # from collection user',
     ]
+
+
+def test_combine_many_entries():
+    reqs = {
+        f'ns.col{i}': [f'pkg{j}>={i}' for j in range(50)]
+        for i in range(3)
+    }
+
+    assert sanitize_requirements(reqs) == [
+        f'pkg{j}>=2  # from collection ns.col0,ns.col1,ns.col2'
+        for j in range(50)
+    ]
+
+
+def test_safe_name():
+    assert safe_name('python_dateutil') == 'python-dateutil'
+    assert safe_name('zope.interface') == 'zope.interface'
+    assert safe_name('foo__-bar') == 'foo-bar'
+
+
+@pytest.mark.parametrize('specs, expected', [
+    (['>=1.0,<3', '>=2.0'], '>=2.0,<3'),
+    (['>1.0', '>=1.0'], '>1.0'),
+    (['<=2', '<2'], '<2'),
+    (['~=1.4.2', '<1.4.8'], '>=1.4.2,<1.4.8'),
+    (['>=1.0,<=1.0'], '==1.0'),
+    (['==1.5', '>=1.0,<2'], '==1.5'),
+    (['>=1.0,!=1.2,!=0.9', '!=1.2'], '>=1.0,!=1.2'),
+    (['==1.*', '==1.*'], '==1.*'),
+    (['==1.*', '>=1.2'], '>=1.2,<2'),
+    (['==1.4.*', '!=1.4.2'], '==1.4.*,!=1.4.2'),
+    (['>=1.0', '!=2.*'], '>=1.0,!=2.*'),
+    (['===2.0', '>=1.5'], '===2.0'),
+])
+def test_simplify_specifiers(specs, expected):
+    reqs = {f'ns.col{i}': [f'foo{spec}'] for i, spec in enumerate(specs)}
+    assert sanitize_requirements(reqs) == [
+        f'foo{expected}  # from collection {",".join(reqs)}'
+    ]
+
+
+def test_arbitrary_equality_kept():
+    assert sanitize_requirements({
+        'foo.bar': ['foo===2.0-custom'],
+        'bar.foo': ['foo===2.0-custom'],
+    }) == ['foo===2.0-custom  # from collection foo.bar,bar.foo']
+
+
+def test_arbitrary_equality_unverifiable():
+    with pytest.raises(RequirementConflictError) as exc:
+        sanitize_requirements({
+            'foo.bar': ['foo>=1.0'],
+            'bar.foo': ['foo===2.0-custom,>=1.5'],
+        })
+    assert "Cannot verify the requirements for Python package 'foo'" in exc.value.msg
+    assert "'foo===2.0-custom' from collection bar.foo" in exc.value.msg
+
+
+@pytest.mark.parametrize('specs, message', [
+    (['>=2.0', '<1.5'], "'foo>=2.0' from collection ns.col0 and 'foo<1.5' from collection ns.col1"),
+    (['>1.0', '<=1.0'], "'foo>1.0' from collection ns.col0 and 'foo<=1.0' from collection ns.col1"),
+    (['==1.0', '==2.0'], "'foo==1.0' from collection ns.col0 and 'foo==2.0' from collection ns.col1"),
+    (['~=1.4', '>=2'], "'foo>=2' from collection ns.col1 and 'foo~=1.4' from collection ns.col0"),
+    (['==1.*', '>=2'], "'foo>=2' from collection ns.col1 and 'foo==1.*' from collection ns.col0"),
+    (['==1.5', '==2.*'], "'foo==1.5' from collection ns.col0 and 'foo==2.*' from collection ns.col1"),
+    (['>=1.2,<1.5', '!=1.*'], "'foo>=1.2' from collection ns.col0 and 'foo!=1.*' from collection ns.col1"),
+])
+def test_conflicting_specifiers(specs, message):
+    reqs = {f'ns.col{i}': [f'foo{spec}'] for i, spec in enumerate(specs)}
+    with pytest.raises(RequirementConflictError) as exc:
+        sanitize_requirements(reqs)
+    assert message in exc.value.msg
+
+
+def test_conflict_with_pin_from_bounds():
+    with pytest.raises(RequirementConflictError) as exc:
+        sanitize_requirements({'ns.a': ['foo<=2'], 'ns.b': ['foo>=2', 'foo!=2.0']})
+    assert "'foo==2' from collections ns.b, ns.a and 'foo!=2.0' from collection ns.b" in exc.value.msg
+
+
+def test_conflicts_ignored_for_excluded_requirements():
+    assert sanitize_requirements({
+        'foo.bar': ['ansible<2.9'],
+        'bar.foo': ['ansible>=2.10'],
+    }) == []
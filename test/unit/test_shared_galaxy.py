@@ -0,0 +1,107 @@
+import os
+
+import pytest
+import yaml
+
+from ansible_builder import constants
+from ansible_builder.batch import BatchBuilder
+from ansible_builder.shared_galaxy import common_requirements, load_galaxy_requirements, subtract_requirements
+
+
+def test_common_requirements():
+    first = {'collections': ['community.general', {'name': 'ansible.utils', 'version': '2.0.0'}], 'roles': ['geerlingguy.php']}
+    second = {'collections': [{'name': 'community.general'}, {'name': 'ansible.utils', 'version': '2.1.0'}], 'roles': []}
+
+    common = common_requirements([first, second])
+    assert common == {'collections': ['community.general'], 'roles': []}
+    assert subtract_requirements(second, common) == {
+        'collections': [{'name': 'ansible.utils', 'version': '2.1.0'}], 'roles': []
+    }
+
+
+def test_load_galaxy_requirements(tmp_path):
+    path = tmp_path / 'requirements.yml'
+    path.write_text('- geerlingguy.php\n')
+    assert load_galaxy_requirements(path) == {'collections': [], 'roles': ['geerlingguy.php']}
+    path.write_text('collections:\n  - community.general\n')
+    assert load_galaxy_requirements(path) == {'collections': ['community.general'], 'roles': []}
+
+
+@pytest.fixture
+def definitions(tmp_path):
+    def _write(name, collections, base_image=None):
+        folder = tmp_path / name
+        folder.mkdir()
+        (folder / 'requirements.yml').write_text(yaml.safe_dump({'collections': collections}))
+        definition = {'version': 1, 'dependencies': {'galaxy': 'requirements.yml'}}
+        if base_image:
+            definition['build_arg_defaults'] = {'EE_BASE_IMAGE': base_image}
+        path = folder / 'execution-environment.yml'
+        path.write_text(yaml.safe_dump(definition))
+        return str(path)
+
+    return [
+        _write('first', ['community.general', 'ansible.utils']),
+        _write('second', ['community.general', 'ansible.netcommon']),
+        _write('other', ['community.general', 'ansible.utils'], base_image='quay.io/org/other:latest'),
+    ]
+
+
+def test_shared_galaxy_build(definitions, tmp_path, mocker):
+    run_command = mocker.patch('ansible_builder.drivers.run_command', return_value=(0, []))
+    batch = BatchBuilder(definitions, build_context=str(tmp_path / 'bc'), container_runtime='podman', shared_galaxy=True)
+
+    assert batch.build()
+    assert len(batch.shared_images) == 1
+    image = batch.shared_images[0]
+    assert sorted(os.path.basename(builder.build_context) for builder in image.builders) == ['first', 'second']
+
+    # The shared image is built before the definitions using it
+    built = [call.args[0][call.args[0].index('-t') + 1] for call in run_command.call_args_list]
+    assert built[0] == image.tag
+
+    with open(os.path.join(image.build_context, constants.user_content_subfolder, 'requirements.yml')) as f:
+        assert yaml.safe_load(f) == {'collections': ['community.general'], 'roles': []}
+    with open(image.containerfile_path) as f:
+        assert 'ansible-galaxy collection install' in f.read()
+
+    for name, collections in (('first', ['ansible.utils']), ('second', ['ansible.netcommon'])):
+        builder = batch.builders[name]
+        with open(builder.containerfile.path) as f:
+            assert f'FROM {image.tag} as galaxy' in f.read()
+        with open(os.path.join(builder.build_outputs_dir, 'requirements.yml')) as f:
+            assert yaml.safe_load(f) == {'collections': collections, 'roles': []}
+
+    with open(batch.builders['other'].containerfile.path) as f:
+        assert 'FROM $EE_BASE_IMAGE as galaxy' in f.read()
+    assert len(batch.summary()) == 5
+
+
+def test_failed_shared_galaxy_build(definitions, tmp_path, mocker):
+    run_command = mocker.patch('ansible_builder.drivers.run_command', return_value=(1, []))
+    batch = BatchBuilder(definitions, build_context=str(tmp_path / 'bc'), container_runtime='podman', shared_galaxy=True)
+
+    assert not batch.build()
+    # Only the shared image and the definition not using it were built
+    assert run_command.call_count == 2
+    assert [result.succeeded for result in batch.results] == [False] * 4
+
+
+def test_shared_galaxy_build_options(definitions, tmp_path):
+    batch = BatchBuilder(definitions, build_context=str(tmp_path / 'bc'), container_runtime='podman', shared_galaxy=True,
+                         build_args={'EE_BASE_IMAGE': 'quay.io/org/base:1'}, no_cache=True,
+                         cache_from=['quay.io/org/cache-{name}'], cache_to='quay.io/org/cache-{name}')
+    batch.create()
+
+    image = batch.shared_images[0]
+    assert len(image.builders) == 3
+    command = image.build_command
+    assert '--build-arg=EE_BASE_IMAGE=quay.io/org/base:1' in command
+    assert '--no-cache' in command
+    assert command[command.index('--cache-from') + 1] == f'quay.io/org/cache-{image.name}'
+    assert command[command.index('--cache-to') + 1] == f'quay.io/org/cache-{image.name}'
+
+
+def test_shared_galaxy_buildx(definitions, tmp_path):
+    with pytest.raises(ValueError, match='--shared-galaxy may not be set with the buildx build driver'):
+        BatchBuilder(definitions, build_context=str(tmp_path / 'bc'), build_driver='buildx', shared_galaxy=True)
@@ -2,7 +2,7 @@ import pytest
 import textwrap
 
 from ansible_builder import constants
-from ansible_builder.steps import AdditionalBuildSteps, GalaxyInstallSteps
+from ansible_builder.steps import AdditionalBuildSteps, ContextFileSteps, GalaxyInstallSteps
 
 
 @pytest.mark.parametrize('verb', ['prepend', 'append'])
@@ -65,3 +65,22 @@ def test_galaxy_install_steps_with_ignore_code():
         f"--ignore-signature-status-code {codes[1]} --keyring \"{constants.default_keyring_name}\""
     ]
     assert steps == expected
+
+
+def test_context_file_steps():
+    steps = list(ContextFileSteps(['requirements.yml', constants.default_keyring_name]))
+    assert steps == [
+        "WORKDIR /build",
+        f"ADD {constants.user_content_subfolder}/requirements.yml requirements.yml",
+        f"ADD {constants.user_content_subfolder}/{constants.default_keyring_name} {constants.default_keyring_name}",
+        "",
+    ]
+
+
+def test_galaxy_install_steps_with_cache_mounts():
+    steps = list(GalaxyInstallSteps("requirements.txt", None, [], None, cache_mounts=True))
+    target, _ = constants.CACHE_MOUNTS['galaxy']
+    assert steps[1].startswith(
+        f"RUN --mount=type=cache,id=ansible-builder-galaxy,target={target},sharing=locked "
+        "ANSIBLE_GALAXY_DISABLE_GPG_VERIFY=1 ansible-galaxy collection install"
+    )
@@ -0,0 +1,70 @@
+import pytest
+
+from ansible_builder.system_requirements import sanitize_system_requirements
+
+
+def test_merge_covered_entries():
+    assert sanitize_system_requirements({
+        'foo.bar': ['gcc [compile]', 'make  # build tool', '# comment'],
+        'bar.foo': ['gcc [platform:rpm compile]', 'make'],
+        'baz.foo': ['gcc'],
+    }) == [
+        'gcc  # from collection foo.bar, bar.foo, baz.foo',
+        'make  # from collection foo.bar, bar.foo',
+    ]
+
+
+@pytest.mark.parametrize('lines, expected', [
+    (['libxml2 [platform:rpm]', 'libxml2 [platform:dpkg]'], 'libxml2 [platform:rpm platform:dpkg]'),
+    (['libxml2 [test platform:rpm]', 'libxml2 [doc platform:rpm]'], 'libxml2 [platform:rpm test doc]'),
+    (['libxml2 [!platform:centos-7 platform:rpm]', 'libxml2 [platform:dpkg !platform:centos-7]'],
+     'libxml2 [platform:rpm platform:dpkg !platform:centos-7]'),
+    (['libxml2 [(platform:rpm test)]', 'libxml2 [(platform:rpm test)]'], 'libxml2 [(platform:rpm test)]'),
+])
+def test_union_selectors(lines, expected):
+    reqs = {f'ns.col{i}': [line] for i, line in enumerate(lines)}
+    assert sanitize_system_requirements(reqs) == [f'{expected}  # from collection {", ".join(reqs)}']
+
+
+@pytest.mark.parametrize('lines', [
+    # Different profiles and platforms, the union would also match libxml2 [platform:dpkg test]
+    ['libxml2 [platform:rpm test]', 'libxml2 [platform:dpkg doc]'],
+    # Different negative selectors
+    ['libxml2 [platform:rpm !platform:centos-7]', 'libxml2 [platform:dpkg]'],
+    # Different versions
+    ['libxml2 >=2.9', 'libxml2 <2.9'],
+    ['libxml2 [(platform:rpm test)]', 'libxml2 [platform:rpm]'],
+])
+def test_entries_not_merged(lines):
+    reqs = {f'ns.col{i}': [line] for i, line in enumerate(lines)}
+    assert sanitize_system_requirements(reqs) == [
+        f'{line}  # from collection ns.col{i}' for i, line in enumerate(lines)
+    ]
+
+
+def test_merged_entry_merges_again():
+    assert sanitize_system_requirements({
+        'foo.bar': ['libxml2 [platform:rpm]', 'libxml2 [platform:dpkg test]'],
+        'bar.foo': ['libxml2 [platform:dpkg]'],
+    }) == ['libxml2 [platform:rpm platform:dpkg]  # from collection foo.bar, bar.foo']
+
+
+def test_drop_entries_for_other_platforms():
+    platforms = ['platform:rpm', 'platform:redhat', 'platform:centos', 'platform:centos-8']
+    assert sanitize_system_requirements({
+        'foo.bar': ['libxml2 [platform:rpm]', 'libxml2-dev [platform:dpkg]', 'gcc [platform:centos-7]'],
+        'bar.foo': ['libxml2', 'python3-devel [platform:rpm !platform:centos-8] >=3.6', 'make [platform:rpm test]'],
+    }, platforms=platforms) == [
+        'libxml2  # from collection foo.bar, bar.foo',
+        'make [test]  # from collection bar.foo',
+    ]
+
+
+def test_unrecognized_lines_kept():
+    assert sanitize_system_requirements({
+        'foo.bar': ['gcc', 'not a bindep line!'],
+        'bar.foo': ['not a bindep line!'],
+    }) == [
+        'gcc  # from collection foo.bar',
+        'not a bindep line!  # from collection foo.bar, bar.foo',
+    ]
@@ -0,0 +1,55 @@
+import json
+
+import pytest
+
+from ansible_builder import cli
+from ansible_builder.cli import parse_args, run
+from ansible_builder.main import AnsibleBuilder
+from ansible_builder.timings import Timings
+
+
+def test_nested_spans(tmp_path):
+    timings = Timings()
+    with timings.span('outer') as outer:
+        with timings.span('inner', step=1) as inner:
+            pass
+
+    assert inner.parent_id == outer.span_id
+    assert outer.parent_id is None
+    assert outer.duration >= inner.duration
+
+    report = timings.report()
+    assert [span['name'] for span in report['spans']] == ['outer', 'inner']
+    assert report['spans'][1]['attributes'] == {'step': 1}
+
+    trace_file = tmp_path / 'trace.jsonl'
+    timings.export_spans(trace_file)
+    spans = [json.loads(line) for line in trace_file.read_text().splitlines()]
+    assert [span['name'] for span in spans] == ['outer', 'inner']
+    assert spans[1]['parentSpanId'] == spans[0]['spanId']
+    assert spans[1]['traceId'] == spans[0]['traceId'] == timings.trace_id
+    assert spans[1]['attributes'] == [{'key': 'step', 'value': {'stringValue': '1'}}]
+    assert spans[0]['endTimeUnixNano'] >= spans[0]['startTimeUnixNano']
+
+
+def test_timings_report(exec_env_definition_file, tmp_path):
+    path = exec_env_definition_file(content={'version': 1})
+    report_file = tmp_path / 'timings.json'
+    aee = AnsibleBuilder(filename=path, build_context=str(tmp_path / 'bc'), timings=str(report_file))
+    aee.build()
+    aee.write_timings()
+
+    names = [span['name'] for span in json.loads(report_file.read_text())['spans']]
+    assert names == ['definition.load', 'definition.validate', 'context.copy', 'containerfile.render', 'build']
+
+
+def test_introspect_timings(data_dir, tmp_path, monkeypatch):
+    report_file = tmp_path / 'timings.json'
+    args = parse_args(['introspect', '--sanitize', '--timings', str(report_file), str(data_dir)])
+    monkeypatch.setattr(cli, 'parse_args', lambda: args)
+    with pytest.raises(SystemExit) as exc:
+        run()
+    assert exc.value.code == 0
+
+    names = [span['name'] for span in json.loads(report_file.read_text())['spans']]
+    assert names == ['introspect.collections', 'introspect.sanitize']
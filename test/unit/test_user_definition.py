@@ -48,9 +48,23 @@ class TestUserDefinition:
             "{'version': 1, 'foo': 'bar'}",
             "Error: Unknown yaml key(s), {'foo'}, found in the definition file."
         ),
+        (
+            "{'version': 1, 'dependencies': {'wheels': 'foo/not-exists'}}",
+            'not-exists does not exist'
+        ),  # missing wheels directory
+        (
+            "{'version': 1, 'dependencies': {'wheels': {'no_index': True}}}",
+            "Expected a 'path' key in 'dependencies.wheels'."
+        ),
+        (
+            "{'version': 1, 'dependencies': {'wheels': ['foo']}}",
+            "Expected 'dependencies.wheels' to be a directory, or a dictionary with keys 'path' "
+            "and 'no_index'; found a list instead."
+        ),
     ], ids=[
         'integer', 'missing_file', 'additional_steps_format', 'additional_unknown',
-        'build_args_value_type', 'unexpected_build_arg', 'config_type', 'unknown_key'
+        'build_args_value_type', 'unexpected_build_arg', 'config_type', 'unknown_key',
+        'missing_wheels', 'wheels_path', 'wheels_type'
     ])
     def test_yaml_error(self, exec_env_definition_file, yaml_text, expect):
         path = exec_env_definition_file(yaml_text)
@@ -4,7 +4,7 @@ import shutil
 
 import pytest
 
-from ansible_builder.utils import write_file, copy_file, run_command
+from ansible_builder.utils import write_file, copy_file, run_command, detect_container_runtime, stage_file
 
 
 def test_write_file(tmp_path):
@@ -55,6 +55,25 @@ def test_copy_touched_file(dest_file, source_file):
     assert not copy_file(source_file, dest_file)
 
 
+def test_stage_file_hardlink(tmp_path, source_file):
+    dest = tmp_path / 'linked.txt'
+    dest.write_text('old')
+    assert stage_file(str(source_file), str(dest), 'hardlink') == 'hardlink'
+    assert os.path.samefile(source_file, dest)
+    assert not copy_file(source_file, dest, 'hardlink')
+
+
+def test_stage_file_fallback(mocker, tmp_path, source_file):
+    mocker.patch('ansible_builder.utils.os.link', side_effect=OSError(18, 'Invalid cross-device link'))
+    mocker.patch('ansible_builder.utils._reflink', side_effect=OSError(95, 'Operation not supported'))
+    dest = tmp_path / 'copied.txt'
+    assert stage_file(str(source_file), str(dest), 'auto') == 'copy'
+    assert not os.path.samefile(source_file, dest)
+    assert dest.read_text() == 'foo\nbar\n'
+    assert os.stat(dest).st_mtime_ns == os.stat(source_file).st_mtime_ns
+    assert not list(tmp_path.glob('*.tmp'))
+
+
 @pytest.mark.run_command
 def test_failed_command(mocker):
     mocker.patch('ansible_builder.utils.subprocess.Popen.wait', return_value=1)
@@ -101,3 +120,34 @@ def test_invalid_docker_command(caplog, mocker):
 
     assert 'You do not have docker installed' in record.msg
     assert 'podman: not installed, docker: not installed' in record.msg
+
+
+@pytest.mark.run_command
+def test_run_command_log_file(tmp_path):
+    log_file = tmp_path / 'build.log'
+    rc, out = run_command(
+        ['python', '-c', 'for i in range(5000): print("line", i)'],
+        capture_output=True, stream_output=True, log_file=str(log_file), max_output_lines=10,
+    )
+
+    assert rc == 0
+    assert out == [f'line {i}' for i in range(4990, 5000)]
+    assert log_file.read_text().splitlines() == [f'line {i}' for i in range(5000)]
+
+
+@pytest.mark.run_command
+def test_run_command_multibyte_output():
+    # Multi-byte characters may be split across chunk boundaries
+    rc, out = run_command(
+        ['python', '-c', 'import sys; sys.stdout.buffer.write("\\u00e9".encode("utf-8") * 70000)'],
+        capture_output=True,
+    )
+
+    assert out == ['é' * 70000]
+
+
+def test_detect_container_runtime(mocker):
+    which = mocker.patch('ansible_builder.utils.shutil.which', return_value='/usr/bin/podman')
+    assert detect_container_runtime() == 'podman'
+    which.return_value = None
+    assert detect_container_runtime() == 'docker'